@@ -0,0 +1,36 @@
+"""Add crawlerrecord dedup columns.
+
+Revision ID: 862abda9f140
+Revises: 4d732a7d010f
+Create Date: 2026-10-18 10:03:17.884129
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '862abda9f140'
+down_revision: Union[str, None] = '4d732a7d010f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column('crawlerrecord', sa.Column('canonical_url', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+    op.add_column('crawlerrecord', sa.Column('content_hash', sqlmodel.sql.sqltypes.AutoString(), nullable=True))
+    # added without the foreign key constraint so that SQLite doesn't have to copy the whole table
+    op.add_column('crawlerrecord', sa.Column('duplicate_of_id', sa.Integer(), nullable=True))
+    op.create_index('ix_crawlerrecord_school_id_content_hash', 'crawlerrecord', ['school_id', 'content_hash'],
+                    unique=True, sqlite_where=sa.text('duplicate_of_id IS NULL'))
+    # run `python -m cps_childcare.dedup` afterwards to fill these in for existing rows
+
+
+def downgrade() -> None:
+    op.drop_index('ix_crawlerrecord_school_id_content_hash', table_name='crawlerrecord')
+    op.drop_column('crawlerrecord', 'duplicate_of_id')
+    op.drop_column('crawlerrecord', 'content_hash')
+    op.drop_column('crawlerrecord', 'canonical_url')
@@ -0,0 +1,127 @@
+"""
+Benchmark of the pending-work queries in cps_childcare/queries.py on synthetic crawls of increasing
+size, with and without the composite (school_id, page_url[, model, prompt_version]) and lineage
+indexes.  sqlite doesn't report planning on its own, so the planning time is the time to prepare and
+run EXPLAIN QUERY PLAN, and the execution time is the time to fetch every row.
+
+python benchmarks/pending_queries.py --sizes 1000 10000 100000 --plans
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import insert
+from sqlmodel import SQLModel, create_engine
+
+from cps_childcare.cps_data_models import (ChildcareOpenAIRecord, CrawlerOpenAIRecord, CrawlerRecord, CrawlerRecordContent,
+                                           Lineage)
+from cps_childcare.queries import care_pages_to_extract_query, pages_to_extract_query
+
+
+PAGES_PER_SCHOOL = 200
+# the share of the crawl 03 has already seen, and the share of those that mention before/after care
+EXTRACTED_SHARE = 0.8
+CARE_SHARE = 0.1
+REPEATS = 3
+
+NEW_INDEXES = {
+    CrawlerRecord: "ix_crawlerrecord_school_id_page_url",
+    CrawlerOpenAIRecord: "ix_crawleropenairecord_school_id_page_url",
+    ChildcareOpenAIRecord: "ix_childcareopenairecord_school_id_page_url",
+    Lineage: "ix_lineage_stage_school_id_page_url",
+}
+
+QUERIES = {
+    "03 pages_to_extract": pages_to_extract_query("gpt-4o-mini"),
+    "04 care_pages_to_extract": care_pages_to_extract_query("gpt-4o-mini", "v1", "v1"),
+}
+
+
+def populate(engine, n_pages: int, seed: int = 42):
+    rng = random.Random(seed)
+    now = datetime.now(timezone.utc)
+    pages, contents, results, care_results, lineage = [], [], [], [], []
+    for page_id in range(1, n_pages + 1):
+        school_id = page_id // PAGES_PER_SCHOOL
+        page_url = f"https://school{school_id}.example.org/page/{page_id}"
+        pages.append({"id": page_id, "index": page_id, "school_name": f"school {school_id}", "school_id": school_id,
+                      "school_type": "ES", "page_title": f"page {page_id}", "page_url": page_url, "description": None,
+                      "status_code": 200, "crawled_at": now, "content_hash": f"{page_id:064x}"})
+        contents.append({"crawler_record_id": page_id, "codec": "none", "markdown": b"x" * 2000})
+
+        if rng.random() < EXTRACTED_SHARE:
+            details = "Before care starts at 7:00am." if rng.random() < CARE_SHARE else ""
+            results.append({"school_id": school_id, "school_type": "ES", "page_url": page_url, "emails": "",
+                            "is_contact_page": False, "before_or_after_care_details": details,
+                            "openai_model_name": "gpt-4o-mini", "prompt_version": "v1", "created_at": now})
+            lineage.append(lineage_row(CrawlerOpenAIRecord, len(results), pages[-1], now))
+            # and 04 is halfway through those
+            if details and rng.random() < 0.5:
+                care_results.append({"school_id": school_id, "page_url": page_url, "provides_before_care": True,
+                                     "openai_model_name": "gpt-4o-mini", "prompt_version": "v1", "created_at": now})
+                lineage.append(lineage_row(ChildcareOpenAIRecord, len(care_results), pages[-1], now))
+
+    with engine.begin() as conn:
+        for model, rows in [(CrawlerRecord, pages), (CrawlerRecordContent, contents),
+                            (CrawlerOpenAIRecord, results), (ChildcareOpenAIRecord, care_results), (Lineage, lineage)]:
+            if rows:
+                conn.execute(insert(model.__table__), rows)
+
+
+def lineage_row(record_cls, record_id: int, page: dict, now: datetime) -> dict:
+    return {"stage": record_cls.__tablename__, "record_id": record_id, "school_id": page["school_id"],
+            "page_url": page["page_url"], "input_hash": page["content_hash"], "openai_model_name": "gpt-4o-mini",
+            "prompt_version": "v1", "created_at": now}
+
+
+def set_indexes(engine, enabled: bool):
+    for model, name in NEW_INDEXES.items():
+        index = next(index for index in model.__table__.indexes if index.name == name)
+        if enabled:
+            index.create(engine, checkfirst=True)
+        else:
+            index.drop(engine, checkfirst=True)
+    with engine.begin() as conn:
+        conn.exec_driver_sql("ANALYZE")
+
+
+def time_query(engine, query):
+    sql = str(query.compile(engine, compile_kwargs={"literal_binds": True}))
+    plan_times, execution_times = [], []
+    with engine.connect() as conn:
+        for _ in range(REPEATS):
+            start = time.perf_counter()
+            plan = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {sql}").fetchall()
+            planned = time.perf_counter()
+            n_rows = len(conn.exec_driver_sql(sql).fetchall())
+            plan_times.append(planned - start)
+            execution_times.append(time.perf_counter() - planned)
+    return plan, min(plan_times), min(execution_times), n_rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the pending-work queries against synthetic crawls.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000])
+    parser.add_argument("--plans", action="store_true", help="print the query plans for the largest size")
+    args = parser.parse_args()
+
+    print(f"{'pages':>8}  {'query':<26} {'indexes':<8} {'plan ms':>9} {'exec ms':>10} {'rows':>8}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in args.sizes:
+            engine = create_engine(f"sqlite:///{os.path.join(tmp_dir, f'bench_{size}.db')}")
+            SQLModel.metadata.create_all(engine)
+            populate(engine, size)
+
+            for enabled in [False, True]:
+                set_indexes(engine, enabled)
+                for name, query in QUERIES.items():
+                    plan, plan_time, execution_time, n_rows = time_query(engine, query)
+                    print(f"{size:>8}  {name:<26} {'yes' if enabled else 'no':<8} "
+                          f"{plan_time * 1000:>9.2f} {execution_time * 1000:>10.1f} {n_rows:>8}")
+                    if args.plans and size == max(args.sizes):
+                        for row in plan:
+                            print(f"{'':>12}{row[-1]}")
+            engine.dispose()
@@ -0,0 +1,118 @@
+"""
+Site-level boilerplate stripping.  Every page of an Edlio or WordPress school site repeats the
+same nav, footer and sidebar markdown, which inflates the LLM prompts and the embedded chunks.
+For each school we learn which markdown blocks repeat across most of the pages on each of its
+domains, store them in the `boilerplateblock` table, and save a `stripped_markdown` variant of
+every page with them taken out.  The site's home page keeps its full markdown so anything that
+only lives in the boilerplate (e.g. a sidebar blurb about after care) is still seen once.
+
+Run `python -m cps_childcare.boilerplate` to (re)strip every school.
+"""
+import hashlib
+import re
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+from sqlmodel import Session, delete, select
+
+from cps_childcare.content_store import field_update, has_markdown, load_contents
+from cps_childcare.cps_data_models import BoilerplateBlock, CrawlerRecord, CrawlerRecordContent
+
+
+# a block is boilerplate if it's on at least this share of a domain's pages...
+MIN_PAGE_FRACTION = 0.5
+# ...and on at least this many of them
+MIN_PAGES = 3
+
+
+def site_domain(url: str) -> str:
+    return (urlsplit(url).hostname or "").lower().removeprefix("www.")
+
+
+def split_blocks(markdown: str) -> list[str]:
+    return [block for block in re.split(r"\n\s*\n", markdown) if block.strip()]
+
+
+def block_hash(block: str) -> str:
+    return hashlib.sha256(re.sub(r"\s+", " ", block).strip().lower().encode()).hexdigest()
+
+
+def learn_boilerplate(markdowns: list[str]) -> dict[str, tuple[str, int]]:
+    """Returns {block hash: (block text, number of pages it's on)} for the repeated blocks."""
+    page_counts = defaultdict(int)
+    block_text = {}
+    for markdown in markdowns:
+        page_blocks = {}
+        for block in split_blocks(markdown):
+            page_blocks.setdefault(block_hash(block), block)
+        for digest, block in page_blocks.items():
+            block_text.setdefault(digest, block)
+            page_counts[digest] += 1
+
+    min_pages = max(MIN_PAGES, MIN_PAGE_FRACTION * len(markdowns))
+    return {digest: (block_text[digest], count) for digest, count in page_counts.items() if count >= min_pages}
+
+
+def strip_boilerplate(markdown: str, boilerplate_hashes) -> str:
+    return "\n\n".join(block for block in split_blocks(markdown) if block_hash(block) not in boilerplate_hashes)
+
+
+def content_markdown(page) -> str | None:
+    """The markdown that should go into prompts and embeddings for a page."""
+    return page.markdown if page.stripped_markdown is None else page.stripped_markdown
+
+
+def strip_school_boilerplate(session: Session, school_id: int) -> int:
+    pages = session.exec(
+        select(CrawlerRecord.id, CrawlerRecord.page_url)
+        .where(CrawlerRecord.school_id == school_id)
+        .where(has_markdown())
+    ).all()
+    contents = load_contents(session, [page.id for page in pages])
+
+    pages_by_domain = defaultdict(list)
+    for page in pages:
+        pages_by_domain[site_domain(page.page_url)].append(page)
+
+    session.exec(delete(BoilerplateBlock).where(BoilerplateBlock.school_id == school_id))
+
+    updates, blocks = [], []
+    chars_saved = 0
+    for domain, domain_pages in pages_by_domain.items():
+        boilerplate = learn_boilerplate([contents[page.id].markdown for page in domain_pages])
+        blocks.extend({"school_id": school_id, "domain": domain, "block_hash": digest,
+                       "page_count": count, "block_text": text}
+                      for digest, (text, count) in boilerplate.items())
+
+        home_page = min(domain_pages, key=lambda page: (len(urlsplit(page.page_url).path.strip("/")), page.id))
+        for page in domain_pages:
+            content = contents[page.id]
+            if page.id == home_page.id or not boilerplate:
+                stripped = content.markdown
+            else:
+                stripped = strip_boilerplate(content.markdown, boilerplate)
+            chars_saved += len(content.markdown) - len(stripped)
+            # no need to store a second copy of pages that didn't change
+            updates.append(field_update(content, "stripped_markdown",
+                                        stripped if stripped != content.markdown else None))
+
+    session.bulk_insert_mappings(BoilerplateBlock, blocks)
+    session.bulk_update_mappings(CrawlerRecordContent, updates)
+    return chars_saved
+
+
+def strip_all_schools(engine):
+    with Session(engine) as session:
+        school_ids = session.exec(select(CrawlerRecord.school_id).distinct()).all()
+
+    for num, school_id in enumerate(school_ids):
+        with Session(engine) as session:
+            chars_saved = strip_school_boilerplate(session, school_id)
+            session.commit()
+        print(f"{num} / {len(school_ids)}: stripped {chars_saved:,} characters of boilerplate for {school_id}")
+
+
+if __name__ == "__main__":
+    from cps_childcare.database import engine
+
+    strip_all_schools(engine)
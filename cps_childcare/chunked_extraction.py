@@ -0,0 +1,111 @@
+"""
+Map-reduce extraction for pages that are too big to send to the LLM in one prompt.  The page's
+markdown is split along its headers into windows of at most `WINDOW_TOKENS` tokens (sections that
+are too big on their own get split by paragraph, and then by tokens as a last resort), each window
+is extracted on its own, and the per-window responses are merged back into one response for the page.
+"""
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from cps_childcare.cps_data_models import ChildcareOpenAIResponse, CrawlerOpenAIResponse
+from cps_childcare.prompts import count_tokens, get_tokenizer, token_upper_bound
+
+
+MAX_PROMPT_TOKENS = 100_000
+# well under the prompt limit so that each window comes back quickly
+WINDOW_TOKENS = 32_000
+MAX_WORKERS = 8
+
+HEADER_PATTERN = re.compile(r"^#{1,6}\s", re.MULTILINE)
+
+
+def prompt_fits(prompt: str, model: str = "gpt-4o-mini", max_tokens: int = MAX_PROMPT_TOKENS) -> bool:
+    # only prompts that could be over the limit need to be tokenized
+    return token_upper_bound(prompt) <= max_tokens or count_tokens(prompt, model) <= max_tokens
+
+
+def split_sections(markdown: str) -> list[str]:
+    starts = [match.start() for match in HEADER_PATTERN.finditer(markdown)]
+    if not starts or starts[0] != 0:
+        starts = [0] + starts
+    return [markdown[start:end] for start, end in zip(starts, starts[1:] + [len(markdown)])]
+
+
+def split_paragraphs(text: str) -> list[str]:
+    return [paragraph for paragraph in re.split(r"(?<=\n\n)", text) if paragraph]
+
+
+def split_tokens(text: str, model: str, max_tokens: int) -> list[str]:
+    tokenizer = get_tokenizer(model)
+    tokens = tokenizer.encode_ordinary(text)
+    return [tokenizer.decode(tokens[start:start + max_tokens]) for start in range(0, len(tokens), max_tokens)]
+
+
+def pack(pieces: list[str], model: str, max_tokens: int, split_piece) -> list[str]:
+    """Greedily pack consecutive pieces into windows, splitting up any piece that's too big by itself."""
+    windows, current, current_tokens = [], [], 0
+    for piece in pieces:
+        n_tokens = count_tokens(piece, model)
+        if n_tokens > max_tokens:
+            if current:
+                windows.append("".join(current))
+                current, current_tokens = [], 0
+            windows.extend(split_piece(piece))
+            continue
+        if current and current_tokens + n_tokens > max_tokens:
+            windows.append("".join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += n_tokens
+
+    if current:
+        windows.append("".join(current))
+    return windows
+
+
+def split_markdown(markdown: str, model: str = "gpt-4o-mini", max_tokens: int = WINDOW_TOKENS) -> list[str]:
+    def split_section(section):
+        return pack(split_paragraphs(section), model, max_tokens,
+                    lambda paragraph: split_tokens(paragraph, model, max_tokens))
+
+    return pack(split_sections(markdown), model, max_tokens, split_section)
+
+
+def extract_windows(extract_window, windows: list[str], max_workers: int = MAX_WORKERS) -> list:
+    """Run `extract_window(window)` over the windows concurrently, keeping them in order."""
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(windows))) as executor:
+        return list(executor.map(extract_window, windows))
+
+
+def unique(values) -> list:
+    return list(dict.fromkeys(value for value in values if value))
+
+
+def merge_crawler_responses(responses: list[CrawlerOpenAIResponse]) -> CrawlerOpenAIResponse:
+    return CrawlerOpenAIResponse(
+        emails=unique(email for response in responses for email in response.emails),
+        is_contact_page=any(response.is_contact_page for response in responses),
+        before_or_after_care_details="\n\n".join(
+            unique(response.before_or_after_care_details.strip() for response in responses)),
+    )
+
+
+def merge_childcare_responses(responses: list[ChildcareOpenAIResponse]) -> ChildcareOpenAIResponse:
+    merged = {"webpage_year": next((response.webpage_year for response in responses if response.webpage_year), None)}
+
+    # take all of the before (and after) care fields from the same window, so the times, provider
+    # and quote all go together.  a window that found care beats one that says there isn't any.
+    for prefix, fields in [("before_care", ["start_time", "provider", "quote_snippet"]),
+                           ("after_care", ["end_time", "provider", "quote_snippet"])]:
+        provides = [getattr(response, f"provides_{prefix}") for response in responses]
+        if True in provides:
+            best = responses[provides.index(True)]
+        elif False in provides:
+            best = responses[provides.index(False)]
+        else:
+            best = responses[0]
+        merged[f"provides_{prefix}"] = getattr(best, f"provides_{prefix}")
+        for field in fields:
+            merged[f"{prefix}_{field}"] = getattr(best, f"{prefix}_{field}")
+
+    return ChildcareOpenAIResponse(**merged)
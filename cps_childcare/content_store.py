@@ -0,0 +1,291 @@
+"""
+Compressed storage for crawled page content.  The markdown/html blobs make up most of the
+crawler database, so they live in the `crawlerrecordcontent` side table instead of on
+CrawlerRecord (so metadata scans never page them in) and are compressed with a dictionary
+trained per site family (Edlio, Educational Networks, WordPress, ...), since sites built by the
+same vendor share most of their markup.  Content is only decompressed when something actually
+reads it.
+
+Compression uses zstd (`zstandard` is a dependency) and falls back to zlib's preset dictionaries
+in an environment that doesn't have it yet, though rows stored with zstd can't be read there.
+After migrating, train the dictionaries and compress the existing rows with
+
+    python -m cps_childcare.content_store train
+    python -m cps_childcare.content_store compress
+"""
+import argparse
+import random
+import zlib
+from collections import Counter
+from functools import cached_property
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from sqlmodel import Session, select
+
+from cps_childcare.cps_data_models import CompressionDictionary, CrawlerRecord, CrawlerRecordContent
+
+
+CONTENT_FIELDS = ("markdown", "html", "stripped_markdown")
+
+DEFAULT_CODEC = "zstd" if zstandard is not None else "zlib"
+ZSTD_LEVEL = 10
+ZSTD_DICTIONARY_SIZE = 112_640
+# zlib can't use more than 32KB of preset dictionary
+ZLIB_DICTIONARY_SIZE = 32_768
+
+# dictionaries are small and immutable, so keep them around once they're loaded
+_dictionaries: dict[int, bytes] = {}
+_current_dictionaries: dict[tuple[str, str], tuple[int, bytes] | None] = {}
+
+
+def require_zstandard():
+    if zstandard is None:
+        raise RuntimeError("This content is zstd-compressed but the zstandard package isn't installed, "
+                           "run `poetry install` to install it")
+    return zstandard
+
+
+def compress(text: str | None, codec: str, dictionary: bytes | None = None) -> bytes | None:
+    if text is None:
+        return None
+    data = text.encode()
+    if codec == "none":
+        return data
+    if codec == "zlib":
+        compressor = zlib.compressobj(level=9, zdict=dictionary) if dictionary else zlib.compressobj(level=9)
+        return compressor.compress(data) + compressor.flush()
+    if codec == "zstd":
+        zstandard = require_zstandard()
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL, dict_data=dict_data).compress(data)
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+def decompress(data: bytes | None, codec: str, dictionary: bytes | None = None) -> str | None:
+    if data is None:
+        return None
+    if codec == "none":
+        return bytes(data).decode()
+    if codec == "zlib":
+        decompressor = zlib.decompressobj(zdict=dictionary) if dictionary else zlib.decompressobj()
+        return (decompressor.decompress(data) + decompressor.flush()).decode()
+    if codec == "zstd":
+        zstandard = require_zstandard()
+        dict_data = zstandard.ZstdCompressionDict(dictionary) if dictionary else None
+        return zstandard.ZstdDecompressor(dict_data=dict_data).decompress(data).decode()
+    raise ValueError(f"Unknown codec: {codec}")
+
+
+def site_family(markdown: str | None, html: str | None) -> str:
+    text = html or markdown or ""
+    if "Edlio" in text or "edlio" in text:
+        return "edlio"
+    if "Educational Networks" in text or "educationalnetworks" in text:
+        return "educational_networks"
+    if "wp-content" in text:
+        return "wordpress"
+    if "cps.edu" in text:
+        return "cps"
+    return "other"
+
+
+def get_dictionary(session: Session, dictionary_id: int | None) -> bytes | None:
+    if dictionary_id is None:
+        return None
+    if dictionary_id not in _dictionaries:
+        _dictionaries[dictionary_id] = session.get(CompressionDictionary, dictionary_id).dictionary
+    return _dictionaries[dictionary_id]
+
+
+def current_dictionary(session: Session, family: str, codec: str = DEFAULT_CODEC) -> tuple[int, bytes] | None:
+    if (family, codec) not in _current_dictionaries:
+        dictionary = session.exec(
+            select(CompressionDictionary)
+            .where(CompressionDictionary.family == family)
+            .where(CompressionDictionary.codec == codec)
+            .order_by(CompressionDictionary.id.desc())
+        ).first()
+        _current_dictionaries[(family, codec)] = (dictionary.id, dictionary.dictionary) if dictionary else None
+    return _current_dictionaries[(family, codec)]
+
+
+class PageContent:
+    """A CrawlerRecordContent row whose fields get decompressed the first time they're read."""
+    def __init__(self, row: CrawlerRecordContent, dictionary: bytes | None):
+        self.crawler_record_id = row.crawler_record_id
+        self.codec = row.codec
+        self.dictionary_id = row.dictionary_id
+        self._row = row
+        self._dictionary = dictionary
+
+    @cached_property
+    def markdown(self) -> str | None:
+        return decompress(self._row.markdown, self.codec, self._dictionary)
+
+    @cached_property
+    def html(self) -> str | None:
+        return decompress(self._row.html, self.codec, self._dictionary)
+
+    @cached_property
+    def stripped_markdown(self) -> str | None:
+        return decompress(self._row.stripped_markdown, self.codec, self._dictionary)
+
+
+class CrawledPage:
+    """A CrawlerRecord's metadata plus its (lazily decompressed) content."""
+    def __init__(self, record: CrawlerRecord, content: PageContent | None):
+        self.record = record
+        self.content = content
+
+    def __getattr__(self, name):
+        if name in CONTENT_FIELDS:
+            return getattr(self.content, name) if self.content is not None else None
+        return getattr(self.record, name)
+
+
+def to_page_content(session: Session, row: CrawlerRecordContent | None) -> PageContent | None:
+    if row is None:
+        return None
+    return PageContent(row, get_dictionary(session, row.dictionary_id))
+
+
+def load_content(session: Session, crawler_record_id: int) -> PageContent | None:
+    return to_page_content(session, session.get(CrawlerRecordContent, crawler_record_id))
+
+
+def load_contents(session: Session, crawler_record_ids) -> dict[int, PageContent]:
+    crawler_record_ids = list(crawler_record_ids)
+    contents = {}
+    # stay well under sqlite's limit on query parameters
+    for start in range(0, len(crawler_record_ids), 500):
+        # bulk updates don't touch rows already in the session, so make sure we see their changes
+        rows = session.exec(
+            select(CrawlerRecordContent)
+            .where(CrawlerRecordContent.crawler_record_id.in_(crawler_record_ids[start:start + 500]))
+            .execution_options(populate_existing=True)
+        )
+        for row in rows:
+            contents[row.crawler_record_id] = to_page_content(session, row)
+    return contents
+
+
+def load_pages(session: Session, records: list[CrawlerRecord]) -> list[CrawledPage]:
+    contents = load_contents(session, [record.id for record in records])
+    return [CrawledPage(record, contents.get(record.id)) for record in records]
+
+
+def has_markdown():
+    """Where clause for CrawlerRecord queries that only keeps pages with markdown."""
+    return select(CrawlerRecordContent.crawler_record_id).where(
+        (CrawlerRecordContent.crawler_record_id == CrawlerRecord.id) &
+        (CrawlerRecordContent.markdown.is_not(None))
+    ).exists()
+
+
+def content_row(session: Session, crawler_record_id: int, markdown: str | None = None, html: str | None = None,
+                stripped_markdown: str | None = None, codec: str = DEFAULT_CODEC) -> dict:
+    """Build a crawlerrecordcontent mapping, compressed with the page's site family's dictionary."""
+    dictionary = current_dictionary(session, site_family(markdown, html), codec)
+    dictionary_id, dictionary_bytes = dictionary if dictionary else (None, None)
+    return {
+        "crawler_record_id": crawler_record_id,
+        "codec": codec,
+        "dictionary_id": dictionary_id,
+        "markdown": compress(markdown, codec, dictionary_bytes),
+        "html": compress(html, codec, dictionary_bytes),
+        "stripped_markdown": compress(stripped_markdown, codec, dictionary_bytes),
+    }
+
+
+def field_update(content: PageContent, field: str, text: str | None) -> dict:
+    """Mapping for bulk_update_mappings that replaces one field, using the row's codec and dictionary."""
+    return {"crawler_record_id": content.crawler_record_id,
+            field: compress(text, content.codec, content._dictionary)}
+
+
+def zlib_dictionary(samples: list[str], size: int = ZLIB_DICTIONARY_SIZE) -> bytes:
+    # zlib's preset dictionary is just text to match against, so fill it with the lines that show up
+    # across the most sample pages, weighted by length.  zlib prefers matches near the end of it,
+    # so the most useful lines go last.
+    line_counts = Counter()
+    for sample in samples:
+        line_counts.update({line.strip() for line in sample.splitlines() if len(line.strip()) > 8})
+    scored = sorted((line for line, count in line_counts.items() if count > 1),
+                    key=lambda line: line_counts[line] * len(line), reverse=True)
+
+    lines, total = [], 0
+    for line in scored:
+        encoded = (line + "\n").encode()
+        if total + len(encoded) > size:
+            break
+        lines.append(encoded)
+        total += len(encoded)
+    return b"".join(reversed(lines))
+
+
+def train_dictionaries(engine, sample_size: int = 1000, codec: str = DEFAULT_CODEC):
+    with Session(engine) as session:
+        record_ids = session.exec(select(CrawlerRecordContent.crawler_record_id)).all()
+
+    random.seed(42)
+    sample_ids = random.sample(record_ids, min(sample_size, len(record_ids)))
+
+    samples_by_family = {}
+    with Session(engine) as session:
+        for content in load_contents(session, sample_ids).values():
+            family = site_family(content.markdown, content.html)
+            samples = samples_by_family.setdefault(family, [])
+            samples.extend(text for text in (content.markdown, content.html) if text)
+
+    with Session(engine) as session:
+        for family, samples in samples_by_family.items():
+            if codec == "zstd":
+                dictionary = require_zstandard().train_dictionary(
+                    ZSTD_DICTIONARY_SIZE, [sample.encode() for sample in samples]).as_bytes()
+            else:
+                dictionary = zlib_dictionary(samples)
+            session.add(CompressionDictionary(family=family, codec=codec, dictionary=dictionary))
+            print(f"Trained a {len(dictionary):,} byte {codec} dictionary for {family} from {len(samples)} samples")
+        session.commit()
+
+    _current_dictionaries.clear()
+
+
+def compress_all(engine, codec: str = DEFAULT_CODEC, batch_size: int = 500):
+    """Recompress every row that isn't using the current codec and dictionary for its site family."""
+    with Session(engine) as session:
+        record_ids = session.exec(select(CrawlerRecordContent.crawler_record_id)).all()
+
+    n_recompressed = 0
+    for start in range(0, len(record_ids), batch_size):
+        with Session(engine) as session:
+            updates = []
+            for content in load_contents(session, record_ids[start:start + batch_size]).values():
+                dictionary = current_dictionary(session, site_family(content.markdown, content.html), codec)
+                if content.codec == codec and content.dictionary_id == (dictionary[0] if dictionary else None):
+                    continue
+                updates.append(content_row(session, content.crawler_record_id, content.markdown,
+                                           content.html, content.stripped_markdown, codec=codec))
+            session.bulk_update_mappings(CrawlerRecordContent, updates)
+            session.commit()
+        n_recompressed += len(updates)
+        print(f"{min(start + batch_size, len(record_ids))} / {len(record_ids)}: recompressed {n_recompressed} pages")
+
+
+if __name__ == "__main__":
+    from cps_childcare.database import engine
+
+    parser = argparse.ArgumentParser(description="Manage the compressed crawled page content.")
+    parser.add_argument("command", choices=["train", "compress"])
+    parser.add_argument("--codec", choices=["zstd", "zlib"], default=DEFAULT_CODEC)
+    parser.add_argument("--sample-size", type=int, default=1000)
+    args = parser.parse_args()
+
+    if args.command == "train":
+        train_dictionaries(engine, sample_size=args.sample_size, codec=args.codec)
+    else:
+        compress_all(engine, codec=args.codec)
@@ -5,12 +5,20 @@ from functools import partial
 from lancedb.pydantic import LanceModel, Vector
 from pydantic import BaseModel, field_validator
 from sqlmodel import Field, LargeBinary, SQLModel
-from sqlalchemy import text
+from sqlalchemy import Index, text
 from sqlalchemy.engine import Engine
 import numpy as np
 
 
 class CrawlerRecord(SQLModel, table=True):
+    __table_args__ = (
+        # only one canonical copy of each distinct page per school
+        Index("ix_crawlerrecord_school_id_content_hash", "school_id", "content_hash",
+              unique=True, sqlite_where=text("duplicate_of_id IS NULL")),
+        # the llm results are joined back to their pages on these, see cps_childcare/queries.py
+        Index("ix_crawlerrecord_school_id_page_url", "school_id", "page_url"),
+    )
+
     id: int | None = Field(default=None, primary_key=True)
     index: int
     school_name: str
@@ -20,10 +28,134 @@ class CrawlerRecord(SQLModel, table=True):
     page_url: str
     description: str | None
     status_code: int
-    markdown: str | None
-    html: str | None
     crawled_at: datetime = Field(default_factory=partial(datetime.now, timezone.utc))
 
+    # see cps_childcare/dedup.py
+    canonical_url: str | None = Field(default=None)
+    content_hash: str | None = Field(default=None)
+    duplicate_of_id: int | None = Field(default=None, foreign_key="crawlerrecord.id")
+
+
+# the page content lives in its own compressed table so that scans of the crawler records
+# don't have to read it, see cps_childcare/content_store.py
+class CrawlerRecordContent(SQLModel, table=True):
+    crawler_record_id: int = Field(primary_key=True, foreign_key="crawlerrecord.id")
+    # "zstd", "zlib" or "none"
+    codec: str
+    dictionary_id: int | None = Field(default=None, foreign_key="compressiondictionary.id")
+    markdown: bytes | None = Field(default=None, sa_type=LargeBinary)
+    html: bytes | None = Field(default=None, sa_type=LargeBinary)
+    # markdown with the site's repeated nav/footer/sidebar blocks taken out, see cps_childcare/boilerplate.py
+    stripped_markdown: bytes | None = Field(default=None, sa_type=LargeBinary)
+
+
+# compression dictionaries trained on a family of school sites (edlio, wordpress, ...)
+class CompressionDictionary(SQLModel, table=True):
+    id: int | None = Field(default=None, primary_key=True)
+    family: str
+    codec: str
+    dictionary: bytes = Field(sa_type=LargeBinary)
+    created_at: datetime = Field(default_factory=partial(datetime.now, timezone.utc))
+
+
+# one row per firecrawl crawl job so that a partially ingested crawl can be picked back up
+class FirecrawlJob(SQLModel, table=True):
+    id: int | None = Field(default=None, primary_key=True)
+    school_id: int
+    crawl_url: str
+    firecrawl_id: str | None
+    status: str = Field(default="pending")
+    # how many of the crawl's results have been ingested so far
+    pages_ingested: int = Field(default=0)
+    submitted_at: datetime | None
+    updated_at: datetime = Field(default_factory=partial(datetime.now, timezone.utc))
+
+
+# near-duplicate cluster membership, see cps_childcare/near_duplicates.py.  pages that
+# aren't near-duplicates of anything don't get a row.
+class NearDupCluster(SQLModel, table=True):
+    id: int | None = Field(default=None, primary_key=True)
+    school_id: int = Field(index=True)
+    crawler_record_id: int = Field(foreign_key="crawlerrecord.id", index=True)
+    representative_id: int = Field(foreign_key="crawlerrecord.id")
+    # estimated jaccard similarity to the representative
+    similarity: float
+    created_at: datetime = Field(default_factory=partial(datetime.now, timezone.utc))
+
+
+# the markdown blocks that repeat across a school's site, see cps_childcare/boilerplate.py
+class BoilerplateBlock(SQLModel, table=True):
+    id: int | None = Field(default=None, primary_key=True)
+    school_id: int = Field(index=True)
+    domain: str
+    block_hash: str
+    page_count: int
+    block_text: str
+    created_at: datetime = Field(default_factory=partial(datetime.now, timezone.utc))
+
+
+# openai batch api jobs and the pages in each of them, see cps_childcare/openai_batch.py
+class OpenAIBatch(SQLModel, table=True):
+    id: int | None = Field(default=None, primary_key=True)
+    batch_id: str = Field(index=True)
+    # which extraction pass the batch is for, e.g. "page_extraction" or "care_details"
+    stage: str
+    openai_model_name: str
+    prompt_version: str | None
+    input_file_id: str
+    output_file_id: str | None = Field(default=None)
+    error_file_id: str | None = Field(default=None)
+    status: str
+    n_requests: int
+    created_at: datetime = Field(default_factory=partial(datetime.now, timezone.utc))
+    updated_at: datetime = Field(default_factory=partial(datetime.now, timezone.utc))
+    # set once the results have been saved
+    ingested_at: datetime | None = Field(default=None)
+
+
+class OpenAIBatchRequest(SQLModel, table=True):
+    id: int | None = Field(default=None, primary_key=True)
+    openai_batch_id: int = Field(foreign_key="openaibatch.id", index=True)
+    crawler_record_id: int = Field(foreign_key="crawlerrecord.id", index=True)
+
+
+# cached llm responses, see cps_childcare/llm_cache.py
+class LLMResponseCache(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_llmresponsecache_key", "content_hash", "prompt_hash", "openai_model_name", "schema_hash", unique=True),
+    )
+
+    id: int | None = Field(default=None, primary_key=True)
+    content_hash: str
+    prompt_hash: str
+    openai_model_name: str
+    schema_hash: str
+    response: str
+    size: int
+    created_at: datetime = Field(default_factory=partial(datetime.now, timezone.utc))
+    last_used_at: datetime = Field(default_factory=partial(datetime.now, timezone.utc), index=True)
+
+
+# what each llm result was derived from, see cps_childcare/lineage.py
+class Lineage(SQLModel, table=True):
+    __table_args__ = (
+        Index("ix_lineage_stage_school_id_page_url", "stage", "school_id", "page_url",
+              "openai_model_name", "prompt_version", "input_hash"),
+    )
+
+    id: int | None = Field(default=None, primary_key=True)
+    # the table of the derived record, e.g. "crawleropenairecord"
+    stage: str
+    record_id: int
+    school_id: int
+    # None for the per-school records
+    page_url: str | None
+    # the page's content hash, or a hash of all of the school's page content hashes
+    input_hash: str
+    openai_model_name: str
+    prompt_version: str | None
+    created_at: datetime = Field(default_factory=partial(datetime.now, timezone.utc))
+
 
 # this will be the model that we use for the gpt structured output response
 class CrawlerOpenAIResponse(BaseModel):
@@ -34,6 +166,10 @@ class CrawlerOpenAIResponse(BaseModel):
 
 # add a few extra fields for the database record
 class CrawlerOpenAIRecord(SQLModel, CrawlerOpenAIResponse, table=True):
+    __table_args__ = (
+        Index("ix_crawleropenairecord_school_id_page_url", "school_id", "page_url", "openai_model_name", "prompt_version"),
+    )
+
     id: int | None = Field(default=None, primary_key=True)
     school_id: int
     school_type: str
@@ -67,6 +203,10 @@ class ChildcareOpenAIResponse(BaseModel):
 
 # add a few extra fields for the database record
 class ChildcareOpenAIRecord(SQLModel, ChildcareOpenAIResponse, table=True):
+    __table_args__ = (
+        Index("ix_childcareopenairecord_school_id_page_url", "school_id", "page_url", "openai_model_name", "prompt_version"),
+    )
+
     id: int | None = Field(default=None, primary_key=True)
     school_id: int
     page_url: str
@@ -100,6 +240,10 @@ class CombinedChildcareOpenAIResponse(BaseModel):
 
 # add a few extra fields for the database record
 class CombinedChildcareOpenAIRecord(SQLModel, CombinedChildcareOpenAIResponse, table=True):
+    __table_args__ = (
+        Index("ix_combinedchildcareopenairecord_school_id_prompt_version", "school_id", "prompt_version"),
+    )
+
     id: int | None = Field(default=None, primary_key=True)
     school_id: int
     before_care_citations: str | None
@@ -3,9 +3,11 @@ import sqlite_vec
 from sqlalchemy import event
 from sqlmodel import SQLModel, create_engine
 
-from cps_childcare.cps_data_models import (CrawlerRecord, CrawlerOpenAIRecord,
+from cps_childcare.cps_data_models import (BoilerplateBlock, CompressionDictionary, CrawlerRecord,
+                                                CrawlerRecordContent, CrawlerOpenAIRecord,
                                                 ChildcareOpenAIRecord, CombinedChildcareOpenAIRecord,
-                                                Neighborhood, SchoolToNeighborhood)
+                                                FirecrawlJob, Lineage, LLMResponseCache, NearDupCluster, Neighborhood,
+                                                OpenAIBatch, OpenAIBatchRequest, SchoolToNeighborhood)
 
 sqlite_file_name = "/Users/mdagostino/cps-childcare/data/cps_crawler.db"
 sqlite_url = f"sqlite:///{sqlite_file_name}"
@@ -0,0 +1,187 @@
+"""
+Exact-duplicate detection for crawled pages.  School sites serve the same page under lots of
+URLs (trailing slashes, tracking query strings, http vs https, vendor mirrors), so each
+CrawlerRecord gets a canonical url and a hash of its normalized markdown.  The first copy of a
+page for a school is the canonical row, and later copies point at it with `duplicate_of_id`
+so that downstream stages only process each distinct page once.
+
+Run `python -m cps_childcare.dedup` to backfill existing rows.
+"""
+import hashlib
+import re
+from datetime import datetime, timezone
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from sqlmodel import Session, select
+
+from cps_childcare.content_store import content_row, load_contents
+from cps_childcare.cps_data_models import CrawlerRecord, CrawlerRecordContent
+
+
+TRACKING_PARAMS = {"fbclid", "gclid", "mc_cid", "mc_eid", "_ga", "ref"}
+INDEX_PAGES = {"index.html", "index.htm", "index.php", "index.asp", "index.aspx", "default.asp", "default.aspx"}
+
+
+def canonicalize_url(url: str) -> str:
+    parts = urlsplit(url.strip())
+
+    # http vs https and www vs no www are the same page
+    host = (parts.hostname or "").lower().removeprefix("www.")
+    if parts.port and parts.port not in (80, 443):
+        host = f"{host}:{parts.port}"
+
+    path = re.sub(r"/{2,}", "/", parts.path)
+    segments = path.rstrip("/").split("/")
+    if segments[-1].lower() in INDEX_PAGES:
+        segments = segments[:-1]
+    path = "/".join(segments) or "/"
+
+    query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+             if key.lower() not in TRACKING_PARAMS and not key.lower().startswith("utm_")]
+    query = urlencode(sorted(query))
+
+    return urlunsplit(("https", host, path, query, ""))
+
+
+def normalize_markdown(markdown: str) -> str:
+    # link targets change between mirrors (absolute vs relative, http vs https) even when the page doesn't
+    markdown = re.sub(r"\]\([^)]*\)", "]()", markdown)
+    return re.sub(r"\s+", " ", markdown).strip().lower()
+
+
+def content_hash(markdown: str | None) -> str | None:
+    if markdown is None:
+        return None
+    return hashlib.sha256(normalize_markdown(markdown).encode()).hexdigest()
+
+
+def insert_deduplicated(session: Session, school_id: int, records: list[dict]):
+    """
+    Insert crawler record mappings for a single school, filling in `canonical_url`, `content_hash`
+    and `duplicate_of_id`.  Records whose page_url is already stored are skipped, unless it's a
+    canonical page whose content has changed, which gets its content replaced so the LLM passes
+    pick it up again (see cps_childcare/lineage.py).  The records' `markdown` and `html` go into the
+    compressed crawlerrecordcontent table.
+    """
+    contents = []
+    for record in records:
+        contents.append((record, record.pop("markdown", None), record.pop("html", None)))
+        record["canonical_url"] = canonicalize_url(record["page_url"])
+        record["content_hash"] = content_hash(contents[-1][1])
+
+    existing_pages = {row.page_url: row for row in session.exec(
+        select(CrawlerRecord.id, CrawlerRecord.page_url, CrawlerRecord.content_hash, CrawlerRecord.duplicate_of_id)
+        .where(CrawlerRecord.school_id == school_id)
+        .where(CrawlerRecord.page_url.in_([record["page_url"] for record in records]))
+    )}
+    existing_page_urls = set(existing_pages)
+
+    canonical_rows = session.exec(
+        select(CrawlerRecord.id, CrawlerRecord.canonical_url, CrawlerRecord.content_hash)
+        .where(CrawlerRecord.school_id == school_id)
+        .where(CrawlerRecord.duplicate_of_id == None)
+        .where(CrawlerRecord.canonical_url.in_([record["canonical_url"] for record in records]) |
+               CrawlerRecord.content_hash.in_([record["content_hash"] for record in records if record["content_hash"]]))
+    ).all()
+    canonical_by_url = {row.canonical_url: row.id for row in canonical_rows}
+    canonical_by_hash = {row.content_hash: row.id for row in canonical_rows if row.content_hash}
+
+    # the first copy of each page becomes canonical, and anything after it is a duplicate of it.
+    # duplicates of pages in this same batch have to wait until those pages have ids.
+    new_canonical, duplicates, duplicates_of_new, changed = [], [], [], []
+    new_by_url, new_by_hash = {}, {}
+    for record in records:
+        existing = existing_pages.pop(record["page_url"], None)
+        if existing is not None and is_changed(existing, record["content_hash"], canonical_by_hash, new_by_hash):
+            record["id"] = existing.id
+            if canonical_by_hash.get(existing.content_hash) == existing.id:
+                del canonical_by_hash[existing.content_hash]
+            canonical_by_hash[record["content_hash"]] = existing.id
+            changed.append(record)
+        if record["page_url"] in existing_page_urls:
+            continue
+        existing_page_urls.add(record["page_url"])
+
+        url, digest = record["canonical_url"], record["content_hash"]
+        if url in canonical_by_url or (digest and digest in canonical_by_hash):
+            record["duplicate_of_id"] = canonical_by_url.get(url) or canonical_by_hash.get(digest)
+            duplicates.append(record)
+        elif url in new_by_url or (digest and digest in new_by_hash):
+            duplicates_of_new.append((record, new_by_url.get(url) or new_by_hash.get(digest)))
+        else:
+            new_canonical.append(record)
+            new_by_url[url] = record
+            if digest:
+                new_by_hash[digest] = record
+
+    session.bulk_insert_mappings(CrawlerRecord, new_canonical, return_defaults=True)
+
+    for record, canonical_record in duplicates_of_new:
+        record["duplicate_of_id"] = canonical_record["id"]
+        duplicates.append(record)
+    session.bulk_insert_mappings(CrawlerRecord, duplicates, return_defaults=True)
+    session.bulk_update_mappings(CrawlerRecord, [
+        {field: record[field] for field in ("id", "page_title", "description", "status_code", "content_hash")}
+        | {"crawled_at": datetime.now(timezone.utc)}
+        for record in changed
+    ])
+
+    changed_ids = {record["id"] for record in changed}
+    session.bulk_insert_mappings(CrawlerRecordContent, [
+        content_row(session, record["id"], markdown=markdown, html=html)
+        for record, markdown, html in contents if "id" in record and record["id"] not in changed_ids
+    ])
+    # this also drops the old stripped markdown, so the boilerplate has to be stripped again
+    session.bulk_update_mappings(CrawlerRecordContent, [
+        content_row(session, record["id"], markdown=markdown, html=html)
+        for record, markdown, html in contents if record.get("id") in changed_ids
+    ])
+
+
+def is_changed(existing, digest: str | None, canonical_by_hash: dict, new_by_hash: dict) -> bool:
+    """Whether a stored canonical page's content should be replaced with a recrawl's."""
+    if existing.duplicate_of_id is not None or digest is None or digest == existing.content_hash:
+        return False
+    # it can't take on the content of another canonical page
+    return canonical_by_hash.get(digest, existing.id) == existing.id and digest not in new_by_hash
+
+
+def backfill_school(session: Session, school_id: int) -> int:
+    pages = session.exec(
+        select(CrawlerRecord.id, CrawlerRecord.page_url)
+        .where(CrawlerRecord.school_id == school_id)
+        .order_by(CrawlerRecord.id)
+    ).all()
+    contents = load_contents(session, [page.id for page in pages])
+
+    updates = []
+    canonical_by_url, canonical_by_hash = {}, {}
+    for page in pages:
+        content = contents.get(page.id)
+        url, digest = canonicalize_url(page.page_url), content_hash(content.markdown if content else None)
+        duplicate_of_id = canonical_by_url.get(url) or (canonical_by_hash.get(digest) if digest else None)
+        if duplicate_of_id is None:
+            canonical_by_url[url] = page.id
+            if digest:
+                canonical_by_hash[digest] = page.id
+        updates.append({"id": page.id, "canonical_url": url, "content_hash": digest, "duplicate_of_id": duplicate_of_id})
+
+    session.bulk_update_mappings(CrawlerRecord, updates)
+    return sum(update["duplicate_of_id"] is not None for update in updates)
+
+
+def backfill_duplicates(engine):
+    with Session(engine) as session:
+        school_ids = session.exec(select(CrawlerRecord.school_id).distinct()).all()
+
+    for num, school_id in enumerate(school_ids):
+        with Session(engine) as session:
+            n_duplicates = backfill_school(session, school_id)
+            session.commit()
+        print(f"{num} / {len(school_ids)}: {school_id} has {n_duplicates} duplicate pages")
+
+
+if __name__ == "__main__":
+    from cps_childcare.database import engine
+
+    backfill_duplicates(engine)
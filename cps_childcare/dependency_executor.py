@@ -0,0 +1,85 @@
+"""
+A thread pool whose tasks can depend on other tasks.  `submit(fn, ..., after=futures)` only starts
+`fn` once every future in `after` has finished (whether or not it succeeded), so 04 can start a
+school's combine the moment that school's pages are extracted instead of after every page in the
+crawl.  A task never holds a worker thread while it waits, and `max_pending` caps how many tasks can be
+queued or running at once, so a producer streaming pages in can't get far ahead of the workers.
+"""
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+
+class DependencyExecutor:
+    def __init__(self, max_workers: int = 16, max_pending: int | None = None):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.pending = threading.Semaphore(max_pending or 4 * max_workers)
+        self.condition = threading.Condition()
+        self.n_outstanding = 0
+        self.n_done = 0
+        self.n_failed = 0
+
+    def submit(self, fn, *args, after=(), **kwargs) -> Future:
+        # blocks while there are already `max_pending` tasks waiting or running
+        self.pending.acquire()
+        with self.condition:
+            self.n_outstanding += 1
+
+        future = Future()
+        future.add_done_callback(lambda done: self.task_done(fn, done))
+
+        def start():
+            task = self.executor.submit(fn, *args, **kwargs)
+            task.add_done_callback(lambda task: copy_result(task, future))
+
+        after = list(after)
+        if not after:
+            start()
+            return future
+
+        remaining = [len(after)]
+        lock = threading.Lock()
+
+        def dependency_done(_):
+            with lock:
+                remaining[0] -= 1
+                ready = remaining[0] == 0
+            if ready:
+                start()
+
+        for dependency in after:
+            dependency.add_done_callback(dependency_done)
+        return future
+
+    def task_done(self, fn, future: Future):
+        if future.exception() is not None:
+            print(f"Error in {getattr(fn, '__name__', fn)}: {future.exception()}")
+        with self.condition:
+            if future.exception() is not None:
+                self.n_failed += 1
+            else:
+                self.n_done += 1
+            self.n_outstanding -= 1
+            self.condition.notify_all()
+        self.pending.release()
+
+    def wait(self):
+        """Block until every submitted task, including the ones still waiting on others, has finished."""
+        with self.condition:
+            self.condition.wait_for(lambda: self.n_outstanding == 0)
+
+    def shutdown(self):
+        self.wait()
+        self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+
+def copy_result(task: Future, future: Future):
+    if task.exception() is not None:
+        future.set_exception(task.exception())
+    else:
+        future.set_result(task.result())
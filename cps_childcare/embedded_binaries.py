@@ -0,0 +1,66 @@
+"""
+Strips inline base64 payloads (`data:image/png;base64,...` images, fonts, pdfs) out of crawled
+pages.  They can be hundreds of KB of meaningless text that would otherwise get stored, sent to
+OpenAI (and blow through the token limit) and embedded, so `extract_crawled_data` in step 2 drops
+them as pages are ingested.  The data URI's media type is kept so it's still clear that something
+was embedded there.
+
+Run `python -m cps_childcare.embedded_binaries` to strip them from pages crawled before this existed.
+"""
+import re
+
+from sqlmodel import Session, select, update
+
+from cps_childcare.content_store import CONTENT_FIELDS, content_row, load_contents
+from cps_childcare.cps_data_models import CrawlerRecord, CrawlerRecordContent
+from cps_childcare.dedup import backfill_school
+
+
+DATA_URI_PATTERN = re.compile(r"data:([\w.+-]+/[\w.+-]+)((?:;[\w.+-]+=[\w.+-]+)*);base64,[A-Za-z0-9+/=]+")
+
+
+def strip_embedded_binaries(text: str | None) -> str | None:
+    if text is None:
+        return None
+    return DATA_URI_PATTERN.sub(r"data:\1\2;base64,", text)
+
+
+def backfill_embedded_binaries(engine, batch_size: int = 500):
+    with Session(engine) as session:
+        record_ids = session.exec(select(CrawlerRecordContent.crawler_record_id)).all()
+
+    changed_ids = []
+    for start in range(0, len(record_ids), batch_size):
+        with Session(engine) as session:
+            updates = []
+            for content in load_contents(session, record_ids[start:start + batch_size]).values():
+                stripped = {field: strip_embedded_binaries(getattr(content, field)) for field in CONTENT_FIELDS}
+                if all(stripped[field] == getattr(content, field) for field in CONTENT_FIELDS):
+                    continue
+                updates.append(content_row(session, content.crawler_record_id, **stripped, codec=content.codec))
+            session.bulk_update_mappings(CrawlerRecordContent, updates)
+            session.commit()
+        changed_ids.extend(row["crawler_record_id"] for row in updates)
+        print(f"{min(start + batch_size, len(record_ids))} / {len(record_ids)}: stripped {len(changed_ids)} pages")
+
+    # the content hashes of the pages that changed are stale now, so redo those schools' duplicates.
+    # the hashes get cleared first so that the unique index doesn't trip over a half updated school.
+    school_ids = set()
+    with Session(engine) as session:
+        for start in range(0, len(changed_ids), batch_size):
+            school_ids.update(session.exec(
+                select(CrawlerRecord.school_id).where(CrawlerRecord.id.in_(changed_ids[start:start + batch_size]))
+            ))
+
+    for school_id in school_ids:
+        with Session(engine) as session:
+            session.exec(update(CrawlerRecord).where(CrawlerRecord.school_id == school_id).values(content_hash=None))
+            n_duplicates = backfill_school(session, school_id)
+            session.commit()
+        print(f"{school_id} now has {n_duplicates} duplicate pages")
+
+
+if __name__ == "__main__":
+    from cps_childcare.database import engine
+
+    backfill_embedded_binaries(engine)
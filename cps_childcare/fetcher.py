@@ -0,0 +1,117 @@
+import asyncio
+import random
+import time
+from urllib.parse import urlsplit
+
+import httpx
+
+from cps_childcare.http_cache import HttpCache
+
+
+# some CPS school /contact pages give 403's without a proper header
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36"
+}
+
+
+class HostBudget:
+    """
+    Politeness budget for a single host: at most `max_concurrency` requests in flight,
+    and a random delay between `min_delay` and `max_delay` seconds between request starts.
+    """
+    def __init__(self, max_concurrency: int = 1, min_delay: float = 0.0, max_delay: float = 0.0):
+        self.max_concurrency = max_concurrency
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._lock = asyncio.Lock()
+        self._next_start = 0.0
+
+    async def __aenter__(self):
+        await self._semaphore.acquire()
+        try:
+            # space out the request starts for this host
+            async with self._lock:
+                wait = self._next_start - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                self._next_start = time.monotonic() + random.uniform(self.min_delay, self.max_delay)
+        except BaseException:
+            self._semaphore.release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._semaphore.release()
+
+
+def budget_key(url: str) -> str:
+    """
+    All of the CPS APIs (api.cps.edu, www.cps.edu, ...) share one budget, and every other
+    host (i.e. each school's own website) gets its own.
+    """
+    host = (urlsplit(url).hostname or "").lower()
+    if host == "cps.edu" or host.endswith(".cps.edu"):
+        return "cps.edu"
+    return host.removeprefix("www.")
+
+
+class AsyncFetcher:
+    """
+    Thin wrapper around an httpx.AsyncClient that makes every request wait on the
+    budget for its host.  `budgets` maps a budget key to the keyword arguments for its
+    HostBudget, and any host not in there gets `default_budget`.  If a `cache` is given,
+    fresh responses are served from it without touching the network and stale ones are
+    revalidated with a conditional GET.
+    """
+    def __init__(self, budgets: dict | None = None, default_budget: dict | None = None,
+                 headers: dict | None = None, timeout: httpx.Timeout | float = 30.0,
+                 cache: HttpCache | None = None):
+        self.budget_config = budgets or {}
+        self.default_budget = default_budget or {}
+        self.headers = headers if headers is not None else DEFAULT_HEADERS
+        self.cache = cache
+        self.client = httpx.AsyncClient(
+            headers=self.headers,
+            timeout=timeout,
+            follow_redirects=True,
+        )
+        self._budgets: dict[str, HostBudget] = {}
+
+    def budget_for(self, url: str) -> HostBudget:
+        key = budget_key(url)
+        if key not in self._budgets:
+            self._budgets[key] = HostBudget(**self.budget_config.get(key, self.default_budget))
+        return self._budgets[key]
+
+    async def get(self, url: str, headers: dict | None = None, **kwargs) -> httpx.Response:
+        if self.cache is None:
+            async with self.budget_for(url):
+                return await self.client.get(url, headers=headers, **kwargs)
+
+        cache_key = self.cache.key(url, {**self.headers, **(headers or {})})
+        entry = self.cache.load(cache_key)
+        if entry is not None and self.cache.is_fresh(entry):
+            self.cache.stats["hit"] += 1
+            return self.cache.to_response(entry)
+
+        conditional_headers = self.cache.conditional_headers(entry) if entry is not None else {}
+        async with self.budget_for(url):
+            response = await self.client.get(url, headers={**(headers or {}), **conditional_headers}, **kwargs)
+
+        if response.status_code == 304 and entry is not None:
+            self.cache.stats["revalidated"] += 1
+            return self.cache.to_response(self.cache.revalidated(cache_key, entry, response))
+
+        self.cache.stats["miss"] += 1
+        self.cache.store(cache_key, url, response)
+        return response
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
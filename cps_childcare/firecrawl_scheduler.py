@@ -0,0 +1,142 @@
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+
+import httpx
+
+
+DEFAULT_FIRECRAWL_API_URL = "https://api.firecrawl.dev"
+
+
+@dataclass
+class CrawlJob:
+    url: str
+    # whatever the caller needs to ingest the results, e.g. the airtable school record
+    context: dict = field(default_factory=dict)
+    crawl_id: str | None = None
+    status: str = "pending"
+    # how many of the crawl's results have already been handed off, so a resumed job only gets new ones
+    pages_ingested: int = 0
+    poll_errors: int = 0
+
+
+class FirecrawlScheduler:
+    """
+    Runs many Firecrawl crawls at once against the v1 REST API.  Up to `max_in_flight` crawl jobs
+    are submitted at a time (to stay within the plan's concurrency limits) and all of the in-flight
+    jobs are polled together every `poll_interval` seconds.  Results are streamed out a page of the
+    API's pagination at a time as they become available, even while a crawl is still running, so
+    nothing ever holds a whole crawl in memory.  Point `api_url` at `cps_childcare.local_firecrawl`
+    to run against canned results instead of the real service.
+    """
+    def __init__(self, api_key: str, api_url: str = DEFAULT_FIRECRAWL_API_URL, max_in_flight: int = 5,
+                 poll_interval: float = 10, max_poll_errors: int = 5, timeout: float = 60.0):
+        self.api_url = api_url.rstrip("/")
+        self.max_in_flight = max_in_flight
+        self.poll_interval = poll_interval
+        self.max_poll_errors = max_poll_errors
+        self.client = httpx.AsyncClient(
+            headers={"Authorization": f"Bearer {api_key}"},
+            timeout=timeout,
+        )
+
+    async def submit(self, job: CrawlJob, params: dict) -> str:
+        response = await self.client.post(f"{self.api_url}/v1/crawl", json={"url": job.url, **params})
+        response.raise_for_status()
+        return response.json()["id"]
+
+    async def get_status(self, crawl_id: str, skip: int = 0) -> dict:
+        params = {"skip": skip} if skip else None
+        response = await self.client.get(f"{self.api_url}/v1/crawl/{crawl_id}", params=params)
+        response.raise_for_status()
+        return response.json()
+
+    async def poll(self, job: CrawlJob, on_pages) -> dict | None:
+        try:
+            status = await self.get_status(job.crawl_id, skip=job.pages_ingested)
+
+            # hand off whatever results are ready, following the pagination links
+            page = status
+            while True:
+                data = page.get("data") or []
+                if data:
+                    on_pages(job, data)
+                    job.pages_ingested += len(data)
+                if not page.get("next"):
+                    break
+                response = await self.client.get(page["next"])
+                response.raise_for_status()
+                page = response.json()
+        except httpx.HTTPError as e:
+            job.poll_errors += 1
+            print(f"Polling {job.url} failed ({job.poll_errors} / {self.max_poll_errors}): {e}")
+            if job.poll_errors >= self.max_poll_errors:
+                return {"success": False, "status": "failed", "error": str(e)}
+            return None
+
+        return status
+
+    async def run(self, jobs: list[CrawlJob], params: dict, on_pages, on_complete=None, on_submit=None, on_failure=None):
+        """
+        `on_pages(job, pages)` gets each batch of crawled pages as it comes in, and then
+        `on_complete(job, status)` is called once the crawl is finished.  `on_submit(job)` is called
+        as soon as a job has a crawl id, and `on_failure(job, status_or_exception)` gets anything that
+        couldn't be submitted or failed.  Jobs that already have a `crawl_id` are resumed from
+        `pages_ingested` instead of being resubmitted.
+        """
+        pending = deque(job for job in jobs if job.crawl_id is None)
+        in_flight: list[CrawlJob] = [job for job in jobs if job.crawl_id is not None]
+
+        def fail(job, reason):
+            job.status = "failed"
+            if on_failure is not None:
+                on_failure(job, reason)
+            else:
+                print(f"Crawl failed for {job.url}!!")
+                print(reason)
+
+        while pending or in_flight:
+            while pending and len(in_flight) < self.max_in_flight:
+                job = pending.popleft()
+                try:
+                    job.crawl_id = await self.submit(job, params)
+                except httpx.HTTPStatusError as e:
+                    if e.response.status_code == 429:
+                        # we're at the plan's limit, so try again once something finishes
+                        pending.appendleft(job)
+                        break
+                    fail(job, e)
+                    continue
+                except httpx.HTTPError as e:
+                    fail(job, e)
+                    continue
+
+                job.status = "scraping"
+                in_flight.append(job)
+                if on_submit is not None:
+                    on_submit(job)
+                print(f"Submitted crawl {job.crawl_id} for {job.url}...")
+
+            await asyncio.sleep(self.poll_interval)
+
+            statuses = await asyncio.gather(*(self.poll(job, on_pages) for job in in_flight))
+            still_running = []
+            for job, status in zip(in_flight, statuses):
+                if status is None or status.get("status") == "scraping":
+                    still_running.append(job)
+                elif status.get("status") == "completed":
+                    job.status = "completed"
+                    if on_complete is not None:
+                        on_complete(job, status)
+                else:
+                    fail(job, status)
+            in_flight = still_running
+
+    async def aclose(self):
+        await self.client.aclose()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.aclose()
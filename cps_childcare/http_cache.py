@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+import time
+from collections import Counter
+
+import httpx
+
+
+class HttpCache:
+    """
+    On-disk HTTP response cache.  Entries are keyed on the URL plus the request headers and
+    remember the response's ETag/Last-Modified so that a stale entry can be revalidated with a
+    conditional GET instead of downloading it again.  Bodies are content-addressed by their
+    sha256 so identical responses are only stored once.
+
+    `ttls` is a list of (url prefix, seconds) pairs--the longest matching prefix wins, and
+    anything that doesn't match uses `default_ttl`.  Within its TTL an entry is served straight
+    from disk; after that it gets revalidated.
+    """
+    # don't cache server errors or rate limiting
+    UNCACHEABLE_STATUS_CODES = {429}
+
+    def __init__(self, cache_dir: str, ttls: list[tuple[str, float]] | None = None, default_ttl: float = 0):
+        self.cache_dir = cache_dir
+        self.ttls = sorted(ttls or [], key=lambda prefix_ttl: len(prefix_ttl[0]), reverse=True)
+        self.default_ttl = default_ttl
+        self.stats = Counter()
+
+        os.makedirs(os.path.join(cache_dir, "entries"), exist_ok=True)
+        os.makedirs(os.path.join(cache_dir, "bodies"), exist_ok=True)
+
+    def key(self, url: str, headers: dict | None = None) -> str:
+        headers = {k.lower(): v for k, v in (headers or {}).items()}
+        return hashlib.sha256(json.dumps([url, sorted(headers.items())]).encode()).hexdigest()
+
+    def ttl_for(self, url: str) -> float:
+        for prefix, ttl in self.ttls:
+            if url.startswith(prefix):
+                return ttl
+        return self.default_ttl
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, "entries", f"{key}.json")
+
+    def _body_path(self, body_hash: str) -> str:
+        return os.path.join(self.cache_dir, "bodies", body_hash[:2], body_hash)
+
+    def _write_atomic(self, path: str, data: bytes):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def load(self, key: str) -> dict | None:
+        try:
+            with open(self._entry_path(key), "r") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+        # the body can go missing if the cache was partially cleaned up
+        if not os.path.exists(self._body_path(entry["body_hash"])):
+            return None
+        return entry
+
+    def is_fresh(self, entry: dict) -> bool:
+        return time.time() - entry["fetched_at"] < self.ttl_for(entry["url"])
+
+    def conditional_headers(self, entry: dict) -> dict:
+        headers = {}
+        if entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def store(self, key: str, url: str, response: httpx.Response) -> dict | None:
+        if response.status_code >= 500 or response.status_code in self.UNCACHEABLE_STATUS_CODES:
+            return None
+
+        body = response.content
+        body_hash = hashlib.sha256(body).hexdigest()
+        body_path = self._body_path(body_hash)
+        if not os.path.exists(body_path):
+            self._write_atomic(body_path, body)
+
+        entry = {
+            "url": url,
+            "status_code": response.status_code,
+            "content_type": response.headers.get("content-type"),
+            "etag": response.headers.get("etag"),
+            "last_modified": response.headers.get("last-modified"),
+            "body_hash": body_hash,
+            "fetched_at": time.time(),
+        }
+        self._write_atomic(self._entry_path(key), json.dumps(entry).encode())
+        return entry
+
+    def revalidated(self, key: str, entry: dict, response: httpx.Response) -> dict:
+        # a 304 can carry updated validators
+        entry["etag"] = response.headers.get("etag", entry.get("etag"))
+        entry["last_modified"] = response.headers.get("last-modified", entry.get("last_modified"))
+        entry["fetched_at"] = time.time()
+        self._write_atomic(self._entry_path(key), json.dumps(entry).encode())
+        return entry
+
+    def to_response(self, entry: dict) -> httpx.Response:
+        with open(self._body_path(entry["body_hash"]), "rb") as f:
+            body = f.read()
+
+        headers = {"content-type": entry["content_type"]} if entry["content_type"] else {}
+        return httpx.Response(
+            status_code=entry["status_code"],
+            headers=headers,
+            content=body,
+            request=httpx.Request("GET", entry["url"]),
+        )
+
+    def summary(self) -> str:
+        return (f"{self.stats['hit']} served from cache, {self.stats['revalidated']} revalidated (304), "
+                f"{self.stats['miss']} downloaded")
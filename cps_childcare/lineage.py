@@ -0,0 +1,113 @@
+"""
+Lineage for the LLM results.  Every CrawlerOpenAIRecord, ChildcareOpenAIRecord and
+CombinedChildcareOpenAIRecord gets a `lineage` row in the same transaction it's written in, with the
+model and prompt version it came from and the hash of its input: the page's content hash for the
+per-page records, and a hash of all of the school's page content hashes for the combined ones.
+
+The passes pick their work by comparing that against the current crawl instead of checking whether
+a result exists at all, so a recrawled page that changed (or a new prompt version) gets extracted
+again, and only the schools whose pages changed get combined again.  See the queries in
+cps_childcare/queries.py.
+"""
+import hashlib
+from collections import defaultdict
+
+from sqlmodel import Session, select
+
+from cps_childcare.cps_data_models import (ChildcareOpenAIRecord, CombinedChildcareOpenAIRecord,
+                                           CrawlerOpenAIRecord, CrawlerRecord, Lineage)
+
+
+PAGE_RECORDS = (CrawlerOpenAIRecord, ChildcareOpenAIRecord)
+SCHOOL_RECORDS = (CombinedChildcareOpenAIRecord,)
+
+
+def school_input_hash(pages) -> str:
+    """Hash of a school's (page_url, content_hash) pairs."""
+    digest = hashlib.sha256()
+    for page_url, page_hash in sorted(pages):
+        digest.update(f"{page_url}\t{page_hash}\n".encode())
+    return digest.hexdigest()
+
+
+def school_input_hashes(session: Session, school_ids) -> dict[int, str]:
+    """The current input hash of each school, over its canonical pages that have content."""
+    school_ids = list(school_ids)
+    pages = defaultdict(list)
+    # stay well under sqlite's limit on query parameters
+    for start in range(0, len(school_ids), 500):
+        for school_id, page_url, page_hash in session.exec(
+            select(CrawlerRecord.school_id, CrawlerRecord.page_url, CrawlerRecord.content_hash)
+            .where(CrawlerRecord.school_id.in_(school_ids[start:start + 500]))
+            .where(CrawlerRecord.duplicate_of_id == None)
+            .where(CrawlerRecord.content_hash.is_not(None))
+        ):
+            pages[school_id].append((page_url, page_hash))
+    return {school_id: school_input_hash(pages[school_id]) for school_id in school_ids}
+
+
+def page_input_hashes(session: Session, records) -> dict[tuple[int, str], str]:
+    """The current content hash of each record's page, keyed on (school_id, page_url)."""
+    keys = {(record.school_id, record.page_url) for record in records}
+    page_urls = list({page_url for _, page_url in keys})
+    hashes = {}
+    for start in range(0, len(page_urls), 500):
+        for school_id, page_url, page_hash in session.exec(
+            select(CrawlerRecord.school_id, CrawlerRecord.page_url, CrawlerRecord.content_hash)
+            .where(CrawlerRecord.page_url.in_(page_urls[start:start + 500]))
+            .where(CrawlerRecord.content_hash.is_not(None))
+        ):
+            if (school_id, page_url) in keys:
+                hashes.setdefault((school_id, page_url), page_hash)
+    return hashes
+
+
+def record_lineage(session: Session, records: list) -> int:
+    """
+    Add the lineage rows for freshly added records (of any type, the ones that aren't LLM results are
+    skipped) to the session.  Records whose input can't be found don't get one, so they'll be redone.
+    """
+    page_records = [record for record in records if isinstance(record, PAGE_RECORDS)]
+    school_records = [record for record in records if isinstance(record, SCHOOL_RECORDS)]
+    if not page_records and not school_records:
+        return 0
+    # the records need their ids
+    session.flush()
+
+    rows = []
+    page_hashes = page_input_hashes(session, page_records) if page_records else {}
+    for record in page_records:
+        input_hash = page_hashes.get((record.school_id, record.page_url))
+        if input_hash is not None:
+            rows.append(lineage_row(record, input_hash, page_url=record.page_url))
+
+    school_hashes = school_input_hashes(session, {record.school_id for record in school_records}) if school_records else {}
+    for record in school_records:
+        rows.append(lineage_row(record, school_hashes[record.school_id]))
+
+    session.add_all(rows)
+    return len(rows)
+
+
+def lineage_row(record, input_hash: str, page_url: str | None = None) -> Lineage:
+    return Lineage(stage=record.__tablename__, record_id=record.id, school_id=record.school_id, page_url=page_url,
+                   input_hash=input_hash, openai_model_name=record.openai_model_name,
+                   prompt_version=record.prompt_version)
+
+
+def schools_to_combine(session: Session, model_name: str, prompt_version: str, source=ChildcareOpenAIRecord) -> set[int]:
+    """
+    Schools with `source` rows whose latest combine with this model and prompt version is missing or
+    was made from different page content than the school has now.
+    """
+    candidates = set(session.exec(select(source.school_id).distinct()))
+    combined = dict(session.exec(
+        select(Lineage.school_id, Lineage.input_hash)
+        .where(Lineage.stage == CombinedChildcareOpenAIRecord.__tablename__)
+        .where(Lineage.openai_model_name == model_name)
+        .where(Lineage.prompt_version == prompt_version)
+        # so the latest combine per school wins
+        .order_by(Lineage.id)
+    ).all())
+    current = school_input_hashes(session, candidates)
+    return {school_id for school_id in candidates if combined.get(school_id) != current[school_id]}
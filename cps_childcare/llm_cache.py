@@ -0,0 +1,138 @@
+"""
+A persistent cache of LLM responses in the `llmresponsecache` table, so rerunning 03 or 04 after an
+interruption or on an unchanged crawl doesn't pay for the same answers twice.  Responses are keyed on
+the hash of the normalized page content, the hash of the fully rendered prompt, the model and the hash
+of the response schema, so changing any of them (a recrawl, a new prompt version, a schema tweak)
+misses the cache.  Once the cache grows past `max_bytes` the least recently used responses are evicted.
+"""
+import hashlib
+import json
+import threading
+from collections import Counter
+from datetime import datetime, timezone
+
+from pydantic import BaseModel
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlmodel import Session, delete, func, select, update
+
+from cps_childcare.cps_data_models import LLMResponseCache
+from cps_childcare.dedup import content_hash
+
+
+def sha256(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def schema_hash(response_format: type[BaseModel]) -> str:
+    return sha256(json.dumps(response_format.model_json_schema(), sort_keys=True))
+
+
+class LLMCache:
+    def __init__(self, engine, max_bytes: int = 256 * 1024 * 1024, evict_every: int = 100, touch_every: int = 100):
+        self.engine = engine
+        self.max_bytes = max_bytes
+        # how many new responses between checks of the cache's size
+        self.evict_every = evict_every
+        # last_used_at is updated in batches rather than on every hit
+        self.touch_every = touch_every
+        self.stats = Counter()
+        self.touched = set()
+        self.n_puts = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(content: str, messages: list[dict], model: str, response_format: type[BaseModel], **params) -> dict:
+        return {
+            "content_hash": content_hash(content) or "",
+            "prompt_hash": sha256(json.dumps({"messages": messages, **params}, sort_keys=True)),
+            "openai_model_name": model,
+            "schema_hash": schema_hash(response_format),
+        }
+
+    def get(self, content: str, messages: list[dict], model: str, response_format: type[BaseModel], **params):
+        """The cached response parsed into `response_format`, or None."""
+        key = self.key(content, messages, model, response_format, **params)
+        with Session(self.engine) as session:
+            entry = session.exec(
+                select(LLMResponseCache.id, LLMResponseCache.response)
+                .where(LLMResponseCache.content_hash == key["content_hash"])
+                .where(LLMResponseCache.prompt_hash == key["prompt_hash"])
+                .where(LLMResponseCache.openai_model_name == key["openai_model_name"])
+                .where(LLMResponseCache.schema_hash == key["schema_hash"])
+            ).first()
+
+        with self.lock:
+            if entry is None:
+                self.stats["miss"] += 1
+                return None
+            self.stats["hit"] += 1
+            self.touched.add(entry.id)
+            flush = len(self.touched) >= self.touch_every
+        if flush:
+            self.flush()
+        return response_format.model_validate_json(entry.response)
+
+    def put(self, content: str, messages: list[dict], model: str, response_format: type[BaseModel],
+            response: BaseModel | str, **params):
+        key = self.key(content, messages, model, response_format, **params)
+        response_json = response if isinstance(response, str) else response.model_dump_json()
+        now = datetime.now(timezone.utc)
+        values = {"response": response_json, "size": len(response_json.encode()), "last_used_at": now}
+        with Session(self.engine) as session:
+            # a concurrent run might have cached the same thing already, in which case this one wins
+            session.exec(
+                sqlite_insert(LLMResponseCache)
+                .values(**key, **values, created_at=now)
+                .on_conflict_do_update(index_elements=list(key), set_=values)
+            )
+            session.commit()
+
+        with self.lock:
+            self.stats["put"] += 1
+            self.n_puts += 1
+            evict = self.n_puts % self.evict_every == 0
+        if evict:
+            self.evict()
+
+    def flush(self):
+        with self.lock:
+            touched, self.touched = self.touched, set()
+        if not touched:
+            return
+        with Session(self.engine) as session:
+            session.exec(
+                update(LLMResponseCache)
+                .where(LLMResponseCache.id.in_(touched))
+                .values(last_used_at=datetime.now(timezone.utc))
+            )
+            session.commit()
+
+    def evict(self):
+        """Drop the least recently used responses until the cache is back under 90% of `max_bytes`."""
+        self.flush()
+        with Session(self.engine) as session:
+            total = session.exec(select(func.coalesce(func.sum(LLMResponseCache.size), 0))).one()
+            if total <= self.max_bytes:
+                return
+
+            to_free = total - 0.9 * self.max_bytes
+            evicted_ids = []
+            for entry_id, size in session.exec(
+                select(LLMResponseCache.id, LLMResponseCache.size).order_by(LLMResponseCache.last_used_at)
+            ):
+                if to_free <= 0:
+                    break
+                evicted_ids.append(entry_id)
+                to_free -= size
+
+            for start in range(0, len(evicted_ids), 500):
+                session.exec(delete(LLMResponseCache).where(LLMResponseCache.id.in_(evicted_ids[start:start + 500])))
+            session.commit()
+
+        with self.lock:
+            self.stats["evicted"] += len(evicted_ids)
+
+    def summary(self) -> str:
+        self.flush()
+        return (f"LLM cache: {self.stats['hit']} hits, {self.stats['miss']} misses, "
+                f"{self.stats['put']} new responses, {self.stats['evicted']} evicted")
@@ -0,0 +1,148 @@
+"""
+A local stand-in for the Firecrawl v1 crawl API that returns canned crawl results, so the
+crawl scheduler in 02 can be exercised without spending credits:
+
+    python -m cps_childcare.local_firecrawl --port 3002 --fixtures-dir path/to/fixtures
+    FIRECRAWL_API_URL=http://localhost:3002 FIRECRAWL_API_KEY=local python scripts/02_cps_firecrawl.py
+
+A fixture is a json list of Firecrawl page objects ({"markdown": ..., "html": ..., "metadata": {...}})
+named after the host it's for, e.g. `www.peirceschool.org.json`.  Hosts without a fixture get a
+few generated pages.
+"""
+import argparse
+import json
+import os
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+
+def generated_pages(url: str, n_pages: int = 3) -> list[dict]:
+    url = url.rstrip("/")
+    return [
+        {
+            "markdown": f"# Page {num}\n\nThis is page {num} of {url}.",
+            "html": f"<h1>Page {num}</h1><p>This is page {num} of {url}.</p>",
+            "metadata": {
+                "title": f"Page {num}",
+                "description": f"Page {num} of {url}",
+                "sourceURL": f"{url}/page-{num}",
+                "statusCode": 200,
+            },
+        }
+        for num in range(n_pages)
+    ]
+
+
+class LocalFirecrawl:
+    """
+    Keeps track of the fake crawl jobs.  Each job reports "scraping" for `polls_until_done` status
+    checks and then "completed", with its results split into pages of `page_size` linked by "next".
+    """
+    def __init__(self, fixtures_dir: str | None = None, polls_until_done: int = 1, page_size: int = 10):
+        self.fixtures_dir = fixtures_dir
+        self.polls_until_done = polls_until_done
+        self.page_size = page_size
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def canned_pages(self, url: str) -> list[dict]:
+        if self.fixtures_dir:
+            fixture_file = os.path.join(self.fixtures_dir, f"{urlsplit(url).hostname}.json")
+            if os.path.exists(fixture_file):
+                with open(fixture_file, "r") as f:
+                    return json.load(f)
+        return generated_pages(url)
+
+    def create_job(self, body: dict) -> dict:
+        crawl_id = str(uuid.uuid4())
+        pages = self.canned_pages(body["url"])[:body.get("limit", 10_000)]
+        with self.lock:
+            self.jobs[crawl_id] = {"pages": pages, "polls": 0}
+        return {"success": True, "id": crawl_id, "url": f"/v1/crawl/{crawl_id}"}
+
+    def job_status(self, crawl_id: str, base_url: str, skip: int = 0) -> dict | None:
+        with self.lock:
+            job = self.jobs.get(crawl_id)
+            if job is None:
+                return None
+            job["polls"] += 1
+            done = job["polls"] > self.polls_until_done
+
+        pages = job["pages"]
+        # while it's still scraping only some of the pages are available
+        available = len(pages) if done else len(pages) // 2
+        end = min(skip + self.page_size, available)
+        next_url = f"{base_url}/v1/crawl/{crawl_id}?skip={end}" if end < available else None
+
+        return {
+            "success": True,
+            "status": "completed" if done else "scraping",
+            "total": len(pages),
+            "completed": available,
+            "creditsUsed": available,
+            "next": next_url,
+            "data": pages[skip:end],
+        }
+
+
+def make_handler(firecrawl: LocalFirecrawl):
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, status: int, body: dict):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def base_url(self) -> str:
+            host, port = self.server.server_address[:2]
+            return f"http://{host}:{port}"
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/v1/crawl":
+                return self.send_json(404, {"success": False, "error": "Not found"})
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            if "url" not in body:
+                return self.send_json(400, {"success": False, "error": "url is required"})
+            self.send_json(200, firecrawl.create_job(body))
+
+        def do_GET(self):
+            path = urlsplit(self.path)
+            parts = path.path.strip("/").split("/")
+            if len(parts) != 3 or parts[:2] != ["v1", "crawl"]:
+                return self.send_json(404, {"success": False, "error": "Not found"})
+            skip = int(parse_qs(path.query).get("skip", ["0"])[0])
+            status = firecrawl.job_status(parts[2], self.base_url(), skip=skip)
+            if status is None:
+                return self.send_json(404, {"success": False, "error": "Job not found"})
+            self.send_json(200, status)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_local_firecrawl(port: int = 0, **kwargs) -> tuple[ThreadingHTTPServer, str]:
+    """Start the stand-in server on a background thread and return it along with its base url."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(LocalFirecrawl(**kwargs)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Firecrawl crawl API.")
+    parser.add_argument("--port", type=int, default=3002)
+    parser.add_argument("--fixtures-dir", default=None)
+    parser.add_argument("--polls-until-done", type=int, default=1)
+    parser.add_argument("--page-size", type=int, default=10)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(LocalFirecrawl(
+        fixtures_dir=args.fixtures_dir, polls_until_done=args.polls_until_done, page_size=args.page_size)))
+    print(f"Local Firecrawl listening on http://127.0.0.1:{args.port}")
+    server.serve_forever()
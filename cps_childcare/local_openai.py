@@ -0,0 +1,268 @@
+"""
+A local stand-in for OpenAI's chat completions API, so the extraction steps can be exercised
+without spending money:
+
+    python -m cps_childcare.local_openai --port 8089 --requests-per-minute 60
+    OPENAI_BASE_URL=http://localhost:8089/v1 python scripts/03_cps_openai.py
+
+Structured output requests get back an object that matches their json schema (empty strings,
+False, empty lists...).  It enforces its own requests/min and tokens/min limits, answering with
+429s and the same `x-ratelimit-*` headers OpenAI sends, so the rate limiting can be tested too.
+It also implements enough of the files and batches APIs for the batch mode in 03 and 04, where a
+batch is finished after it's been checked on `batch_polls_until_done` times.
+"""
+import argparse
+import json
+import threading
+import time
+import uuid
+from email.parser import BytesParser
+from email.policy import HTTP
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def value_for_schema(schema: dict, defs: dict):
+    if "$ref" in schema:
+        return value_for_schema(defs[schema["$ref"].split("/")[-1]], defs)
+    if "anyOf" in schema:
+        return value_for_schema(schema["anyOf"][0], defs)
+
+    schema_type = schema.get("type")
+    if isinstance(schema_type, list):
+        schema_type = schema_type[0]
+    if schema_type == "object":
+        return {name: value_for_schema(prop, defs) for name, prop in schema.get("properties", {}).items()}
+    return {"string": "", "boolean": False, "integer": 0, "number": 0, "array": [], "null": None}.get(schema_type)
+
+
+def count_tokens(body: dict) -> int:
+    # close enough for rate limiting
+    return sum(len(str(message.get("content", ""))) for message in body.get("messages", [])) // 4
+
+
+class LocalOpenAI:
+    def __init__(self, requests_per_minute: int = 500, tokens_per_minute: int = 200_000, latency: float = 0.2,
+                 respond=None, batch_polls_until_done: int = 1):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.latency = latency
+        # optionally a function from the request body to the message content to return
+        self.respond = respond
+        self.batch_polls_until_done = batch_polls_until_done
+        self.requests = []
+        self.tokens = []
+        self.files = {}
+        self.batches = {}
+        self.stats = {"completions": 0, "rate_limited": 0, "batches": 0}
+        # reentrant since finishing a batch creates its output file
+        self.lock = threading.RLock()
+
+    def rate_limit_headers(self, now: float) -> dict:
+        n_requests = len(self.requests)
+        n_tokens = sum(tokens for _, tokens in self.tokens)
+        reset_requests = 60 - (now - self.requests[0]) if self.requests else 0
+        reset_tokens = 60 - (now - self.tokens[0][0]) if self.tokens else 0
+        return {
+            "x-ratelimit-limit-requests": str(self.requests_per_minute),
+            "x-ratelimit-limit-tokens": str(self.tokens_per_minute),
+            "x-ratelimit-remaining-requests": str(max(0, self.requests_per_minute - n_requests)),
+            "x-ratelimit-remaining-tokens": str(max(0, self.tokens_per_minute - n_tokens)),
+            "x-ratelimit-reset-requests": f"{max(0, reset_requests):.3f}s",
+            "x-ratelimit-reset-tokens": f"{max(0, reset_tokens):.3f}s",
+        }
+
+    def admit(self, n_tokens: int) -> tuple[bool, dict]:
+        """Record a request against the last minute's usage if it fits under the limits."""
+        with self.lock:
+            now = time.monotonic()
+            self.requests = [t for t in self.requests if now - t < 60]
+            self.tokens = [(t, tokens) for t, tokens in self.tokens if now - t < 60]
+            fits = (len(self.requests) < self.requests_per_minute and
+                    sum(tokens for _, tokens in self.tokens) + n_tokens <= self.tokens_per_minute)
+            if fits:
+                self.requests.append(now)
+                self.tokens.append((now, n_tokens))
+                self.stats["completions"] += 1
+            else:
+                self.stats["rate_limited"] += 1
+            return fits, self.rate_limit_headers(now)
+
+    def completion(self, body: dict) -> dict:
+        if self.respond is not None:
+            content = self.respond(body)
+        else:
+            response_format = body.get("response_format") or {}
+            schema = response_format.get("json_schema", {}).get("schema")
+            content = json.dumps(value_for_schema(schema, schema.get("$defs", {}))) if schema else ""
+
+        prompt_tokens = count_tokens(body)
+        completion_tokens = len(content) // 4
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o-mini"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content, "refusal": None},
+                "logprobs": None,
+                "finish_reason": "stop",
+            }],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    def create_file(self, filename: str, purpose: str, content: bytes) -> dict:
+        file_object = {"id": f"file-{uuid.uuid4().hex}", "object": "file", "bytes": len(content),
+                       "created_at": int(time.time()), "filename": filename, "purpose": purpose,
+                       "status": "processed"}
+        with self.lock:
+            self.files[file_object["id"]] = (file_object, content)
+        return file_object
+
+    def create_batch(self, body: dict) -> dict | None:
+        if body.get("input_file_id") not in self.files:
+            return None
+        batch = {
+            "id": f"batch_{uuid.uuid4().hex}",
+            "object": "batch",
+            "endpoint": body.get("endpoint", "/v1/chat/completions"),
+            "errors": None,
+            "input_file_id": body["input_file_id"],
+            "completion_window": body.get("completion_window", "24h"),
+            "status": "validating",
+            "output_file_id": None,
+            "error_file_id": None,
+            "created_at": int(time.time()),
+            "request_counts": {"total": 0, "completed": 0, "failed": 0},
+            "metadata": body.get("metadata"),
+            "polls": 0,
+        }
+        with self.lock:
+            self.batches[batch["id"]] = batch
+            self.stats["batches"] += 1
+        return {key: value for key, value in batch.items() if key != "polls"}
+
+    def run_batch(self, batch: dict):
+        _, content = self.files[batch["input_file_id"]]
+        outputs = []
+        for line in content.decode().splitlines():
+            if not line.strip():
+                continue
+            request = json.loads(line)
+            outputs.append(json.dumps({
+                "id": f"batch_req_{uuid.uuid4().hex}",
+                "custom_id": request["custom_id"],
+                "response": {"status_code": 200, "request_id": uuid.uuid4().hex,
+                             "body": self.completion(request["body"])},
+                "error": None,
+            }))
+        output_file = self.create_file(f"{batch['id']}_output.jsonl", "batch_output", "\n".join(outputs).encode())
+        batch.update(status="completed", output_file_id=output_file["id"], completed_at=int(time.time()),
+                     request_counts={"total": len(outputs), "completed": len(outputs), "failed": 0})
+
+    def get_batch(self, batch_id: str) -> dict | None:
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            if batch is None:
+                return None
+            batch["polls"] += 1
+            if batch["status"] != "completed":
+                if batch["polls"] >= self.batch_polls_until_done:
+                    self.run_batch(batch)
+                else:
+                    batch["status"] = "in_progress"
+            return {key: value for key, value in batch.items() if key != "polls"}
+
+
+def make_handler(local_openai: LocalOpenAI):
+    class Handler(BaseHTTPRequestHandler):
+        def send_json(self, status: int, body: dict, headers: dict | None = None):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def not_found(self):
+            self.send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+
+        def do_POST(self):
+            path = self.path.rstrip("/")
+            payload = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            if path == "/v1/files":
+                # the file upload is multipart/form-data
+                message = BytesParser(policy=HTTP).parsebytes(
+                    f"Content-Type: {self.headers['Content-Type']}\r\n\r\n".encode() + payload)
+                fields = {part.get_param("name", header="content-disposition"): part for part in message.iter_parts()}
+                return self.send_json(200, local_openai.create_file(
+                    fields["file"].get_filename(), fields["purpose"].get_content().strip(),
+                    fields["file"].get_payload(decode=True)))
+            if path == "/v1/batches":
+                batch = local_openai.create_batch(json.loads(payload or b"{}"))
+                if batch is None:
+                    return self.send_json(400, {"error": {"message": "Unknown input file", "type": "invalid_request_error"}})
+                return self.send_json(200, batch)
+            if path != "/v1/chat/completions":
+                return self.not_found()
+            body = json.loads(payload or b"{}")
+
+            admitted, headers = local_openai.admit(count_tokens(body))
+            if not admitted:
+                retry_after = max(float(headers["x-ratelimit-reset-requests"][:-1]),
+                                  float(headers["x-ratelimit-reset-tokens"][:-1]))
+                headers["retry-after-ms"] = str(int(retry_after * 1000))
+                return self.send_json(429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                                      "code": "rate_limit_exceeded"}}, headers)
+
+            time.sleep(local_openai.latency)
+            self.send_json(200, local_openai.completion(body), headers)
+
+        def do_GET(self):
+            parts = self.path.strip("/").split("/")
+            if len(parts) == 3 and parts[:2] == ["v1", "batches"]:
+                batch = local_openai.get_batch(parts[2])
+                return self.send_json(200, batch) if batch is not None else self.not_found()
+            if len(parts) == 4 and parts[:2] == ["v1", "files"] and parts[3] == "content":
+                if parts[2] not in local_openai.files:
+                    return self.not_found()
+                _, content = local_openai.files[parts[2]]
+                self.send_response(200)
+                self.send_header("Content-Type", "application/octet-stream")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+                return
+            self.not_found()
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def start_local_openai(port: int = 0, **kwargs) -> tuple[ThreadingHTTPServer, str]:
+    """Start the stand-in server on a background thread and return it along with its base url."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(LocalOpenAI(**kwargs)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}/v1"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the OpenAI chat completions API.")
+    parser.add_argument("--port", type=int, default=8089)
+    parser.add_argument("--requests-per-minute", type=int, default=500)
+    parser.add_argument("--tokens-per-minute", type=int, default=200_000)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--batch-polls-until-done", type=int, default=1)
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(LocalOpenAI(
+        requests_per_minute=args.requests_per_minute, tokens_per_minute=args.tokens_per_minute,
+        latency=args.latency, batch_polls_until_done=args.batch_polls_until_done)))
+    print(f"Local OpenAI listening on http://127.0.0.1:{args.port}/v1")
+    server.serve_forever()
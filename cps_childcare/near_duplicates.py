@@ -0,0 +1,252 @@
+"""
+Near-duplicate clustering of a school's crawled pages with MinHash + LSH.  Lots of pages in a
+crawl are almost identical (archived newsletters, per-classroom template pages, calendar variants),
+so we cluster them per school and only send a representative of each cluster to the LLM.  Cluster
+membership lives in the `neardupcluster` table, and `fan_out_page_results` copies a representative's
+results back out to the rest of its cluster.
+
+Run `python -m cps_childcare.near_duplicates` after crawling to (re)cluster every school.
+"""
+import zlib
+from collections import defaultdict
+
+import numpy as np
+from sqlmodel import Session, delete, select
+
+from cps_childcare.boilerplate import content_markdown
+from cps_childcare.content_store import has_markdown, load_contents
+from cps_childcare.cps_data_models import CrawlerRecord, Lineage, NearDupCluster
+from cps_childcare.dedup import normalize_markdown
+from cps_childcare.lineage import lineage_row
+
+
+NUM_PERM = 128
+# 16 bands of 8 rows puts the LSH threshold at a jaccard similarity of ~0.7, and then
+# candidate pairs have to clear SIMILARITY_THRESHOLD on their full signatures
+NUM_BANDS = 16
+SIMILARITY_THRESHOLD = 0.8
+SHINGLE_SIZE = 5
+
+# a*x + b mod a 31 bit prime keeps every intermediate value inside a uint64
+_MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+_rng = np.random.RandomState(42)
+_A = _rng.randint(1, (1 << 31) - 1, size=NUM_PERM).astype(np.uint64)
+_B = _rng.randint(0, (1 << 31) - 1, size=NUM_PERM).astype(np.uint64)
+
+
+def shingles(markdown: str, size: int = SHINGLE_SIZE) -> np.ndarray:
+    words = normalize_markdown(markdown).split()
+    if len(words) < size:
+        words_grams = [" ".join(words)]
+    else:
+        words_grams = [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return np.unique(np.fromiter((zlib.crc32(gram.encode()) & 0x7FFFFFFF for gram in words_grams),
+                                 dtype=np.uint64, count=len(words_grams)))
+
+
+def minhash_signature(shingle_hashes: np.ndarray, block_size: int = 8192) -> np.ndarray:
+    signature = np.full(NUM_PERM, _MERSENNE_PRIME, dtype=np.uint64)
+    # do it in blocks so a huge page doesn't build a NUM_PERM x n_shingles matrix all at once
+    for start in range(0, len(shingle_hashes), block_size):
+        block = shingle_hashes[start:start + block_size]
+        hashed = (_A[:, None] * block[None, :] + _B[:, None]) % _MERSENNE_PRIME
+        signature = np.minimum(signature, hashed.min(axis=1))
+    return signature
+
+
+def cluster_signatures(signatures: dict[int, np.ndarray]) -> dict[int, tuple[int, float]]:
+    """
+    Takes {page id: signature} and returns {page id: (representative id, estimated jaccard)} for
+    every page in a cluster of two or more.  The lowest id in a cluster is its representative.
+    """
+    rows_per_band = NUM_PERM // NUM_BANDS
+    buckets = defaultdict(list)
+    for page_id, signature in signatures.items():
+        for band in range(NUM_BANDS):
+            band_key = signature[band * rows_per_band:(band + 1) * rows_per_band].tobytes()
+            buckets[(band, band_key)].append(page_id)
+
+    parent = {page_id: page_id for page_id in signatures}
+
+    def find(page_id):
+        while parent[page_id] != page_id:
+            parent[page_id] = parent[parent[page_id]]
+            page_id = parent[page_id]
+        return page_id
+
+    checked = set()
+    for page_ids in buckets.values():
+        for i, page_id in enumerate(page_ids):
+            for other_id in page_ids[i + 1:]:
+                pair = (min(page_id, other_id), max(page_id, other_id))
+                if pair in checked:
+                    continue
+                checked.add(pair)
+                similarity = np.mean(signatures[page_id] == signatures[other_id])
+                if similarity >= SIMILARITY_THRESHOLD:
+                    root, other_root = find(page_id), find(other_id)
+                    parent[max(root, other_root)] = min(root, other_root)
+
+    clusters = defaultdict(list)
+    for page_id in signatures:
+        clusters[find(page_id)].append(page_id)
+
+    memberships = {}
+    for representative_id, members in clusters.items():
+        if len(members) < 2:
+            continue
+        for page_id in members:
+            similarity = float(np.mean(signatures[page_id] == signatures[representative_id]))
+            memberships[page_id] = (representative_id, similarity)
+    return memberships
+
+
+def cluster_school(session: Session, school_id: int) -> int:
+    page_ids = session.exec(
+        select(CrawlerRecord.id)
+        .where(CrawlerRecord.school_id == school_id)
+        .where(CrawlerRecord.status_code == 200)
+        .where(has_markdown())
+        .where(CrawlerRecord.duplicate_of_id == None)
+    ).all()
+    # compare the pages without the site's boilerplate, otherwise it makes every page look alike
+    signatures = {page_id: minhash_signature(shingles(content_markdown(content)))
+                  for page_id, content in load_contents(session, page_ids).items()}
+    memberships = cluster_signatures(signatures)
+
+    session.exec(delete(NearDupCluster).where(NearDupCluster.school_id == school_id))
+    session.bulk_insert_mappings(NearDupCluster, [
+        {"school_id": school_id, "crawler_record_id": page_id,
+         "representative_id": representative_id, "similarity": similarity}
+        for page_id, (representative_id, similarity) in memberships.items()
+    ])
+
+    # how many pages don't need to be sent anywhere
+    return sum(page_id != representative_id for page_id, (representative_id, _) in memberships.items())
+
+
+def cluster_all_schools(engine):
+    with Session(engine) as session:
+        school_ids = session.exec(select(CrawlerRecord.school_id).distinct()).all()
+
+    for num, school_id in enumerate(school_ids):
+        with Session(engine) as session:
+            n_skippable = cluster_school(session, school_id)
+            session.commit()
+        print(f"{num} / {len(school_ids)}: {school_id} has {n_skippable} near-duplicate pages")
+
+
+def is_cluster_representative():
+    """
+    Where clause for CrawlerRecord queries that leaves out pages whose near-duplicate cluster is
+    represented by some other page.
+    """
+    return ~select(NearDupCluster.id).where(
+        (NearDupCluster.crawler_record_id == CrawlerRecord.id) &
+        (NearDupCluster.representative_id != CrawlerRecord.id)
+    ).exists()
+
+
+def fan_out_page_results(session: Session, record_cls, **filters) -> int:
+    """
+    Copy a representative page's latest result record (e.g. CrawlerOpenAIRecord) to every other page
+    in its cluster, replacing any older copy.  A member's copy is up to date if its lineage has the
+    same input hash as the representative's result, and a result the member got from its own current
+    content is left alone.  `filters` narrow down which records count, e.g.
+    `openai_model_name="gpt-4o-mini", prompt_version="v1"`.
+    """
+    memberships = session.exec(
+        select(NearDupCluster.school_id, CrawlerRecord.page_url, CrawlerRecord.content_hash,
+               NearDupCluster.representative_id)
+        .join(CrawlerRecord, CrawlerRecord.id == NearDupCluster.crawler_record_id)
+        .where(NearDupCluster.crawler_record_id != NearDupCluster.representative_id)
+    ).all()
+    if not memberships:
+        return 0
+
+    representative_ids = list({membership.representative_id for membership in memberships})
+    representative_keys = {}
+    for start in range(0, len(representative_ids), 500):
+        for page_id, school_id, page_url in session.exec(
+            select(CrawlerRecord.id, CrawlerRecord.school_id, CrawlerRecord.page_url)
+            .where(CrawlerRecord.id.in_(representative_ids[start:start + 500]))
+        ):
+            representative_keys[page_id] = (school_id, page_url)
+
+    representative_records = latest_records(session, record_cls, set(representative_keys.values()), **filters)
+    member_keys = {(membership.school_id, membership.page_url) for membership in memberships}
+    member_records = records_by_page(session, record_cls, member_keys, **filters)
+    input_hashes = latest_input_hashes(session, record_cls, set(representative_keys.values()) | member_keys, **filters)
+
+    stale_record_ids, copies = [], []
+    for membership in memberships:
+        member_key = (membership.school_id, membership.page_url)
+        representative_key = representative_keys.get(membership.representative_id)
+        representative_record = representative_records.get(representative_key)
+        representative_hash = input_hashes.get(representative_key)
+        # without lineage there's no telling what the representative's result came from
+        if representative_record is None or representative_hash is None:
+            continue
+        if input_hashes.get(member_key) in (representative_hash, membership.content_hash):
+            continue
+
+        stale_record_ids.extend(record.id for record in member_records.get(member_key, []))
+        copy = record_cls.model_validate(representative_record.model_dump(exclude={"id", "created_at"}))
+        copy.page_url = membership.page_url
+        copies.append((copy, representative_hash))
+
+    for start in range(0, len(stale_record_ids), 500):
+        batch_ids = stale_record_ids[start:start + 500]
+        session.exec(delete(record_cls).where(record_cls.id.in_(batch_ids)))
+        session.exec(delete(Lineage).where(Lineage.stage == record_cls.__tablename__).where(Lineage.record_id.in_(batch_ids)))
+
+    session.add_all([copy for copy, _ in copies])
+    session.flush()
+    # the copies were made from the representative's content, not the member's own
+    session.add_all([lineage_row(copy, input_hash, page_url=copy.page_url) for copy, input_hash in copies])
+    return len(copies)
+
+
+def matching(query, record_cls, **filters):
+    for field, value in filters.items():
+        query = query.where(getattr(record_cls, field) == value)
+    return query
+
+
+def records_by_page(session: Session, record_cls, keys: set, **filters) -> dict[tuple[int, str], list]:
+    """The `record_cls` records for each (school_id, page_url) in `keys`, oldest first."""
+    page_urls = list({page_url for _, page_url in keys})
+    records = defaultdict(list)
+    # stay well under sqlite's limit on query parameters
+    for start in range(0, len(page_urls), 500):
+        for record in session.exec(matching(
+            select(record_cls).where(record_cls.page_url.in_(page_urls[start:start + 500])), record_cls, **filters
+        ).order_by(record_cls.id)):
+            if (record.school_id, record.page_url) in keys:
+                records[(record.school_id, record.page_url)].append(record)
+    return records
+
+
+def latest_records(session: Session, record_cls, keys: set, **filters) -> dict:
+    return {key: records[-1] for key, records in records_by_page(session, record_cls, keys, **filters).items()}
+
+
+def latest_input_hashes(session: Session, record_cls, keys: set, **filters) -> dict[tuple[int, str], str]:
+    """The input hash of the latest `record_cls` lineage row for each (school_id, page_url) in `keys`."""
+    page_urls = list({page_url for _, page_url in keys})
+    hashes = {}
+    for start in range(0, len(page_urls), 500):
+        for school_id, page_url, input_hash in session.exec(matching(
+            select(Lineage.school_id, Lineage.page_url, Lineage.input_hash)
+            .where(Lineage.stage == record_cls.__tablename__)
+            .where(Lineage.page_url.in_(page_urls[start:start + 500])), Lineage, **filters
+        ).order_by(Lineage.id)):
+            if (school_id, page_url) in keys:
+                hashes[(school_id, page_url)] = input_hash
+    return hashes
+
+
+if __name__ == "__main__":
+    from cps_childcare.database import engine
+
+    cluster_all_schools(engine)
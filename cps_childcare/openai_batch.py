@@ -0,0 +1,214 @@
+"""
+OpenAI Batch API mode for the extraction passes in 03 and 04.  Neither needs answers right away,
+and batches get much higher throughput (and half price) compared to calling the API page by page.
+Pending pages are packed into JSONL files under `data/openai_batches/`, uploaded and submitted, and
+each batch and the pages in it are tracked in the `openaibatch` / `openaibatchrequest` tables.  A
+later run picks up the finished batches and saves their results.
+
+Point `OPENAI_BASE_URL` at `python -m cps_childcare.local_openai` to run against a fake server.
+"""
+import json
+import os
+from datetime import datetime, timezone
+
+from pydantic import BaseModel
+from sqlmodel import Session, select
+
+from cps_childcare.content_store import load_pages
+from cps_childcare.cps_data_models import CrawlerRecord, OpenAIBatch, OpenAIBatchRequest
+from cps_childcare.lineage import record_lineage
+
+
+BATCH_DIR = "data/openai_batches"
+# the api allows 50,000 requests and 200MB per batch file
+MAX_BATCH_REQUESTS = 50_000
+MAX_BATCH_BYTES = 180 * 1024 * 1024
+FINISHED_STATUSES = {"completed", "failed", "expired", "cancelled"}
+# what 03 and 04 exit with when batches are still running, so the pipeline runner knows the stage
+# isn't done yet (75 is EX_TEMPFAIL: try again later)
+PENDING_EXIT_CODE = 75
+
+
+def custom_id(stage: str, crawler_record_id: int) -> str:
+    return f"{stage}-{crawler_record_id}"
+
+
+def crawler_record_id_from(custom_id: str) -> int:
+    return int(custom_id.rsplit("-", 1)[1])
+
+
+def strict_schema(schema):
+    """
+    What structured outputs' strict mode needs of a json schema: every object closed to extra
+    properties with all of its properties required, and no null defaults.  This is what
+    `client.beta.chat.completions.parse` does to the schema, so batch requests ask for the same
+    structured output as the synchronous calls.
+    """
+    if isinstance(schema, list):
+        return [strict_schema(item) for item in schema]
+    if not isinstance(schema, dict):
+        return schema
+    schema = {key: strict_schema(value) for key, value in schema.items()}
+    if "default" in schema and schema["default"] is None:
+        del schema["default"]
+    if schema.get("type") == "object" and "properties" in schema:
+        schema["additionalProperties"] = False
+        schema["required"] = list(schema["properties"])
+    return schema
+
+
+def response_format_param(response_format: type[BaseModel]) -> dict:
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "name": response_format.__name__,
+            "schema": strict_schema(response_format.model_json_schema()),
+            "strict": True,
+        },
+    }
+
+
+def batch_request_line(stage: str, crawler_record_id: int, model: str, messages: list[dict],
+                       response_format, **params) -> str:
+    return json.dumps({
+        "custom_id": custom_id(stage, crawler_record_id),
+        "method": "POST",
+        "url": "/v1/chat/completions",
+        "body": {
+            "model": model,
+            "messages": messages,
+            "response_format": response_format_param(response_format),
+            **params,
+        },
+    })
+
+
+def in_flight_record_ids(engine, stage: str) -> set[int]:
+    """Pages that are in a batch that hasn't been ingested yet, so they shouldn't be submitted again."""
+    with Session(engine) as session:
+        return set(session.exec(
+            select(OpenAIBatchRequest.crawler_record_id)
+            .join(OpenAIBatch, OpenAIBatch.id == OpenAIBatchRequest.openai_batch_id)
+            .where(OpenAIBatch.stage == stage)
+            .where(OpenAIBatch.ingested_at == None)
+        ))
+
+
+def submit_batch(client, engine, stage: str, model: str, prompt_version: str | None,
+                 crawler_record_ids: list[int], lines: list[str]) -> OpenAIBatch:
+    os.makedirs(BATCH_DIR, exist_ok=True)
+    batch_file = os.path.join(BATCH_DIR, f"{stage}-{datetime.now(timezone.utc):%Y%m%dT%H%M%S%f}.jsonl")
+    with open(batch_file, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+    with open(batch_file, "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint="/v1/chat/completions",
+        completion_window="24h",
+        metadata={"stage": stage, "prompt_version": prompt_version or ""},
+    )
+
+    with Session(engine) as session:
+        batch_row = OpenAIBatch(batch_id=batch.id, stage=stage, openai_model_name=model, prompt_version=prompt_version,
+                                input_file_id=input_file.id, status=batch.status, n_requests=len(lines))
+        session.add(batch_row)
+        session.flush()
+        session.bulk_insert_mappings(OpenAIBatchRequest, [
+            {"openai_batch_id": batch_row.id, "crawler_record_id": crawler_record_id}
+            for crawler_record_id in crawler_record_ids
+        ])
+        session.commit()
+        session.refresh(batch_row)
+
+    print(f"Submitted batch {batch.id} with {len(lines)} {stage} requests ({batch_file})")
+    return batch_row
+
+
+def submit_batches(client, engine, stage: str, model: str, prompt_version: str | None, requests) -> list[OpenAIBatch]:
+    """`requests` yields (crawler record id, request line) pairs, which get split into as few batches as fit."""
+    batches = []
+    crawler_record_ids, lines, n_bytes = [], [], 0
+    for crawler_record_id, line in requests:
+        if lines and (len(lines) >= MAX_BATCH_REQUESTS or n_bytes + len(line) + 1 > MAX_BATCH_BYTES):
+            batches.append(submit_batch(client, engine, stage, model, prompt_version, crawler_record_ids, lines))
+            crawler_record_ids, lines, n_bytes = [], [], 0
+        crawler_record_ids.append(crawler_record_id)
+        lines.append(line)
+        n_bytes += len(line.encode()) + 1
+
+    if lines:
+        batches.append(submit_batch(client, engine, stage, model, prompt_version, crawler_record_ids, lines))
+    return batches
+
+
+def ingest_output(client, engine, batch_row: OpenAIBatch, output_file_id: str, to_record) -> int:
+    results = {}
+    for line in client.files.content(output_file_id).text.splitlines():
+        if not line.strip():
+            continue
+        result = json.loads(line)
+        response = result.get("response") or {}
+        if result.get("error") or response.get("status_code") != 200:
+            print(f"Batch request {result['custom_id']} failed: {result.get('error') or response.get('body')}")
+            continue
+        results[crawler_record_id_from(result["custom_id"])] = response["body"]["choices"][0]["message"]["content"]
+
+    n_saved = 0
+    record_ids = list(results)
+    for start in range(0, len(record_ids), 500):
+        with Session(engine) as session:
+            records = session.exec(
+                select(CrawlerRecord).where(CrawlerRecord.id.in_(record_ids[start:start + 500]))
+            ).all()
+            saved = []
+            for page in load_pages(session, records):
+                try:
+                    saved.append(to_record(page, results[page.id], batch_row.openai_model_name, batch_row.prompt_version))
+                except Exception as e:
+                    print(f"Error saving batch result for {page.page_url}: {e}")
+            session.add_all(saved)
+            record_lineage(session, saved)
+            session.commit()
+            n_saved += len(saved)
+    return n_saved
+
+
+def ingest_batches(client, engine, stage: str, to_record) -> int:
+    """
+    Check on every batch for `stage` that hasn't been ingested yet, and save the results of the
+    finished ones with `to_record(page, response content, model, prompt_version)`.  Returns how
+    many batches are still running.  Pages whose requests failed aren't saved, so they get sent
+    again with the next batch.
+    """
+    with Session(engine) as session:
+        batch_rows = session.exec(
+            select(OpenAIBatch).where(OpenAIBatch.stage == stage).where(OpenAIBatch.ingested_at == None)
+        ).all()
+
+    n_running = 0
+    for batch_row in batch_rows:
+        batch = client.batches.retrieve(batch_row.batch_id)
+        n_saved = 0
+        if batch.status in FINISHED_STATUSES and batch.output_file_id:
+            n_saved = ingest_output(client, engine, batch_row, batch.output_file_id, to_record)
+
+        with Session(engine) as session:
+            batch_row = session.get(OpenAIBatch, batch_row.id)
+            batch_row.status = batch.status
+            batch_row.output_file_id = batch.output_file_id
+            batch_row.error_file_id = batch.error_file_id
+            batch_row.updated_at = datetime.now(timezone.utc)
+            if batch.status in FINISHED_STATUSES:
+                batch_row.ingested_at = datetime.now(timezone.utc)
+            session.add(batch_row)
+            session.commit()
+
+        if batch.status in FINISHED_STATUSES:
+            print(f"Batch {batch.id} {batch.status}: saved {n_saved} of {batch_row.n_requests} results")
+        else:
+            n_running += 1
+            print(f"Batch {batch.id} is {batch.status}")
+
+    return n_running
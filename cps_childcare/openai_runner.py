@@ -0,0 +1,143 @@
+"""
+Concurrent, rate-limit-aware OpenAI calls.  `OpenAIRunner` keeps a bounded number of pages in flight,
+`RateLimiter` holds them to the account's requests/min and tokens/min with a token bucket for each
+(adjusted from the `x-ratelimit-*` headers OpenAI sends back).  The results are handed to a callback,
+usually `RecordWriter.put` from cps_childcare/record_writer.py.
+
+Point `OPENAI_BASE_URL` at `python -m cps_childcare.local_openai` to run against a fake server.
+"""
+import asyncio
+import random
+import re
+import time
+
+import openai
+
+
+def parse_reset(value: str | None) -> float | None:
+    """Parse OpenAI's reset durations like "1s", "6m0s" or "20ms" into seconds."""
+    if not value:
+        return None
+    seconds = 0.0
+    for amount, unit in re.findall(r"([\d.]+)(ms|s|m|h)", value):
+        seconds += float(amount) * {"ms": 0.001, "s": 1, "m": 60, "h": 3600}[unit]
+    return seconds
+
+
+class TokenBucket:
+    """Allows `per_minute` units a minute, refilled continuously, with up to a minute's worth banked."""
+    def __init__(self, per_minute: float):
+        self.per_minute = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.level = min(self.per_minute, self.level + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1):
+        # one waiter at a time so that big requests don't get starved by small ones
+        async with self.lock:
+            amount = min(amount, self.per_minute)
+            while True:
+                self.refill()
+                if self.level >= amount:
+                    self.level -= amount
+                    return
+                await asyncio.sleep((amount - self.level) * 60 / self.per_minute)
+
+    def update(self, limit: float | None = None, remaining: float | None = None):
+        self.refill()
+        if limit:
+            self.per_minute = limit
+            self.level = min(self.level, limit)
+        if remaining is not None:
+            # the server knows about requests we haven't heard back from yet
+            self.level = min(self.level, remaining)
+
+
+class RateLimiter:
+    def __init__(self, requests_per_minute: float = 500, tokens_per_minute: float = 200_000):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.paused_until = 0.0
+
+    async def acquire(self, n_tokens: int):
+        while (delay := self.paused_until - time.monotonic()) > 0:
+            await asyncio.sleep(delay)
+        await self.requests.acquire(1)
+        await self.tokens.acquire(n_tokens)
+
+    def update_from_headers(self, headers):
+        def number(name):
+            value = headers.get(name)
+            return float(value) if value is not None else None
+
+        self.requests.update(number("x-ratelimit-limit-requests"), number("x-ratelimit-remaining-requests"))
+        self.tokens.update(number("x-ratelimit-limit-tokens"), number("x-ratelimit-remaining-tokens"))
+
+    def pause(self, headers):
+        """Stop sending anything until the limit that got hit resets."""
+        if headers.get("retry-after-ms"):
+            delay = float(headers["retry-after-ms"]) / 1000
+        elif headers.get("retry-after"):
+            delay = float(headers["retry-after"])
+        else:
+            delay = max(parse_reset(headers.get("x-ratelimit-reset-requests")) or 0,
+                        parse_reset(headers.get("x-ratelimit-reset-tokens")) or 0) or 1.0
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+
+
+class OpenAIRunner:
+    """
+    Runs `process(item)` for every item with at most `max_in_flight` running at once, retrying
+    rate limits (after pausing the limiter) and transient API errors.  Non-None results are handed
+    to `on_result`, which mustn't block.  Any other exception is reported and that item is skipped.
+    """
+    def __init__(self, limiter: RateLimiter, max_in_flight: int = 32, max_retries: int = 6):
+        self.limiter = limiter
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.n_done = 0
+        self.n_failed = 0
+
+    async def call(self, process, item):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await process(item)
+            except openai.RateLimitError as e:
+                self.limiter.update_from_headers(e.response.headers)
+                self.limiter.pause(e.response.headers)
+                error = e
+            except (openai.APIConnectionError, openai.InternalServerError) as e:
+                await asyncio.sleep(min(300, 2 ** attempt + random.random()))
+                error = e
+        raise error
+
+    async def worker(self, queue: asyncio.Queue, process, on_result, describe):
+        while (item := await queue.get()) is not None:
+            try:
+                result = await self.call(process, item)
+                if result is not None:
+                    on_result(result)
+                self.n_done += 1
+            except Exception as e:
+                self.n_failed += 1
+                print(f"Error processing {describe(item)}: {e}")
+
+            if (self.n_done + self.n_failed) % 100 == 0:
+                print(f"{self.n_done} done, {self.n_failed} failed")
+
+    async def run(self, items, process, on_result, describe=str):
+        # the queue only holds a few items beyond what's in flight, so `items` can be a generator
+        queue = asyncio.Queue(maxsize=self.max_in_flight)
+        workers = [asyncio.create_task(self.worker(queue, process, on_result, describe))
+                   for _ in range(self.max_in_flight)]
+        for item in items:
+            await queue.put(item)
+        for _ in workers:
+            await queue.put(None)
+        await asyncio.gather(*workers)
+        print(f"{self.n_done} done, {self.n_failed} failed")
@@ -0,0 +1,11 @@
+"""
+Runs the numbered scripts (and the dedup, boilerplate and near-duplicate passes) as one pipeline.
+The stages and what each one reads and writes are in `stages.py`, and `runner.py` runs them in
+dependency order, in parallel where it can, with a checkpoint per stage.
+
+    cps-pipeline --dry-run
+    cps-pipeline --from extract --stage-args extract="--batch"
+    cps-pipeline --only neighborhoods embed
+"""
+from cps_childcare.pipeline.runner import plan, run
+from cps_childcare.pipeline.stages import STAGES, Stage, dependencies, downstream
@@ -0,0 +1,4 @@
+from cps_childcare.pipeline.cli import main
+
+
+main()
@@ -0,0 +1,64 @@
+import argparse
+import shlex
+import sys
+
+from cps_childcare.pipeline.runner import mark_done, plan, read_checkpoint, run
+from cps_childcare.pipeline.stages import STAGES, dependencies
+
+
+def parse_stage_args(values: list[str]) -> dict[str, tuple[str, ...]]:
+    stage_args = {}
+    for value in values:
+        name, _, args = value.partition("=")
+        stage_args[name] = tuple(shlex.split(args))
+    return stage_args
+
+
+def print_stages(selected: list[str]):
+    deps = dependencies()
+    for stage in STAGES:
+        checkpoint = read_checkpoint(stage.name)
+        status = f"done {checkpoint['finished_at']}" if checkpoint else "never run"
+        marker = "*" if stage.name in selected else " "
+        after = f" (after {', '.join(deps[stage.name])})" if deps[stage.name] else ""
+        print(f"{marker} {stage.name:<17} {status:<42} {stage.description}{after}")
+
+
+def main():
+    names = [stage.name for stage in STAGES]
+    parser = argparse.ArgumentParser(description="Run the pipeline's stages in dependency order, independent ones in parallel.")
+    selection = parser.add_mutually_exclusive_group()
+    selection.add_argument("--only", nargs="+", choices=names, metavar="STAGE", help="run just these stages")
+    selection.add_argument("--from", dest="start", choices=names, metavar="STAGE",
+                           help="run this stage and everything downstream of it")
+    parser.add_argument("--force", action="store_true", help="ignore the checkpoints and run every stage")
+    parser.add_argument("--max-parallel", type=int, default=4, help="how many stages can run at once")
+    parser.add_argument("--stage-args", nargs="+", default=[], metavar="STAGE=ARGS",
+                        help="extra arguments for a stage's script, e.g. extract=\"--batch\"")
+    parser.add_argument("--dry-run", action="store_true", help="list the stages and which ones would run")
+    parser.add_argument("--mark-done", nargs="+", default=[], choices=names, metavar="STAGE",
+                        help="checkpoint these stages without running them, e.g. once the Airtable upload is done")
+    args = parser.parse_args()
+
+    if args.mark_done:
+        for stage in STAGES:
+            if stage.name in args.mark_done:
+                mark_done(stage)
+                print(f"Marked {stage.name} as done")
+        return
+
+    selected = plan(only=args.only, start=args.start, force=args.force)
+    if args.dry_run:
+        print_stages(selected)
+        return
+
+    if not selected:
+        print("Every stage is up to date, use --from, --only or --force to run them again")
+        return
+    print(f"Running {', '.join(selected)}")
+    if not run(selected, max_parallel=args.max_parallel, extra_args=parse_stage_args(args.stage_args)):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
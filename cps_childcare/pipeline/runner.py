@@ -0,0 +1,155 @@
+"""
+Runs the stages in dependency order, each in its own process, with independent stages running at the
+same time (the neighborhood geocoding in 06 runs alongside the crawl and LLM passes, and the
+embedding in 09 alongside 03 and 04).  A stage that finishes writes a checkpoint under
+`data/pipeline/`, and later runs skip it until it's selected again or one of its dependencies has
+run since.  A stage that fails doesn't get a checkpoint, and the stages downstream of it are skipped.
+So does a stage that exits with `PENDING_EXIT_CODE`, which is how 03 and 04 say they're waiting on
+OpenAI batches with `--batch`: rerunning the pipeline once the batches are done picks up from there.
+A manual stage (the Airtable upload) stops the run the same way until it's marked done.
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from cps_childcare.dependency_executor import DependencyExecutor
+from cps_childcare.openai_batch import PENDING_EXIT_CODE
+from cps_childcare.pipeline.stages import STAGES, Stage, dependencies, downstream
+
+
+ROOT = Path(__file__).resolve().parents[2]
+CHECKPOINT_DIR = ROOT / "data" / "pipeline"
+
+# only one process prints at a time, so the prefixed lines don't interleave
+_print_lock = threading.Lock()
+
+
+class StageSkipped(Exception):
+    pass
+
+
+class StagePending(Exception):
+    pass
+
+
+def checkpoint_path(name: str) -> Path:
+    return CHECKPOINT_DIR / f"{name}.json"
+
+
+def read_checkpoint(name: str) -> dict | None:
+    path = checkpoint_path(name)
+    if not path.exists():
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def write_checkpoint(name: str, checkpoint: dict):
+    CHECKPOINT_DIR.mkdir(parents=True, exist_ok=True)
+    # write then rename, so an interrupted run never leaves half a checkpoint
+    tmp_path = checkpoint_path(name).with_suffix(".json.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(checkpoint, f, indent=2)
+    os.replace(tmp_path, checkpoint_path(name))
+
+
+def mark_done(stage: Stage) -> dict:
+    """Checkpoint a stage without running it, e.g. once a manual step has been done."""
+    now = datetime.now(timezone.utc).isoformat()
+    checkpoint = {
+        "stage": stage.name,
+        "command": list(stage.command),
+        "started_at": now,
+        "finished_at": now,
+        "duration": 0,
+        "outputs": list(stage.outputs),
+        "marked_done": True,
+    }
+    write_checkpoint(stage.name, checkpoint)
+    return checkpoint
+
+
+def plan(stages: list[Stage] = STAGES, only: list[str] | None = None, start: str | None = None,
+         force: bool = False) -> list[str]:
+    """
+    The stages to run, in pipeline order.  `only` runs just those stages and `start` runs a stage and
+    everything downstream of it, whatever their checkpoints say.  Otherwise every stage without a
+    checkpoint runs, along with anything downstream of a stage that runs or has run more recently.
+    """
+    if only:
+        return [stage.name for stage in stages if stage.name in only]
+    if start:
+        return downstream(start, stages)
+
+    deps = dependencies(stages)
+    checkpoints = {stage.name: read_checkpoint(stage.name) for stage in stages}
+    selected = []
+    for stage in stages:
+        checkpoint = checkpoints[stage.name]
+        stale = force or checkpoint is None or any(
+            dep in selected or checkpoints[dep]["finished_at"] > checkpoint["finished_at"]
+            for dep in deps[stage.name] if dep in selected or checkpoints[dep] is not None
+        )
+        if stale:
+            selected.append(stage.name)
+    return selected
+
+
+def run_stage(stage: Stage, after=(), extra_args: tuple[str, ...] = ()) -> dict:
+    failed = [future for future in after if future.exception() is not None]
+    if failed:
+        raise StageSkipped(f"{stage.name} skipped, {len(failed)} of its dependencies didn't finish")
+
+    if not stage.command:
+        raise StagePending(f"{stage.name} has to be done by hand: {stage.description}.  Then run "
+                           f"`cps-pipeline --mark-done {stage.name}` and run the pipeline again")
+
+    started_at = datetime.now(timezone.utc)
+    start = time.perf_counter()
+    with _print_lock:
+        print(f"[{stage.name}] starting: {stage.description}")
+    process = subprocess.Popen([sys.executable, *stage.command, *extra_args], cwd=ROOT, text=True,
+                               stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=1)
+    for line in process.stdout:
+        with _print_lock:
+            print(f"[{stage.name}] {line}", end="")
+    returncode = process.wait()
+    duration = time.perf_counter() - start
+    if returncode == PENDING_EXIT_CODE:
+        raise StagePending(f"{stage.name} is waiting on OpenAI batches, run the pipeline again once they're done")
+    if returncode != 0:
+        raise RuntimeError(f"{stage.name} exited with {returncode} after {duration:.0f}s")
+
+    checkpoint = {
+        "stage": stage.name,
+        "command": [*stage.command, *extra_args],
+        "started_at": started_at.isoformat(),
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "duration": duration,
+        "outputs": list(stage.outputs),
+    }
+    write_checkpoint(stage.name, checkpoint)
+    with _print_lock:
+        print(f"[{stage.name}] done in {duration:.0f}s")
+    return checkpoint
+
+
+def run(selected: list[str], stages: list[Stage] = STAGES, max_parallel: int = 4,
+        extra_args: dict[str, tuple[str, ...]] | None = None) -> bool:
+    """Run the selected stages, each as soon as its selected dependencies are done.  True if they all finished."""
+    extra_args = extra_args or {}
+    deps = dependencies(stages)
+    futures = {}
+    with DependencyExecutor(max_workers=max_parallel) as executor:
+        for stage in stages:
+            if stage.name not in selected:
+                continue
+            # dependencies that aren't being run this time are taken as they are
+            after = [futures[dep] for dep in deps[stage.name] if dep in futures]
+            futures[stage.name] = executor.submit(run_stage, stage, after, extra_args.get(stage.name, ()), after=after)
+    return executor.n_failed == 0
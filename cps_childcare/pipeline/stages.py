@@ -0,0 +1,94 @@
+"""
+The stages of the pipeline, in the order the README lists them.  Each stage is one of the numbered
+scripts (or one of the `python -m cps_childcare...` passes) run in its own process, and declares what
+it reads and what it writes: files under data/, sqlite tables ("db:...") and Airtable tables
+("airtable:...").  A stage depends on the earlier stages that write something it reads.  A stage
+without a command is a step that gets done by hand, and the run stops there until it's marked done.
+"""
+from dataclasses import dataclass
+
+
+@dataclass(frozen=True)
+class Stage:
+    name: str
+    # what to run with the python interpreter, from the root of the repo.  empty for a manual step
+    command: tuple[str, ...]
+    inputs: tuple[str, ...] = ()
+    outputs: tuple[str, ...] = ()
+    description: str = ""
+
+
+CRAWL = ("db:crawlerrecord", "db:crawlerrecordcontent")
+
+STAGES = [
+    Stage("scrape", ("scripts/01_cps_scraper.py",),
+          outputs=("data/cps_schools_contacts.csv",),
+          description="scrape the CPS school list and each school's website url"),
+    Stage("upload", (),
+          inputs=("data/cps_schools_contacts.csv",),
+          outputs=("airtable:raw",),
+          description="upload data/cps_schools_contacts.csv to the raw Airtable table by hand"),
+    Stage("crawl", ("scripts/02_cps_firecrawl.py",),
+          inputs=("airtable:raw",),
+          outputs=CRAWL + ("db:firecrawljob",),
+          description="crawl each school's website with Firecrawl"),
+    Stage("dedup", ("-m", "cps_childcare.dedup"),
+          inputs=CRAWL,
+          outputs=("db:crawlerrecord.duplicate_of_id",),
+          description="link exact-duplicate pages to their canonical copy"),
+    Stage("boilerplate", ("-m", "cps_childcare.boilerplate"),
+          inputs=CRAWL,
+          outputs=("db:crawlerrecordcontent.stripped_markdown", "db:boilerplateblock"),
+          description="strip the nav/footer/sidebar blocks that repeat across each site"),
+    Stage("near_duplicates", ("-m", "cps_childcare.near_duplicates"),
+          inputs=CRAWL + ("db:crawlerrecord.duplicate_of_id", "db:crawlerrecordcontent.stripped_markdown"),
+          outputs=("db:neardupcluster",),
+          description="cluster each school's near-duplicate pages"),
+    Stage("extract", ("scripts/03_cps_openai.py",),
+          inputs=CRAWL + ("db:crawlerrecord.duplicate_of_id", "db:crawlerrecordcontent.stripped_markdown",
+                          "db:neardupcluster"),
+          outputs=("db:crawleropenairecord",),
+          description="extract emails and before/after care details from each page"),
+    Stage("combine", ("scripts/04_cps_openai_aggregate.py",),
+          inputs=CRAWL + ("db:crawleropenairecord", "db:neardupcluster"),
+          outputs=("db:childcareopenairecord", "db:combinedchildcareopenairecord"),
+          description="extract the care details from the care pages and combine them per school"),
+    Stage("update_childcare", ("scripts/05_update_childcare_airtable.py",),
+          inputs=("db:combinedchildcareopenairecord",),
+          outputs=("airtable:childcare",),
+          description="update the childcare Airtable table with the combined records"),
+    Stage("neighborhoods", ("scripts/06_append_neighborhood_to_airtable.py",),
+          inputs=("airtable:raw", "data/Boundaries - Community Areas (current).geojson"),
+          outputs=("airtable:raw.neighborhood", "db:schooltoneighborhood"),
+          description="geocode each school into its neighborhood"),
+    Stage("school_demos", ("scripts/07_update_school_demos_airtable.py",),
+          inputs=("data/cps_schools_contacts.csv", "airtable:raw.neighborhood", "airtable:childcare"),
+          outputs=("db:neighborhood", "airtable:childcare.demographics"),
+          description="add the school and neighborhood demographics to Airtable"),
+    Stage("final_csv", ("scripts/08_write_final_csv.py",),
+          inputs=("airtable:childcare", "airtable:childcare.demographics"),
+          outputs=("data/final_childcare_dataset.csv",),
+          description="write the csv the webapp uses"),
+    Stage("embed", ("scripts/09_chunk_and_embed.py",),
+          inputs=CRAWL + ("db:crawlerrecord.duplicate_of_id", "db:crawlerrecordcontent.stripped_markdown"),
+          outputs=("data/embeddings.lancedb",),
+          description="chunk and embed the pages into LanceDB"),
+]
+
+
+def dependencies(stages: list[Stage] = STAGES) -> dict[str, list[str]]:
+    """Each stage's direct dependencies: the earlier stages that write something it reads."""
+    deps = {}
+    for num, stage in enumerate(stages):
+        deps[stage.name] = [earlier.name for earlier in stages[:num] if set(earlier.outputs) & set(stage.inputs)]
+    return deps
+
+
+def downstream(name: str, stages: list[Stage] = STAGES) -> list[str]:
+    """The stage and every stage that depends on it, directly or not, in pipeline order."""
+    deps = dependencies(stages)
+    selected = {name}
+    for stage in stages:
+        if any(dep in selected for dep in deps[stage.name]):
+            selected.add(stage.name)
+    return [stage.name for stage in stages if stage.name in selected]
@@ -0,0 +1,222 @@
+"""
+Versioned prompt templates for the three LLM passes (page extraction in 03, and the care details and
+per-school combine passes in 04), plus token counting.  Templates are dedented once when they're
+registered and then only filled in per page, and each model's tokenizer is loaded once.  The one
+exception is care_details v1, which has always been sent indented and is registered as-is.  Since
+every token is at least one byte, a page's utf-8 length is a free upper bound on its token count, so
+only pages that might be over a limit actually get tokenized.
+"""
+from dataclasses import dataclass
+from functools import lru_cache
+from textwrap import dedent
+
+import tiktoken
+
+
+@dataclass(frozen=True)
+class PromptTemplate:
+    stage: str
+    version: str
+    system: str
+    template: str
+
+    def render(self, **fields) -> str:
+        return self.template.format(**fields)
+
+    def messages(self, prompt: str) -> list[dict]:
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": prompt}
+        ]
+
+
+PROMPTS: dict[tuple[str, str], PromptTemplate] = {}
+
+
+def register(stage: str, version: str, system: str, template: str, dedented: bool = True) -> PromptTemplate:
+    prompt = PromptTemplate(stage=stage, version=version, system=system,
+                            template=dedent(template) if dedented else template)
+    PROMPTS[(stage, version)] = prompt
+    return prompt
+
+
+def get_prompt(stage: str, version: str) -> PromptTemplate:
+    try:
+        return PROMPTS[(stage, version)]
+    except KeyError:
+        raise ValueError(f"Invalid prompt version for {stage}: {version}") from None
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(model: str):
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+def token_upper_bound(text: str) -> int:
+    # every token is at least one byte of utf-8
+    return len(text.encode())
+
+
+def count_tokens(text: str, model: str = "gpt-4o-mini") -> int:
+    return len(get_tokenizer(model).encode_ordinary(text))
+
+
+def estimate_tokens(text: str) -> int:
+    """About what OpenAI counts a request as against the tokens/min limit."""
+    return len(text) // 4 + 1
+
+
+# step 3: emails, contact pages and before/after care details from every page
+PAGE_EXTRACTION_SYSTEM = "You are an AI expert tasked with understanding elementary and high school websites."
+
+register("page_extraction", "v1", PAGE_EXTRACTION_SYSTEM, """
+For the web page markdown given to you, extract the following information from it:
+- Extract all email addresses as a list. Leave the list empty if there aren't any.
+- If the page is a contact page or contact us page, set is_contact_page to True.
+- If the page describes a before or after school childcare program, extract those details into before_or_after_care_details.  Otherwise leave it empty.
+
+Follow these rules:
+- We ONLY care about before or after care CHILDCARE programs, not general instructions about what students are supposed to do before and after school.  DO NOT include general instructions about what students are supposed to do before and after school.
+- DO NOT infer that before or after care is likely and mention that.
+- A page is NOT a before or after childcare page if it just links to a page with those deatils.
+- DO NOT mention if the page doesn't talk about before or after childcare.
+
+DON'T say things like the following.  These are BAD responses:
+- "The page does not provide specific details about before or after school childcare programs"
+- "The page provides a link to the Before & After School Programs but does not include specific details about the programs themselves."
+- "Students must enter and exit through Door 2. Students must wait patiently in the foyer. Once you exit the building for the day, you will not be allowed back in the building."
+- "Plan ahead for before and after school programs."
+- "After school programs will run as normal."
+
+A good extraction looks like:
+- "Peirce partners with the Lakeview YMCA to offer before and after school care for students in Kindergarten through 8th grades. Programs are run at Peirce School but organized and run by the YMCA. Before care runs from 7:00-8:00 am and after care runs from 3:00 - 6:00 pm."
+
+It's currently the year 2024--DO NOT include information on childcare programs from previous years.
+
+Page URL: {page_url}
+Page Title: {page_title}
+Page Description:  {description}
+Page Markdown: {page_markdown}
+""")
+
+register("page_extraction", "v2", PAGE_EXTRACTION_SYSTEM, """
+For the web page markdown given to you, extract the following information from it:
+- Extract all email addresses as a list. Leave the list empty if there aren't any.
+- If the page is a contact page or contact us page, set is_contact_page to True.
+- If the page describes a before or after school childcare program, extract those details into before_or_after_care_details.  Otherwise leave it empty.
+
+Follow these rules:
+- We ONLY care about before or after care CHILDCARE programs, not general instructions about what students are supposed to do before and after school.  DO NOT include general instructions about what students are supposed to do before and after school.
+- DO NOT infer that before or after care is likely and mention that.
+- A page is NOT a before or after childcare page if it just links to a page with those deatils.
+- DO NOT mention if the page doesn't talk about before or after childcare.
+- The abbreviation "OST" stands for "Out of School Time" and should be included.
+- Right at School, Park District, and YMCA programs should be included.
+
+DON'T say things like the following.  These are BAD responses:
+- "The page does not provide specific details about before or after school childcare programs"
+- "The page provides a link to the Before & After School Programs but does not include specific details about the programs themselves."
+- "Students must enter and exit through Door 2. Students must wait patiently in the foyer. Once you exit the building for the day, you will not be allowed back in the building."
+- "Plan ahead for before and after school programs."
+- "After school programs will run as normal."
+
+A good extraction looks like:
+- "Peirce partners with the Lakeview YMCA to offer before and after school care for students in Kindergarten through 8th grades. Programs are run at Peirce School but organized and run by the YMCA. Before care runs from 7:00-8:00 am and after care runs from 3:00 - 6:00 pm."
+- "We have two after school options - Right At School and Park District."
+
+It's currently the year 2024--DO NOT include information on childcare programs from previous years.
+
+Page URL: {page_url}
+Page Title: {page_title}
+Page Description:  {description}
+Page Markdown: {page_markdown}
+""")
+
+register("page_extraction", "v3", PAGE_EXTRACTION_SYSTEM, """
+For the web page markdown given to you, extract the following information from it:
+- Extract all email addresses as a list. Leave the list empty if there aren't any.
+- If the page is a contact page or contact us page, set is_contact_page to True.
+- If the page describes a before or after school childcare program, extract those details into before_or_after_care_details.  Otherwise leave it empty.
+
+Follow these rules:
+- We ONLY care about before or after care CHILDCARE programs, not general instructions about what students are supposed to do before and after school.  DO NOT include general instructions about what students are supposed to do before and after school.
+- DO NOT infer that before or after care is likely and mention that.
+- DO NOT mention if the page doesn't talk about before or after childcare.
+- If a page mentions that a childcare program starts on a certain date in 2024 or 2025, include it.
+- The abbreviation "OST" stands for "Out of School Time" and should be included.
+- Extended Day programs should be included.
+- Right at School, Park District, and YMCA programs should be included.
+
+DON'T say things like the following.  These are BAD responses:
+- "The page does not provide specific details about before or after school childcare programs"
+- "The page provides a link to the Before & After School Programs but does not include specific details about the programs themselves."
+- "Students must enter and exit through Door 2. Students must wait patiently in the foyer. Once you exit the building for the day, you will not be allowed back in the building."
+- "Plan ahead for before and after school programs."
+- "After school programs will run as normal."
+
+A good extraction looks like:
+- "Peirce partners with the Lakeview YMCA to offer before and after school care for students in Kindergarten through 8th grades. Programs are run at Peirce School but organized and run by the YMCA. Before care runs from 7:00-8:00 am and after care runs from 3:00 - 6:00 pm."
+- "We have two after school options - Right At School and Park District."
+
+It's currently the year 2024--DO NOT include information on childcare programs from previous years.
+
+Page URL: {page_url}
+Page Title: {page_title}
+Page Description:  {description}
+Page Markdown: {page_markdown}
+""")
+
+
+# step 4: the structured before/after care details from the pages step 3 flagged
+CARE_DETAILS_SYSTEM = "You are an AI expert tasked with understanding elementary school websites."
+
+# v1 has always been sent with this indentation, so it isn't dedented (that would make it a different prompt)
+register("care_details", "v1", CARE_DETAILS_SYSTEM, """
+    Here is an elementary school webpage. If present, extract information about before and after school child care.
+    Follow these rules:
+    - We ONLY care about before or after care CHILDCARE programs, not general instructions about what students are supposed to do before and after school, or about summer programs, or about sports.
+    - Don't include info on summer camps or day camps.
+    - Sometimes these programs are called "OST", "Out of School Time", or "Right at School" programs.
+    - For the fields "before_care_quote_snippet" and "after_care_quote_snippet", return the EXACT QUOTED TEXT from the webpage "Content" that is the most relevant snippet to your answer.  DO NOT CHANGE ANY WORDS.
+
+    ## Webpage
+    #URL:
+    {page_url}
+    #Description:
+    {page_title}
+    #Content to Quote From:
+    "{page_markdown}"
+
+    ## Answer:
+    """, dedented=False)
+
+# step 4: all of a school's care details combined into one
+register("combine", "v2", PAGE_EXTRACTION_SYSTEM, """
+Here is a numbered list of json objects extracted from webpages about a single elementary school.  Use the
+information to synthesize a single, high quality overview of the school's before and after school child care program.
+- Prefer pages where the "before_care_quote_snippet_verified" and "after_care_quote_snippet_verified" fields are True over ones where they are False.
+- If there are multiple pages that contain the same information, prefer the one with the highest quality "before_care_quote_snippet_verified" and "after_care_quote_snippet_verified" fields.
+- If there are multiple pages that contain the same information, prefer the one with the most recent "webpage_year" field.
+- You MUST cite your sources by listing the source number in "before_care_citations" and "after_care_citations".
+
+## Webpages
+{context}
+
+## Answer:""")
+
+# step 4 in retrieval mode: a school's top before/after care chunks combined directly, see cps_childcare/retrieval.py
+register("combine", "v3", PAGE_EXTRACTION_SYSTEM, """
+Here is a numbered list of excerpts from the webpages of a single elementary school, the ones most likely to be
+about its before and after school child care.  Use them to synthesize a single, high quality overview of the
+school's before and after school child care program.
+- Only use information that is in the excerpts.  If none of them say whether there's before or after care, leave it null.
+- If excerpts disagree, prefer the one that is about the most recent school year.
+- You MUST cite your sources by listing the excerpt number in "before_care_citations" and "after_care_citations".
+
+## Excerpts
+{context}
+
+## Answer:""")
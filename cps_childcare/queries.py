@@ -0,0 +1,173 @@
+"""
+The queries that find the pending work for the LLM passes: the pages 03 hasn't extracted yet, the
+pages 04 hasn't pulled care details from yet.  A page counts as done once it has a result from the
+same model and prompt version made from its current content, going by the `lineage` table (see
+cps_childcare/lineage.py), so recrawled pages that changed get picked up again.  They only select the
+crawler record columns the passes use, and they're written as NOT EXISTS anti-joins on
+(school_id, page_url[, model, prompt_version]) so sqlite can answer them from the composite indexes
+on those columns instead of scanning, sorting and windowing the result tables.
+
+The passes only load the pending page ids up front, and `iter_pages` streams the pages themselves a
+batch at a time, so memory stays flat however big the crawl gets.
+
+Run `python benchmarks/pending_queries.py` to see how they scale with the number of rows.
+"""
+from collections import defaultdict
+from typing import Iterator
+
+from sqlalchemy import column, table
+from sqlalchemy.orm import aliased
+from sqlmodel import Session, func, select
+
+from cps_childcare.content_store import CrawledPage, has_markdown, load_pages
+from cps_childcare.cps_data_models import ChildcareOpenAIRecord, CrawlerOpenAIRecord, CrawlerRecord, Lineage
+from cps_childcare.near_duplicates import is_cluster_representative
+
+
+# everything the passes read from a page besides its content
+PAGE_COLUMNS = (
+    CrawlerRecord.id,
+    CrawlerRecord.school_id,
+    CrawlerRecord.school_name,
+    CrawlerRecord.school_type,
+    CrawlerRecord.page_url,
+    CrawlerRecord.page_title,
+    CrawlerRecord.description,
+)
+ID_COLUMNS = (CrawlerRecord.id,)
+
+# how many pages' metadata and compressed content are held at once
+BATCH_SIZE = 100
+
+# added by hand, so there's no model for it
+evals = table("evals", column("school_id"), column("page_url"))
+
+
+def has_page_result(record_cls, **filters):
+    """Where clause for CrawlerRecord queries that's true if the page has a `record_cls` row matching the filters."""
+    query = select(record_cls.id).where(
+        (record_cls.school_id == CrawlerRecord.school_id) &
+        (record_cls.page_url == CrawlerRecord.page_url)
+    )
+    for name, value in filters.items():
+        query = query.where(getattr(record_cls, name) == value)
+    return query.exists()
+
+
+def has_current_result(record_cls, model_name: str, prompt_version: str):
+    """Where clause for CrawlerRecord queries that's true if the page's current content has a `record_cls` result."""
+    return select(Lineage.id).where(
+        (Lineage.stage == record_cls.__tablename__) &
+        (Lineage.school_id == CrawlerRecord.school_id) &
+        (Lineage.page_url == CrawlerRecord.page_url) &
+        (Lineage.openai_model_name == model_name) &
+        (Lineage.prompt_version == prompt_version) &
+        (Lineage.input_hash == CrawlerRecord.content_hash)
+    ).exists()
+
+
+def count_unhashed_pages(engine) -> int:
+    """
+    Crawled pages that have markdown but no content_hash, i.e. pages crawled before they were hashed.
+    Their results can never match their lineage, so 03 and 04 would redo them on every run.
+    """
+    with Session(engine) as session:
+        return session.exec(
+            select(func.count(CrawlerRecord.id))
+            .where(CrawlerRecord.status_code == 200)
+            .where(has_markdown())
+            .where(CrawlerRecord.content_hash == None)
+        ).one()
+
+
+def pages_to_extract_query(model_name: str = "gpt-4o-mini", prompt_version: str = "v1", columns=PAGE_COLUMNS):
+    """Pages 03 hasn't sent to the model yet, or that have changed since it did."""
+    return (
+        select(*columns)
+        .where(CrawlerRecord.status_code == 200)
+        .where(has_markdown())
+        # duplicate pages share their canonical page's results, and near-duplicates share their cluster's
+        .where(CrawlerRecord.duplicate_of_id == None)
+        .where(is_cluster_representative())
+        .where(~has_current_result(CrawlerOpenAIRecord, model_name, prompt_version))
+    )
+
+
+def eval_pages_to_extract_query(model_name: str = "gpt-4o-mini", prompt_version: str = "v1", columns=PAGE_COLUMNS):
+    """The pages in the evals table that haven't been run with this model and prompt version yet."""
+    return (
+        select(*columns)
+        .join(evals, (evals.c.page_url == CrawlerRecord.page_url) & (evals.c.school_id == CrawlerRecord.school_id))
+        .where(~has_page_result(CrawlerOpenAIRecord, openai_model_name=model_name, prompt_version=prompt_version))
+    )
+
+
+def care_pages_to_extract_query(model_name: str = "gpt-4o-mini", prompt_version: str = "v1",
+                                care_prompt_version: str = "v1", columns=PAGE_COLUMNS):
+    """
+    Pages whose latest 03 result (from `prompt_version`) mentions before/after care and that 04 hasn't
+    extracted with `care_prompt_version` yet, or that have changed since it did.
+    """
+    latest = aliased(CrawlerOpenAIRecord)
+    newer = aliased(CrawlerOpenAIRecord)
+    return (
+        select(*columns)
+        .join(latest, (latest.school_id == CrawlerRecord.school_id) & (latest.page_url == CrawlerRecord.page_url))
+        .where(latest.openai_model_name == model_name)
+        .where(latest.prompt_version == prompt_version)
+        .where(latest.before_or_after_care_details != "")
+        # only the most recent result for the page counts
+        .where(~select(newer.id).where(
+            (newer.school_id == latest.school_id) &
+            (newer.page_url == latest.page_url) &
+            (newer.openai_model_name == latest.openai_model_name) &
+            (newer.prompt_version == latest.prompt_version) &
+            ((newer.created_at > latest.created_at) |
+             ((newer.created_at == latest.created_at) & (newer.id > latest.id)))
+        ).exists())
+        .where(CrawlerRecord.duplicate_of_id == None)
+        # near-duplicate pages only get extracted once, through their cluster's representative
+        .where(is_cluster_representative())
+        .where(~has_current_result(ChildcareOpenAIRecord, model_name, care_prompt_version))
+    )
+
+
+def load_extracted_pages(session, school_ids) -> dict[int, list[ChildcareOpenAIRecord]]:
+    """The latest ChildcareOpenAIRecord for each of the schools' pages, grouped by school."""
+    newer = aliased(ChildcareOpenAIRecord)
+    school_ids = list(school_ids)
+    pages = defaultdict(list)
+    # stay well under sqlite's limit on query parameters
+    for start in range(0, len(school_ids), 500):
+        for record in session.exec(
+            select(ChildcareOpenAIRecord)
+            .where(ChildcareOpenAIRecord.school_id.in_(school_ids[start:start + 500]))
+            # pages that changed get extracted again, and only the newest result counts
+            .where(~select(newer.id).where(
+                (newer.school_id == ChildcareOpenAIRecord.school_id) &
+                (newer.page_url == ChildcareOpenAIRecord.page_url) &
+                (newer.id > ChildcareOpenAIRecord.id)
+            ).exists())
+            .order_by(ChildcareOpenAIRecord.id)
+        ):
+            pages[record.school_id].append(record)
+    return pages
+
+
+def load_page_ids(engine, query) -> list[int]:
+    """Run one of the queries above with `columns=ID_COLUMNS`."""
+    with Session(engine) as session:
+        return list(session.exec(query).all())
+
+
+def iter_pages(engine, ids: list[int], batch_size: int = BATCH_SIZE) -> Iterator[CrawledPage]:
+    """Yield the pages in `ids` order, loading their metadata and compressed content a batch at a time."""
+    for start in range(0, len(ids), batch_size):
+        batch_ids = ids[start:start + batch_size]
+        with Session(engine) as session:
+            records = {record.id: record for record in session.exec(
+                select(*PAGE_COLUMNS).where(CrawlerRecord.id.in_(batch_ids))
+            )}
+            # the content is only decompressed once a page is actually read
+            pages = load_pages(session, [records[page_id] for page_id in batch_ids if page_id in records])
+        yield from pages
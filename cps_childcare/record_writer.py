@@ -0,0 +1,101 @@
+"""
+The single writer for the LLM results.  Any number of workers (threads, asyncio tasks or just a loop)
+`put` SQLModel records of any type on its queue, and a background thread commits them in one
+transaction per `batch_size` records, or whatever has arrived after `flush_interval` seconds, instead
+of a session and an fsync per record.  Everything still queued is written when the writer is closed.
+The LLM results' lineage rows (see cps_childcare/lineage.py) go in the same transaction as them.
+
+    with RecordWriter(engine) as writer:
+        for page in pages:
+            writer.put(to_record(page, ...))
+"""
+import queue
+import threading
+import time
+
+from sqlmodel import Session
+
+from cps_childcare.lineage import record_lineage
+
+
+_CLOSE = object()
+
+
+class RecordWriter:
+    def __init__(self, engine, batch_size: int = 100, flush_interval: float = 5.0):
+        self.engine = engine
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.queue = queue.Queue()
+        self.n_written = 0
+        self.n_failed = 0
+        self.error = None
+        self.thread = threading.Thread(target=self.run, name="record-writer", daemon=True)
+        self.thread.start()
+
+    def put(self, record):
+        # the queue is unbounded, so this never blocks (an asyncio task can call it directly)
+        self.queue.put(record)
+
+    def put_all(self, records):
+        for record in records:
+            self.put(record)
+
+    def flush(self):
+        """Block until everything put so far has been written (or failed to be, see `close`)."""
+        # the writer commits its current batch as soon as it sees this, and then sets it
+        flushed = threading.Event()
+        self.queue.put(flushed)
+        flushed.wait()
+
+    def close(self):
+        self.queue.put(_CLOSE)
+        self.thread.join()
+        self.raise_error()
+
+    def raise_error(self):
+        if self.error is not None:
+            raise RuntimeError(f"Failed to write {self.n_failed} records") from self.error
+
+    def write(self, records: list):
+        with Session(self.engine) as session:
+            session.add_all(records)
+            record_lineage(session, records)
+            session.commit()
+        self.n_written += len(records)
+
+    def run(self):
+        done = False
+        while not done:
+            batch, flushed = [], None
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    record = self.queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if record is _CLOSE:
+                    done = True
+                    break
+                if isinstance(record, threading.Event):
+                    flushed = record
+                    break
+                batch.append(record)
+
+            if batch:
+                try:
+                    self.write(batch)
+                except Exception as e:
+                    # keep going so the other batches still get written and flush() doesn't hang,
+                    # the first error gets raised from close()
+                    self.n_failed += len(batch)
+                    self.error = self.error or e
+                    print(f"Error writing {len(batch)} records: {e}")
+            if flushed is not None:
+                flushed.set()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,174 @@
+"""
+A cheap local relevance pre-filter for the LLM pass in 03.  Only a small share of crawled pages say
+anything about before or after care, so each page is scored locally on the childcare terms it
+mentions (optionally plus how close its nomic embeddings from 09 are to a childcare query), and only
+pages at or above the threshold are sent to the LLM.  The threshold is calibrated on the hand-labelled
+`evals` table to keep a target share of the pages that do mention care (the recall).
+
+Run `python -m cps_childcare.relevance --recall 0.98` to see the calibrated threshold and how many
+pages it would skip.
+"""
+import argparse
+import math
+import re
+from collections import Counter
+
+from sqlalchemy import inspect
+from sqlmodel import Session, select, text
+
+from cps_childcare.boilerplate import content_markdown
+from cps_childcare.content_store import CrawledPage, has_markdown, load_pages
+from cps_childcare.cps_data_models import CrawlerRecord
+
+
+DEFAULT_RECALL = 0.98
+# used when there aren't any labelled evals to calibrate on
+DEFAULT_MIN_SCORE = 3.0
+# a term only counts this many times, so one long calendar page full of "pick up" doesn't win
+MAX_TERM_COUNT = 3
+
+# (pattern, weight).  the program names are strong evidence on their own, generic words only add a little.
+TERMS = [
+    (re.compile(r"\bbefore[\s_-]*(?:(?:and|&|/|or)?[\s_-]*after[\s_-]*)?(?:school|care)\b", re.IGNORECASE), 3.0),
+    (re.compile(r"\bafter[\s_-]*(?:school|care)\b", re.IGNORECASE), 2.0),
+    (re.compile(r"\bextended[\s_-]*day\b", re.IGNORECASE), 3.0),
+    (re.compile(r"\bout[\s_-]*of[\s_-]*school[\s_-]*time\b", re.IGNORECASE), 3.0),
+    # case sensitive, "ost" is a common substring and a common typo
+    (re.compile(r"\bOST\b"), 3.0),
+    (re.compile(r"\bright[\s_-]*at[\s_-]*school\b", re.IGNORECASE), 5.0),
+    (re.compile(r"\bymca\b", re.IGNORECASE), 4.0),
+    (re.compile(r"\bboys[\s_-]*(?:&|and)[\s_-]*girls[\s_-]*clubs?\b", re.IGNORECASE), 3.0),
+    (re.compile(r"\blatch[\s_-]*key\b", re.IGNORECASE), 4.0),
+    (re.compile(r"\bchild[\s_-]*care\b", re.IGNORECASE), 3.0),
+    (re.compile(r"\bday[\s_-]*care\b", re.IGNORECASE), 2.0),
+    (re.compile(r"\bsafe[\s_-]*haven\b", re.IGNORECASE), 1.0),
+    (re.compile(r"\b(?:drop|pick)[\s_-]*(?:off|up)\b", re.IGNORECASE), 0.5),
+    (re.compile(r"\b\d{1,2}(?::\d{2})?\s*[ap]\.?m\b", re.IGNORECASE), 0.5),
+]
+
+EMBEDDING_QUERY = "before school and after school care programs, times and providers"
+EMBEDDING_MODEL = "nomic-ai/nomic-embed-text-v1.5"
+EMBEDDING_WEIGHT = 5.0
+VECTOR_DB_URI = "data/embeddings.lancedb"
+TABLE_NAME = "webpagechunk"
+
+# the labels in the evals table that mean a page has no before/after care details
+NEGATIVE_LABELS = {"", "none", "no", "false", "0", "n/a", "na"}
+
+
+def page_text(page: CrawledPage) -> str:
+    return "\n".join([page.page_url, page.page_title or "", content_markdown(page) or ""])
+
+
+def keyword_score(text: str) -> float:
+    return sum(weight * min(len(pattern.findall(text)), MAX_TERM_COUNT) for pattern, weight in TERMS)
+
+
+def embedding_similarities(query: str = EMBEDDING_QUERY, limit: int = 5000) -> dict[str, float]:
+    """The cosine similarity of each page's closest chunk to the query, for the `limit` closest chunks."""
+    import lancedb
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+    model = HuggingFaceEmbedding(model_name=EMBEDDING_MODEL, trust_remote_code=True,
+                                 query_instruction="search_query: ")
+    table = lancedb.connect(VECTOR_DB_URI).open_table(TABLE_NAME)
+
+    similarities = {}
+    for row in table.search(model.get_query_embedding(query)).limit(limit).to_list():
+        page_url = row["metadata"]["page_url"]
+        # the embeddings are normalized, so the squared l2 distance is 2 - 2 * cosine similarity
+        similarities[page_url] = max(similarities.get(page_url, 0.0), 1 - row["_distance"] / 2)
+    return similarities
+
+
+class RelevanceScorer:
+    def __init__(self, use_embeddings: bool = False):
+        self.similarities = embedding_similarities() if use_embeddings else {}
+        self.stats = Counter()
+
+    def score(self, page: CrawledPage) -> float:
+        score = keyword_score(page_text(page))
+        if self.similarities:
+            score += EMBEDDING_WEIGHT * self.similarities.get(page.page_url, 0.0)
+        return score
+
+
+def get_eval_pages(session) -> list[tuple[CrawledPage, bool]]:
+    """The labelled eval pages and whether each one has before/after care details."""
+    if not inspect(session.get_bind()).has_table("evals"):
+        return []
+
+    rows = session.exec(text(
+        """
+        SELECT cr.id, e.true_label
+        FROM evals e
+        JOIN crawlerrecord cr
+            ON e.page_url = cr.page_url
+            AND e.school_id = cr.school_id
+        """
+    )).fetchall()
+    labels = {row.id: (row.true_label or "").strip().lower() not in NEGATIVE_LABELS for row in rows}
+
+    records = session.exec(
+        select(CrawlerRecord)
+        .where(CrawlerRecord.id.in_(list(labels)))
+        .where(has_markdown())
+    ).all()
+    return [(page, labels[page.id]) for page in load_pages(session, records)]
+
+
+def threshold_for_recall(scores: list[float], labels: list[bool], recall: float = DEFAULT_RECALL) -> float | None:
+    """The highest threshold that keeps at least `recall` of the positive pages."""
+    positive_scores = sorted((score for score, label in zip(scores, labels) if label), reverse=True)
+    if not positive_scores:
+        return None
+    return positive_scores[max(math.ceil(recall * len(positive_scores)), 1) - 1]
+
+
+def calibrate(engine, scorer: RelevanceScorer, recall: float = DEFAULT_RECALL, verbose: bool = True) -> float:
+    with Session(engine) as session:
+        eval_pages = get_eval_pages(session)
+
+    scores = [scorer.score(page) for page, _ in eval_pages]
+    labels = [label for _, label in eval_pages]
+    threshold = threshold_for_recall(scores, labels, recall)
+    if threshold is None:
+        if verbose:
+            print(f"No labelled eval pages with care details, using the default threshold of {DEFAULT_MIN_SCORE}")
+        return DEFAULT_MIN_SCORE
+
+    if verbose:
+        kept = [label for score, label in zip(scores, labels) if score >= threshold]
+        print(f"Relevance threshold {threshold:.2f}: keeps {sum(kept)}/{sum(labels)} eval pages with care details "
+              f"and {len(kept) - sum(kept)}/{len(labels) - sum(labels)} without")
+    return threshold
+
+
+def filter_pages(pages, scorer: RelevanceScorer, threshold: float):
+    """Yield the pages that score at least `threshold`, so `pages` can be streamed."""
+    for page in pages:
+        scorer.stats["scored"] += 1
+        if scorer.score(page) >= threshold:
+            scorer.stats["kept"] += 1
+            yield page
+
+
+if __name__ == "__main__":
+    from cps_childcare.database import engine
+    from cps_childcare.queries import iter_pages, load_page_ids
+
+    parser = argparse.ArgumentParser(description="Calibrate the relevance pre-filter on the evals table.")
+    parser.add_argument("--recall", type=float, default=DEFAULT_RECALL)
+    parser.add_argument("--embeddings", action="store_true", help="add the nomic embedding similarity to the score")
+    args = parser.parse_args()
+
+    scorer = RelevanceScorer(use_embeddings=args.embeddings)
+    threshold = calibrate(engine, scorer, recall=args.recall)
+
+    ids = load_page_ids(engine, select(CrawlerRecord.id)
+                   .where(CrawlerRecord.status_code == 200)
+                   .where(has_markdown())
+                   .where(CrawlerRecord.duplicate_of_id == None))
+    for _ in filter_pages(iter_pages(engine, ids), scorer, threshold):
+        pass
+    print(f"{scorer.stats['kept']}/{scorer.stats['scored']} crawled pages would be sent to the LLM")
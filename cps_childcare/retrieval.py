@@ -0,0 +1,80 @@
+"""
+Retrieval over the `webpagechunk` LanceDB table built by 09, so a school can be combined from just
+the handful of chunks about before/after care instead of every page on its site.  Each school's chunks
+are searched with a hybrid vector + full text query, the candidates are reranked locally with a cross
+encoder, and the top `k` go to the combine prompt, so the tokens per school scale with `k` rather than
+with the size of the site.
+"""
+from dataclasses import dataclass
+
+import lancedb
+from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from rerankers import Reranker
+
+
+VECTOR_DB_URI = "data/embeddings.lancedb"
+TABLE_NAME = "webpagechunk"
+EMBEDDING_MODEL = "nomic-ai/nomic-embed-text-v1.5"
+RERANK_MODEL = "cross-encoder"
+
+QUERY = "What are the hours, provider and cost of the school's before school and after school care program?"
+# the full text half of the hybrid search matches on these terms
+KEYWORD_QUERY = "before care after care aftercare childcare extended day OST YMCA Right at School"
+
+# how many chunks the hybrid search hands to the reranker, and how many of those go to the LLM
+CANDIDATES = 50
+TOP_K = 8
+
+
+@dataclass
+class Chunk:
+    page_url: str
+    text: str
+    score: float
+
+
+def check_table(table):
+    """Tables built by 09 before retrieval existed don't have the school ids or the full text index it needs."""
+    metadata = table.schema.field("metadata").type if "metadata" in table.schema.names else None
+    if metadata is None or "school_id" not in [field.name for field in metadata]:
+        raise RuntimeError(f"The {table.name} table doesn't have metadata.school_id, re-run scripts/09_chunk_and_embed.py")
+    try:
+        table.search(KEYWORD_QUERY, query_type="fts").limit(1).to_list()
+    except Exception as e:
+        raise RuntimeError(f"The {table.name} table doesn't have a full text index, "
+                           "re-run scripts/09_chunk_and_embed.py") from e
+
+
+class ChunkRetriever:
+    def __init__(self, uri: str = VECTOR_DB_URI, table_name: str = TABLE_NAME, k: int = TOP_K,
+                 candidates: int = CANDIDATES):
+        self.table = lancedb.connect(uri).open_table(table_name)
+        check_table(self.table)
+        self.k = k
+        self.candidates = candidates
+
+        # every school uses the same query, so it only gets embedded once
+        embedding_model = HuggingFaceEmbedding(model_name=EMBEDDING_MODEL, trust_remote_code=True,
+                                               query_instruction="search_query: ")
+        self.query_vector = embedding_model.get_query_embedding(QUERY)
+        self.ranker = Reranker(RERANK_MODEL, verbose=0)
+
+    def retrieve(self, school_id: int) -> list[Chunk]:
+        rows = (
+            self.table.search(query_type="hybrid")
+            .vector(self.query_vector)
+            .text(KEYWORD_QUERY)
+            .where(f"metadata.school_id = {int(school_id)}", prefilter=True)
+            .limit(self.candidates)
+            .to_list()
+        )
+        if not rows:
+            return []
+
+        ranked = self.ranker.rank(query=QUERY, docs=[row["text"] for row in rows], doc_ids=list(range(len(rows))))
+        return [
+            Chunk(page_url=rows[result.document.doc_id]["metadata"]["page_url"],
+                  text=rows[result.document.doc_id]["text"],
+                  score=result.score)
+            for result in ranked.top_k(self.k)
+        ]
@@ -0,0 +1,239 @@
+"""
+Checks that the quote snippets the LLM returns in 04 actually appear on the page, and where.  Both the
+page and the snippet are normalized the same way (lowercased, markdown link targets dropped, and only
+letters and digits kept) so whitespace, punctuation and markdown formatting don't matter, and each page's
+normalized text is cached along with an offset map back into the original markdown.  An exact match
+on the normalized text gives the snippet's character span in the markdown.  When there isn't one, a
+bounded fuzzy alignment (bit-parallel edit distance, only around the spots where pieces of the snippet
+do appear) finds the closest span and scores it, so a snippet with a word or two paraphrased still
+verifies.
+
+Run `python -m cps_childcare.snippets` to re-verify every stored snippet, and `--update` to save the
+results.
+"""
+import argparse
+import re
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+from sqlmodel import Session, select
+
+from cps_childcare.cps_data_models import ChildcareOpenAIRecord, CrawlerRecord
+from cps_childcare.queries import iter_pages
+
+
+# the share of the snippet's normalized characters that have to line up for a fuzzy match to count
+MIN_FUZZY_SCORE = 0.9
+# fuzzy matching anchors on the places these long pieces of the snippet show up exactly
+ANCHOR_SIZE = 8
+MAX_ANCHOR_HITS = 50
+MAX_CANDIDATES = 3
+CANDIDATE_BUCKET = 16
+
+LINK_TARGET = re.compile(r"\]\([^)]*\)")
+WORD = re.compile(r"[^\W_]+")
+
+SNIPPET_FIELDS = {
+    "before_care_quote_snippet": "before_care_quote_snippet_verified",
+    "after_care_quote_snippet": "after_care_quote_snippet_verified",
+}
+
+
+@dataclass
+class SnippetMatch:
+    # the span in the original markdown, so markdown[start:end] is the quoted text
+    start: int
+    end: int
+    # 1.0 for an exact match, otherwise the share of the snippet that lined up
+    score: float
+
+    @property
+    def exact(self) -> bool:
+        return self.score == 1.0
+
+
+def normalize(text: str) -> tuple[str, np.ndarray]:
+    """The letters and digits of `text`, lowercased, and the index in `text` of each of them."""
+    # blank out link targets without moving anything, so the offsets still line up with `text`
+    text = LINK_TARGET.sub(lambda match: "]" + " " * (len(match.group()) - 1), text)
+    words = [(match.start(), match.group()) for match in WORD.finditer(text)]
+    if not words:
+        return "", np.zeros(0, dtype=np.int64)
+
+    starts = np.array([start for start, _ in words], dtype=np.int64)
+    lengths = np.array([len(word) for _, word in words], dtype=np.int64)
+    # each word's characters are contiguous, so the offsets are a running index shifted per word
+    shifts = starts - (np.cumsum(lengths) - lengths)
+    offsets = np.arange(lengths.sum(), dtype=np.int64) + np.repeat(shifts, lengths)
+    # lower() can change the length of a few characters, and those words are left as they are
+    normalized = "".join(word.lower() if len(word.lower()) == len(word) else word for _, word in words)
+    return normalized, offsets
+
+
+class NormalizedText:
+    def __init__(self, text: str):
+        self.text = text
+        self.normalized, self.offsets = normalize(text)
+
+    def span(self, start: int, end: int) -> tuple[int, int]:
+        """The span in the original text of normalized[start:end]."""
+        return int(self.offsets[start]), int(self.offsets[end - 1]) + 1
+
+
+@lru_cache(maxsize=64)
+def normalized_text(text: str) -> NormalizedText:
+    return NormalizedText(text)
+
+
+def best_alignment(pattern: str, text: str) -> tuple[int, int]:
+    """
+    The smallest edit distance between `pattern` and any substring of `text`, and where the first
+    such substring ends, with Myers' bit-parallel algorithm (one column of the DP table per character).
+    """
+    m = len(pattern)
+    mask = (1 << m) - 1
+    high = 1 << (m - 1)
+    peq = {}
+    for i, char in enumerate(pattern):
+        peq[char] = peq.get(char, 0) | (1 << i)
+
+    pv, mv, distance = mask, 0, m
+    best = (m, 0)
+    for j, char in enumerate(text):
+        eq = peq.get(char, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & mask)
+        mh = pv & xh
+        if ph & high:
+            distance += 1
+        elif mh & high:
+            distance -= 1
+        ph = (ph << 1) & mask
+        mh = (mh << 1) & mask
+        pv = mh | (~(xv | ph) & mask)
+        mv = ph & xv
+        if distance < best[0]:
+            best = (distance, j + 1)
+    return best
+
+
+def candidate_starts(haystack: str, needle: str) -> list[int]:
+    """Where in `haystack` the needle probably starts, going by where its pieces match exactly."""
+    votes = Counter()
+    for offset in range(0, len(needle) - ANCHOR_SIZE + 1, ANCHOR_SIZE):
+        anchor = needle[offset:offset + ANCHOR_SIZE]
+        position = haystack.find(anchor)
+        for _ in range(MAX_ANCHOR_HITS):
+            if position < 0:
+                break
+            votes[(position - offset) // CANDIDATE_BUCKET] += 1
+            position = haystack.find(anchor, position + 1)
+    return [bucket * CANDIDATE_BUCKET for bucket, _ in votes.most_common(MAX_CANDIDATES)]
+
+
+def fuzzy_find(page: NormalizedText, needle: str, min_score: float = MIN_FUZZY_SCORE) -> SnippetMatch | None:
+    max_errors = int(len(needle) * (1 - min_score))
+    # if it's within max_errors, at least one of the anchors has to have matched exactly
+    if len(needle) // ANCHOR_SIZE <= max_errors:
+        return None
+
+    best = None
+    margin = max_errors + CANDIDATE_BUCKET
+    for candidate in candidate_starts(page.normalized, needle):
+        window_start = max(0, candidate - margin)
+        window = page.normalized[window_start:candidate + len(needle) + margin]
+        distance, end = best_alignment(needle, window)
+        if distance > max_errors or (best is not None and distance >= best[0]):
+            continue
+        # run it backwards from the end to find where that alignment starts
+        _, length = best_alignment(needle[::-1], window[:end][::-1])
+        best = (distance, window_start + end - length, window_start + end)
+
+    if best is None:
+        return None
+    distance, start, end = best
+    return SnippetMatch(*page.span(start, end), score=1 - distance / len(needle))
+
+
+def find_snippet(markdown: str | NormalizedText, snippet: str, min_score: float = MIN_FUZZY_SCORE) -> SnippetMatch | None:
+    """Where `snippet` is quoted in `markdown`, or None if it isn't (even approximately)."""
+    page = markdown if isinstance(markdown, NormalizedText) else normalized_text(markdown)
+    needle, _ = normalize(snippet)
+    if not needle or not page.normalized:
+        return None
+
+    start = page.normalized.find(needle)
+    if start >= 0:
+        return SnippetMatch(*page.span(start, start + len(needle)), score=1.0)
+    return fuzzy_find(page, needle, min_score)
+
+
+def verify_snippet(markdown: str | NormalizedText | None, snippet: str | None) -> bool | None:
+    """The `*_quote_snippet_verified` value for a snippet: None if there's no snippet to check."""
+    if not snippet:
+        return None
+    if not markdown:
+        return False
+    return find_snippet(markdown, snippet) is not None
+
+
+def verify_stored_snippets(engine, update: bool = False) -> Counter:
+    """Re-verify every ChildcareOpenAIRecord snippet against its page, loading each page only once."""
+    with Session(engine) as session:
+        rows = session.exec(
+            select(ChildcareOpenAIRecord, CrawlerRecord.id)
+            .join(CrawlerRecord, (CrawlerRecord.school_id == ChildcareOpenAIRecord.school_id) &
+                                 (CrawlerRecord.page_url == ChildcareOpenAIRecord.page_url))
+            .where(CrawlerRecord.duplicate_of_id == None)
+            .where(ChildcareOpenAIRecord.before_care_quote_snippet.is_not(None) |
+                   ChildcareOpenAIRecord.after_care_quote_snippet.is_not(None))
+        ).all()
+
+    records_by_page, seen = {}, set()
+    for record, crawler_record_id in rows:
+        if record.id not in seen:
+            seen.add(record.id)
+            records_by_page.setdefault(crawler_record_id, []).append(record)
+
+    stats = Counter()
+    updates = []
+    for page in iter_pages(engine, sorted(records_by_page)):
+        text = NormalizedText(page.markdown or "")
+        for record in records_by_page[page.id]:
+            changes = {}
+            for field, verified_field in SNIPPET_FIELDS.items():
+                snippet = getattr(record, field)
+                if not snippet:
+                    continue
+                match = find_snippet(text, snippet)
+                stats["snippets"] += 1
+                stats["missing" if match is None else "exact" if match.exact else "fuzzy"] += 1
+                if (match is not None) != getattr(record, verified_field):
+                    changes[verified_field] = match is not None
+            if changes:
+                stats["changed records"] += 1
+                updates.append({"id": record.id, **changes})
+
+    if update and updates:
+        with Session(engine) as session:
+            session.bulk_update_mappings(ChildcareOpenAIRecord, updates)
+            session.commit()
+    return stats
+
+
+if __name__ == "__main__":
+    import time
+
+    from cps_childcare.database import engine
+
+    parser = argparse.ArgumentParser(description="Re-verify the stored care quote snippets against their pages.")
+    parser.add_argument("--update", action="store_true", help="save the new verified flags")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    stats = verify_stored_snippets(engine, update=args.update)
+    print(f"Checked {stats['snippets']} snippets in {time.perf_counter() - start:.1f}s: {stats['exact']} exact, "
+          f"{stats['fuzzy']} fuzzy, {stats['missing']} missing, {stats['changed records']} records changed")
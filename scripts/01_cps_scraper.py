@@ -1,15 +1,53 @@
+import asyncio
 import json
 import os
 import re
-import time
-from collections import defaultdict
-from random import uniform
 
+import httpx
 import pandas as pd
-import requests
 
+from cps_childcare.fetcher import AsyncFetcher, budget_key
+from cps_childcare.http_cache import HttpCache
 
-def get_schools_json():
+
+# politeness budgets: all of the CPS APIs share one budget, and each school's website gets its own
+HOST_BUDGETS = {
+    "cps.edu": {"max_concurrency": 4, "min_delay": 0.25, "max_delay": 1.0},
+}
+# a school's contact page probes can overlap, but their starts are still spaced out like they were
+# when they ran one at a time
+SCHOOL_SITE_BUDGET = {"max_concurrency": 3, "min_delay": 1.0, "max_delay": 2.0}
+MAX_SCHOOLS_IN_FLIGHT = 16
+
+# school sites are often slow or dead, so don't let a contact page probe hang
+CONTACT_PROBE_TIMEOUT = httpx.Timeout(10.0, connect=5.0)
+
+# Edlio and Educational Networks sites never have emails on their contact pages, so once we've
+# seen a domain is one of those we remember it and skip probing it on later runs.
+# delete this file to force the vendors to be detected again.
+SITE_VENDORS_FILE = "data/school_site_vendors.json"
+
+# every request goes through an on-disk cache.  within its TTL a response is reused as-is,
+# and after that it's revalidated with a conditional GET
+HTTP_CACHE_DIR = "data/http_cache"
+HTTP_CACHE_TTLS = [
+    ("https://api.cps.edu/maps/cps/GeoJSON", 24 * 60 * 60),
+    ("https://www.cps.edu/api/schoolprofile/", 60 * 60),
+]
+DEFAULT_HTTP_CACHE_TTL = 60 * 60
+
+# each school's results get appended here as soon as they're done so that an
+# interrupted run can pick up where it left off without refetching anything
+CHECKPOINT_FILE = "data/cps_schools_contacts.jsonl"
+OUTPUT_FILE = "data/cps_schools_contacts.csv"
+
+PROFILE_KEYS = ["schoolHours", "afterSchoolHours", "earliestDropOffTime",
+                "phone", "gradesOffered", "websiteURL",
+                "isTitle1Eligible", "studentCount", "studentCountLowIncome",
+                "studentCountBlack", "studentCountHispanic", "studentCountWhite"]
+
+
+async def get_schools_json(fetcher):
     """
     Get a list of all CPS schools with some useful data about them.
     This URL comes from loading the map at https://schoolinfo.cps.edu/schoollocator/
@@ -18,19 +56,12 @@ def get_schools_json():
     the URL of the school's website.
     """
     CPS_API_URL = "https://api.cps.edu/maps/cps/GeoJSON?mapname=SCHOOL&year=2025"
-    CACHE_FILE = "/Users/mdagostino/cps_schools.json"
 
-    if os.path.exists(CACHE_FILE):
-        with open(CACHE_FILE, "r") as f:
-            return json.load(f)
-    else:
-        response = requests.get(CPS_API_URL)
-        with open(CACHE_FILE, "w") as f:
-            json.dump(response.json()["features"], f)
-        return response.json()
+    response = await fetcher.get(CPS_API_URL)
+    return response.json()["features"]
 
 
-def get_school_profile_data(school_id):
+async def get_school_profile_data(fetcher, school_id):
     """
     For each school, we have a school_id in our dataset already.  We can query another CPS endpoint to get
     some more info for each school.
@@ -40,10 +71,10 @@ def get_school_profile_data(school_id):
     It appears to be the API endpoint documented here: https://api.cps.edu/schoolprofile/Help/Api/GET-CPS-SingleSchoolProfile_SchoolID
     """
     CPS_SCHOOL_PROFILE_API_BASE = "https://www.cps.edu/api/schoolprofile/singleschoolprofile?SchoolID="
-    
+
     school_profile_url = f"{CPS_SCHOOL_PROFILE_API_BASE}{school_id}"
 
-    response = requests.get(school_profile_url)
+    response = await fetcher.get(school_profile_url)
 
     return response.json()
 
@@ -59,26 +90,54 @@ def clean_school_url(school_website_url):
     return school_website_url
 
 
-def get_school_contact_page(school_website_url):
+async def probe_contact_url(fetcher, contact_url):
+    response = await fetcher.get(contact_url, timeout=CONTACT_PROBE_TIMEOUT)
+    if response.status_code == 200:
+        return contact_url, response.text
+    return None
+
+
+async def get_school_contact_page(fetcher, school_website_url, site_vendors):
     """
     Try 3 common patterns for the school's contact form on its website.  Also, a very large
     percentage of sites are made by two vendors--Edlio and Eductional Networks--so we try
     to figure that out too.
+    The probes all run at once, and the first one to come back with a 200 wins.
     """
+    domain = budget_key(school_website_url)
+    known_site = site_vendors.get(domain)
+    if known_site is not None and (known_site["is_edlio"] or known_site["is_educational_networks"]):
+        return known_site["contact_url"], None, known_site["is_edlio"], known_site["is_educational_networks"]
+
     contact_url_1 = f"{school_website_url}/apps/contact"
     contact_url_2 = f"{school_website_url}/contact/"
     contact_url_3 = f"{school_website_url}/contact.html"
 
-    for contact_url_try in [contact_url_1, contact_url_2, contact_url_3]:
-        try:
-            response = requests.get(contact_url_try, headers=headers)
-            if response.status_code == 200: 
-                is_edlio = "Edlio" in response.text
+    probes = [asyncio.create_task(probe_contact_url(fetcher, contact_url_try))
+              for contact_url_try in [contact_url_1, contact_url_2, contact_url_3]]
+    try:
+        for probe in asyncio.as_completed(probes):
+            try:
+                result = await probe
+            except httpx.TransportError:
+                continue
+
+            if result is not None:
+                contact_url, contact_page_text = result
+                is_edlio = "Edlio" in contact_page_text
                 # use a regex here because we can have newlines and stuff between the two words
-                is_educational_networks = re.search("Educational\s*Networks", response.text, re.IGNORECASE) is not None
-                return contact_url_try, response.text, is_edlio, is_educational_networks
-        except requests.exceptions.ConnectionError:
-            pass
+                is_educational_networks = re.search(r"Educational\s*Networks", contact_page_text, re.IGNORECASE) is not None
+                site_vendors[domain] = {
+                    "contact_url": contact_url,
+                    "is_edlio": is_edlio,
+                    "is_educational_networks": is_educational_networks,
+                }
+                return contact_url, contact_page_text, is_edlio, is_educational_networks
+    finally:
+        # cancel the probes that lost the race
+        for probe in probes:
+            probe.cancel()
+        await asyncio.gather(*probes, return_exceptions=True)
 
     return None, None, None, None
 
@@ -88,69 +147,120 @@ def get_emails_from_contact_page(contact_page_text):
     return list(set(re.findall(email_pattern, contact_page_text)))
 
 
-if __name__ == "__main__":
-    # some CPS school /contact pages give 403's without a proper header
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/116.0.0.0 Safari/537.36"
-    }
-    
-    schools = get_schools_json()
-
-    # get the data into a pandas dataframe
-    data = pd.DataFrame(schools)
-    
-    # explode the json
-    schools_lat_longs = pd.json_normalize(data.geometry)
-    schools_features = pd.json_normalize(data.properties)
-    schools = pd.concat([schools_features, schools_lat_longs[["coordinates"]]], axis=1)
-
-    profile_data = defaultdict(list)
-    for idx, school in schools.iterrows():
-        school_name = school.Name
-        school_id = school.School_ID
-        school_type = school.Type
-
-        print(f"{school_name}: {school_id}: {school_type}")
-
-        school_profile_data = get_school_profile_data(school_id)
-
-        if school_profile_data is not None:
-            keys_to_print = ["schoolHours", "afterSchoolHours", "earliestDropOffTime",
-                            "phone", "gradesOffered", "websiteURL",
-                            "isTitle1Eligible", "studentCount", "studentCountLowIncome",
-                            "studentCountBlack", "studentCountHispanic", "studentCountWhite"]
-            print(f"Index = {idx}")
-            for key_to_print in keys_to_print:
-                value = school_profile_data[key_to_print]
-                profile_data[key_to_print].append(value)
-            print(value)
-
-            school_website_url = clean_school_url(school_profile_data["websiteURL"])
-            emails = []
-
-            contact_url, contact_page_text, is_edlio, is_educational_networks = get_school_contact_page(school_website_url)
-            print(contact_url)
-
-            if contact_url is not None and not is_edlio and not is_educational_networks:
-                emails = get_emails_from_contact_page(contact_page_text)
-                print(",".join(emails))
-        else:
-            print("No school profile data found!!")
-            for key_to_print in keys_to_print:
-                profile_data[key_to_print].append(None)
-            contact_url, is_edlio, is_educational_networks = None, None, None
-            emails = []
-
-        profile_data["contact_url"].append(contact_url)
-        profile_data["is_edlio"].append(is_edlio)
-        profile_data["is_educational_networks"].append(is_educational_networks)
-        profile_data["contact_emails"].append("|".join(emails))
-
-        print("**************************\n\n")
-
-        # sleep a random amount of time between 1s and 5s
-        time.sleep(uniform(1, 5))
-
-    # dump the final results to csv
-    pd.concat([schools, pd.DataFrame(profile_data)], axis=1).to_csv("data/cps_schools_contacts.csv")
+async def scrape_school(fetcher, school, site_vendors):
+    school_profile_data = await get_school_profile_data(fetcher, school.School_ID)
+
+    profile_data = {"School_ID": int(school.School_ID)}
+    if school_profile_data is not None:
+        for key in PROFILE_KEYS:
+            profile_data[key] = school_profile_data[key]
+
+        school_website_url = clean_school_url(school_profile_data["websiteURL"])
+        emails = []
+
+        contact_url, contact_page_text, is_edlio, is_educational_networks = await get_school_contact_page(fetcher, school_website_url, site_vendors)
+
+        if contact_url is not None and not is_edlio and not is_educational_networks:
+            emails = get_emails_from_contact_page(contact_page_text)
+    else:
+        print(f"No school profile data found for {school.Name}!!")
+        for key in PROFILE_KEYS:
+            profile_data[key] = None
+        contact_url, is_edlio, is_educational_networks = None, None, None
+        emails = []
+
+    profile_data["contact_url"] = contact_url
+    profile_data["is_edlio"] = is_edlio
+    profile_data["is_educational_networks"] = is_educational_networks
+    profile_data["contact_emails"] = "|".join(emails)
+
+    return profile_data
+
+
+def load_site_vendors(site_vendors_file):
+    if not os.path.exists(site_vendors_file):
+        return {}
+
+    with open(site_vendors_file, "r") as f:
+        return json.load(f)
 
+
+def save_site_vendors(site_vendors_file, site_vendors):
+    tmp_file = f"{site_vendors_file}.tmp"
+    with open(tmp_file, "w") as f:
+        json.dump(site_vendors, f, indent=2, sort_keys=True)
+    os.replace(tmp_file, site_vendors_file)
+
+
+def read_checkpoint(checkpoint_file):
+    if not os.path.exists(checkpoint_file):
+        return []
+
+    with open(checkpoint_file, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def append_checkpoint(checkpoint_file, profile_data):
+    with open(checkpoint_file, "a") as f:
+        f.write(json.dumps(profile_data) + "\n")
+
+
+async def scrape_schools(fetcher, schools, checkpoint_file, site_vendors):
+    completed_school_ids = {row["School_ID"] for row in read_checkpoint(checkpoint_file)}
+    schools = schools[~schools.School_ID.isin(completed_school_ids)]
+    print(f"{len(completed_school_ids)} schools already scraped, {len(schools)} to go...")
+
+    in_flight = asyncio.Semaphore(MAX_SCHOOLS_IN_FLIGHT)
+
+    async def scrape_one(school):
+        async with in_flight:
+            try:
+                profile_data = await scrape_school(fetcher, school, site_vendors)
+            except Exception as e:
+                # leave it out of the checkpoint so that the next run retries it
+                print(f"Scraping failed for {school.Name}: {school.School_ID}!!")
+                print(e)
+                return
+
+            append_checkpoint(checkpoint_file, profile_data)
+            print(f"{school.Name}: {school.School_ID}: {school.Type}")
+            print(profile_data["contact_url"])
+            print(profile_data["contact_emails"])
+            print("**************************\n\n")
+
+    await asyncio.gather(*(scrape_one(school) for _, school in schools.iterrows()))
+
+
+async def main():
+    cache = HttpCache(HTTP_CACHE_DIR, ttls=HTTP_CACHE_TTLS, default_ttl=DEFAULT_HTTP_CACHE_TTL)
+    async with AsyncFetcher(budgets=HOST_BUDGETS, default_budget=SCHOOL_SITE_BUDGET, cache=cache) as fetcher:
+        schools = await get_schools_json(fetcher)
+
+        # get the data into a pandas dataframe
+        data = pd.DataFrame(schools)
+
+        # explode the json
+        schools_lat_longs = pd.json_normalize(data.geometry)
+        schools_features = pd.json_normalize(data.properties)
+        schools = pd.concat([schools_features, schools_lat_longs[["coordinates"]]], axis=1)
+
+        site_vendors = load_site_vendors(SITE_VENDORS_FILE)
+        try:
+            await scrape_schools(fetcher, schools, CHECKPOINT_FILE, site_vendors)
+        finally:
+            save_site_vendors(SITE_VENDORS_FILE, site_vendors)
+
+    print(f"HTTP cache: {cache.summary()}")
+
+    profile_data = pd.DataFrame(read_checkpoint(CHECKPOINT_FILE))
+    if len(profile_data) < len(schools):
+        print(f"Only {len(profile_data)} / {len(schools)} schools scraped--rerun to pick up the rest.")
+        return
+
+    # dump the final results to csv, and clear the checkpoint so the next run is a full refresh
+    schools.merge(profile_data, on="School_ID", how="left").to_csv(OUTPUT_FILE)
+    os.remove(CHECKPOINT_FILE)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
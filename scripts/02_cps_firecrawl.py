@@ -1,29 +1,75 @@
 # pyright: reportMissingImports=false
+import asyncio
 import os
 import random
+from datetime import datetime, timedelta, timezone
 
-from firecrawl.firecrawl import FirecrawlApp
 from sqlmodel import select, Session
 
-from cps_childcare.cps_data_models import CrawlerRecord
+from cps_childcare.boilerplate import strip_school_boilerplate
+from cps_childcare.cps_data_models import CrawlerRecord, FirecrawlJob
 from cps_childcare.database import engine
+from cps_childcare.dedup import insert_deduplicated
+from cps_childcare.embedded_binaries import strip_embedded_binaries
+from cps_childcare.firecrawl_scheduler import DEFAULT_FIRECRAWL_API_URL, CrawlJob, FirecrawlScheduler
+from cps_childcare.near_duplicates import cluster_school
 from cps_childcare.utils import get_all_records
 
 
-def bulk_insert_crawler_records(records):
+# crawled pages are committed this many at a time, so a crash only loses the chunk in progress
+INGEST_CHUNK_SIZE = 25
+# firecrawl only keeps crawl results around for 24 hours, so older unfinished crawls get resubmitted
+FIRECRAWL_RESULTS_TTL = timedelta(hours=24)
+
+
+def get_latest_firecrawl_jobs():
     with Session(engine) as session:
-        session.bulk_insert_mappings(CrawlerRecord, records)
-        session.commit()
+        jobs = session.exec(select(FirecrawlJob).order_by(FirecrawlJob.id)).all()
+
+    return {job.school_id: job for job in jobs}
 
 
 def get_completed_school_ids():
     with Session(engine) as session:
-        school_ids = session.exec(
+        school_ids = set(session.exec(
             select(CrawlerRecord.school_id).distinct()
-        )
+        ))
+
+    # schools whose latest crawl never finished only have some of their pages
+    unfinished_school_ids = {school_id for school_id, job in get_latest_firecrawl_jobs().items()
+                             if job.status != "completed"}
+
+    return list(school_ids - unfinished_school_ids)
+
+
+def update_firecrawl_job(job_id, **fields):
+    with Session(engine) as session:
+        firecrawl_job = session.get(FirecrawlJob, job_id)
+        for field, value in fields.items():
+            setattr(firecrawl_job, field, value)
+        firecrawl_job.updated_at = datetime.now(timezone.utc)
+        session.add(firecrawl_job)
+        session.commit()
+
+
+def make_crawl_job(school, latest_job):
+    resume_cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - FIRECRAWL_RESULTS_TTL
+    if (latest_job is not None and latest_job.status == "scraping" and latest_job.firecrawl_id
+            and latest_job.submitted_at > resume_cutoff):
+        print(f"Resuming crawl {latest_job.firecrawl_id} for {latest_job.crawl_url} after {latest_job.pages_ingested} pages...")
+        return CrawlJob(url=latest_job.crawl_url, context={"school": school, "job_id": latest_job.id},
+                        crawl_id=latest_job.firecrawl_id, status="scraping",
+                        pages_ingested=latest_job.pages_ingested)
+
+    firecrawl_job = FirecrawlJob(school_id=school["fields"]["School_ID"], crawl_url=school["fields"]["websiteURL"],
+                                 firecrawl_id=None, submitted_at=None)
+    with Session(engine) as session:
+        session.add(firecrawl_job)
+        session.commit()
+        session.refresh(firecrawl_job)
+
+    return CrawlJob(url=firecrawl_job.crawl_url, context={"school": school, "job_id": firecrawl_job.id})
 
-        return list(school_ids)
-    
 
 def extract_crawled_data(crawled_data):
     metadata = crawled_data["metadata"]
@@ -33,8 +79,9 @@ def extract_crawled_data(crawled_data):
     record["page_url"] = metadata["sourceURL"]
     record["description"] = metadata.get("description", None)
     record["status_code"] = str(metadata["statusCode"])
-    record["markdown"] = crawled_data.get("markdown", None)
-    html = crawled_data.get("html", None)
+    # drop inline base64 images here so nothing downstream ever has to deal with them
+    record["markdown"] = strip_embedded_binaries(crawled_data.get("markdown", None))
+    html = strip_embedded_binaries(crawled_data.get("html", None))
     if html and len(html) < 100_000:
         record["html"] = html
     else:
@@ -43,12 +90,88 @@ def extract_crawled_data(crawled_data):
     return record
 
 
+def ingest_pages(job, pages):
+    school = job.context["school"]
+    for start in range(0, len(pages), INGEST_CHUNK_SIZE):
+        chunk = pages[start:start + INGEST_CHUNK_SIZE]
+        records = []
+        for crawled_data in chunk:
+            if crawled_data:
+                record = extract_crawled_data(crawled_data)
+                record["index"] = school["fields"]["Index"]
+                record["school_name"] = school["fields"]["Name"]
+                record["school_id"] = school["fields"]["School_ID"]
+                record["school_type"] = school["fields"]["Type"]
+                records.append(record)
+
+        with Session(engine) as session:
+            # skips pages we already have (from a resumed crawl) unless they changed since, and links duplicate
+            # pages to their canonical copy
+            insert_deduplicated(session, school["fields"]["School_ID"], records)
+
+            # move the job's cursor forward in the same transaction as the pages
+            firecrawl_job = session.get(FirecrawlJob, job.context["job_id"])
+            firecrawl_job.pages_ingested = job.pages_ingested + start + len(chunk)
+            firecrawl_job.updated_at = datetime.now(timezone.utc)
+            session.add(firecrawl_job)
+            session.commit()
+
+
+def on_submit(job):
+    update_firecrawl_job(job.context["job_id"], firecrawl_id=job.crawl_id, status="scraping",
+                         submitted_at=datetime.now(timezone.utc))
+
+
+def on_complete(job, status):
+    print(f"Crawled {status['total']} urls for {job.url}...")
+
+    # now that we have the whole site, learn its boilerplate and then cluster its near-duplicate pages
+    with Session(engine) as session:
+        strip_school_boilerplate(session, job.context["school"]["fields"]["School_ID"])
+        cluster_school(session, job.context["school"]["fields"]["School_ID"])
+        session.commit()
+
+    update_firecrawl_job(job.context["job_id"], status="completed")
+
+
+def on_failure(job, reason):
+    print(f"Crawl failed for {job.url}!!")
+    print(reason)
+    update_firecrawl_job(job.context["job_id"], status="failed")
+
+
 AIRTABLE_BASE_ID = "appPfxeoBduSJLC67"
 AIRTABLE_RAW_TABLE_NAME = "tblHoR7kZU8IzuKJb"
 
-airtable_api_key = os.environ["AIRTABLE_API_KEY"]
+# set FIRECRAWL_API_URL to run against a local stand-in (see cps_childcare/local_firecrawl.py)
+FIRECRAWL_API_URL = os.environ.get("FIRECRAWL_API_URL", DEFAULT_FIRECRAWL_API_URL)
+# how many crawls to run at once--keep this within the Firecrawl plan's concurrency limit
+MAX_CRAWLS_IN_FLIGHT = int(os.environ.get("FIRECRAWL_MAX_IN_FLIGHT", 5))
+POLL_INTERVAL = 10
+
+CRAWL_PARAMS = {
+    "limit": 300,
+    "excludePaths": ["calendar", "newsletter", "/images", "/Health Forms*/*", "/reminders/*",
+                     "/news--updates/*", "/news/archives/*", "/bateman-art-blog/*"
+                     "/apps/events/*", "/event/*", "/events/*", "/board_minutes/*",
+                     "/2018/*", "/2019/*", "/2020/*", "/2021/*", "/2022/*", "/2023/*",
+                     "/enroll21-22/*", "/classrooms21-22/*/*", "/classrooms1920/*/*",
+                     "/Classrooms2324/*/*", "/Classrooms22-23/*/*/",
+                     "/gallery/*/*", "/images/*/*",
+                     "/uploads/.*\.png", "/uploads/.*\.jpg",
+                     "/lsc/archives/*", "/parents/archives/*",
+                     "/teachers-staff/*", "/category/teachers-staff/*",
+                     "/athletics-2/*", "/category/athletics-2/*",
+                     "/performing-fine-arts-2/*", "/category/performing-fine-arts-2/*",
+                     "/south-loop-scoop/*", "/the-south-loop-school-scoop/*",
+                     "/author/*", "/past-special-events/*", "/past-reminders/*"],
+    "scrapeOptions": {
+        "formats": ["markdown", "html"],
+        "onlyMainContent": True
+    }
+}
 
-fc = FirecrawlApp(api_key=os.environ["FIRECRAWL_API_KEY"])
+airtable_api_key = os.environ["AIRTABLE_API_KEY"]
 
 schools = get_all_records(AIRTABLE_BASE_ID, AIRTABLE_RAW_TABLE_NAME, airtable_api_key)
 
@@ -65,56 +188,17 @@ schools = [s for s in schools if s["fields"]["School_ID"] not in completed_schoo
 
 
 random.shuffle(schools)
-for school in schools:
-    if "websiteURL" not in school["fields"]:
-        continue
-    
-    crawl_url = school["fields"]["websiteURL"]
-    print(f"Crawling {crawl_url}...")
-
-    try:
-        crawl_result = fc.crawl_url(
-            crawl_url,
-            params={"limit": 300,
-                "excludePaths": ["calendar", "newsletter", "/images", "/Health Forms*/*", "/reminders/*",
-                                 "/news--updates/*", "/news/archives/*", "/bateman-art-blog/*"
-                                 "/apps/events/*", "/event/*", "/events/*", "/board_minutes/*",
-                                 "/2018/*", "/2019/*", "/2020/*", "/2021/*", "/2022/*", "/2023/*",
-                                 "/enroll21-22/*", "/classrooms21-22/*/*", "/classrooms1920/*/*",
-                                 "/Classrooms2324/*/*", "/Classrooms22-23/*/*/",
-                                 "/gallery/*/*", "/images/*/*",
-                                 "/uploads/.*\.png", "/uploads/.*\.jpg",
-                                 "/lsc/archives/*", "/parents/archives/*",
-                                 "/teachers-staff/*", "/category/teachers-staff/*",
-                                 "/athletics-2/*", "/category/athletics-2/*",
-                                  "/performing-fine-arts-2/*", "/category/performing-fine-arts-2/*",
-                                  "/south-loop-scoop/*", "/the-south-loop-school-scoop/*",
-                                  "/author/*", "/past-special-events/*", "/past-reminders/*"],
-                "scrapeOptions": {
-                    "formats": ["markdown", "html"],
-                    "onlyMainContent": True
-                    }
-                },
-            poll_interval=10
-        )
-    except Exception as e:
-        print(f"Crawl failed for {crawl_url}!!")
-        print(e)
-        continue
-
-    if crawl_result["success"]:
-        print(f"Crawled {crawl_result['total']} urls for {crawl_url}...")
-        records = []
-        for crawled_data in crawl_result["data"]:
-            if crawled_data:
-                record = extract_crawled_data(crawled_data)
-                record["index"] = school["fields"]["Index"]
-                record["school_name"] = school["fields"]["Name"]
-                record["school_id"] = school["fields"]["School_ID"]
-                record["school_type"] = school["fields"]["Type"]
-                records.append(record)
+latest_jobs = get_latest_firecrawl_jobs()
+jobs = [make_crawl_job(school, latest_jobs.get(school["fields"]["School_ID"]))
+        for school in schools if "websiteURL" in school["fields"]]
+print(f"Crawling {len(jobs)} schools, {MAX_CRAWLS_IN_FLIGHT} at a time...")
 
-        # insert the full batch into the database
-        bulk_insert_crawler_records(records)
-    else:
-        print(f"Crawl failed for {crawl_url}!!")
+
+async def crawl_schools(jobs):
+    async with FirecrawlScheduler(os.environ["FIRECRAWL_API_KEY"], api_url=FIRECRAWL_API_URL,
+                                  max_in_flight=MAX_CRAWLS_IN_FLIGHT, poll_interval=POLL_INTERVAL) as scheduler:
+        await scheduler.run(jobs, params=CRAWL_PARAMS, on_pages=ingest_pages, on_complete=on_complete,
+                            on_submit=on_submit, on_failure=on_failure)
+
+
+asyncio.run(crawl_schools(jobs))
@@ -1,196 +1,61 @@
 # pyright: reportMissingImports=false
+import argparse
+import asyncio
 import os
 import random
-from textwrap import dedent
+import sys
+from functools import partial
+from typing import Iterable
 
-import tiktoken
-from openai import OpenAI
-from sqlalchemy import text
-from sqlmodel import select, Session
-from tenacity import retry, retry_if_not_exception_type, stop_after_attempt, wait_random_exponential
+from openai import AsyncOpenAI, OpenAI
+from sqlmodel import Session
 
-from cps_childcare.cps_data_models import CrawlerRecord, CrawlerOpenAIRecord, CrawlerOpenAIResponse
+from cps_childcare.boilerplate import content_markdown
+from cps_childcare.chunked_extraction import merge_crawler_responses, prompt_fits, split_markdown
+from cps_childcare.content_store import CrawledPage
+from cps_childcare.cps_data_models import CrawlerOpenAIRecord, CrawlerOpenAIResponse
 from cps_childcare.database import engine
+from cps_childcare.llm_cache import LLMCache
+from cps_childcare.near_duplicates import fan_out_page_results
+from cps_childcare.openai_batch import (PENDING_EXIT_CODE, batch_request_line, in_flight_record_ids, ingest_batches,
+                                       submit_batches)
+from cps_childcare.openai_runner import OpenAIRunner, RateLimiter
+from cps_childcare.prompts import estimate_tokens, get_prompt
+from cps_childcare.queries import (ID_COLUMNS, count_unhashed_pages, eval_pages_to_extract_query, iter_pages, load_page_ids,
+                                   pages_to_extract_query)
+from cps_childcare.record_writer import RecordWriter
+from cps_childcare.relevance import DEFAULT_RECALL, RelevanceScorer, calibrate, filter_pages
+
+
+def get_page_ids(model_name: str = "gpt-4o-mini", prompt_version: str = None, evals: bool = False) -> list[int]:
+    # only the ids are loaded up front, the pages themselves get streamed with iter_pages
+    if not evals:
+        # get pages we haven't sent to openai yet
+        query = pages_to_extract_query(model_name, prompt_version, columns=ID_COLUMNS)
+    else:
+        query = eval_pages_to_extract_query(model_name, prompt_version, columns=ID_COLUMNS)
+    return load_page_ids(engine, query)
 
 
-def get_pages(model_name: str = "gpt-4o-mini", prompt_version: str = None, evals: bool = False):
-    with Session(engine) as session:
-        if not evals:
-            # get pages we haven't sent to openai yet
-            pages = session.exec(
-            select(CrawlerRecord)
-            .outerjoin(CrawlerOpenAIRecord,
-                       (CrawlerRecord.school_id == CrawlerOpenAIRecord.school_id) & 
-                       (CrawlerRecord.page_url == CrawlerOpenAIRecord.page_url) &
-                       (CrawlerOpenAIRecord.openai_model_name == model_name)
-            )
-            .where(CrawlerRecord.status_code == 200)
-            .where(CrawlerRecord.markdown.is_not(None))
-            .where(CrawlerOpenAIRecord.id == None)
-            )
-        else:
-            # Query raw table without SQLAlchemy model
-            query = text(
-            f"""
-            WITH crawler_records_by_model AS (
-                SELECT * FROM crawleropenairecord
-                WHERE openai_model_name = '{model_name}'
-                    AND prompt_version = '{prompt_version}'
-            )
-            
-            SELECT cr.*
-            FROM evals e
-            JOIN crawlerrecord cr
-                ON e.page_url = cr.page_url
-                AND e.school_id = cr.school_id
-            LEFT JOIN crawler_records_by_model r
-                ON e.page_url = r.page_url
-                AND e.school_id = r.school_id
-            WHERE r.page_url IS NULL;
-            """
-            )
-            result = session.exec(query)
-            pages = result.fetchall()
-            pages = [CrawlerRecord.model_validate(row) for row in pages]
-
-        return list(pages)
-
-
-class TokenLimitExceededException(Exception):
-    """Exception raised when the token limit is exceeded."""
-    pass
-
-
-@retry(
-    retry=retry_if_not_exception_type(TokenLimitExceededException),
-    wait=wait_random_exponential(multiplier=1, min=10, max=300),
-    stop=stop_after_attempt(10),
-    before_sleep=lambda rcs: print(f"OpenAI call failed: {str(rcs)}"),
-    reraise=True
-)
-def call_openai(openai_client, page: CrawlerRecord, model="gpt-4o-mini", prompt_version="v1"):
-    prompt_v1 = f"""
-For the web page markdown given to you, extract the following information from it:
-- Extract all email addresses as a list. Leave the list empty if there aren't any.
-- If the page is a contact page or contact us page, set is_contact_page to True.
-- If the page describes a before or after school childcare program, extract those details into before_or_after_care_details.  Otherwise leave it empty.
-
-Follow these rules:
-- We ONLY care about before or after care CHILDCARE programs, not general instructions about what students are supposed to do before and after school.  DO NOT include general instructions about what students are supposed to do before and after school.
-- DO NOT infer that before or after care is likely and mention that.
-- A page is NOT a before or after childcare page if it just links to a page with those deatils.
-- DO NOT mention if the page doesn't talk about before or after childcare.
-
-DON'T say things like the following.  These are BAD responses:
-- "The page does not provide specific details about before or after school childcare programs"
-- "The page provides a link to the Before & After School Programs but does not include specific details about the programs themselves."
-- "Students must enter and exit through Door 2. Students must wait patiently in the foyer. Once you exit the building for the day, you will not be allowed back in the building."
-- "Plan ahead for before and after school programs."
-- "After school programs will run as normal."
-
-A good extraction looks like:
-- "Peirce partners with the Lakeview YMCA to offer before and after school care for students in Kindergarten through 8th grades. Programs are run at Peirce School but organized and run by the YMCA. Before care runs from 7:00-8:00 am and after care runs from 3:00 - 6:00 pm."
-
-It's currently the year 2024--DO NOT include information on childcare programs from previous years.
-
-Page URL: {page.page_url}
-Page Title: {page.page_title if page.page_title else ""}
-Page Description:  {page.description if page.description else ""}
-Page Markdown: {page.markdown}
-"""
-    
-    prompt_v2 = f"""
-For the web page markdown given to you, extract the following information from it:
-- Extract all email addresses as a list. Leave the list empty if there aren't any.
-- If the page is a contact page or contact us page, set is_contact_page to True.
-- If the page describes a before or after school childcare program, extract those details into before_or_after_care_details.  Otherwise leave it empty.
-
-Follow these rules:
-- We ONLY care about before or after care CHILDCARE programs, not general instructions about what students are supposed to do before and after school.  DO NOT include general instructions about what students are supposed to do before and after school.
-- DO NOT infer that before or after care is likely and mention that.
-- A page is NOT a before or after childcare page if it just links to a page with those deatils.
-- DO NOT mention if the page doesn't talk about before or after childcare.
-- The abbreviation "OST" stands for "Out of School Time" and should be included.
-- Right at School, Park District, and YMCA programs should be included.
-
-DON'T say things like the following.  These are BAD responses:
-- "The page does not provide specific details about before or after school childcare programs"
-- "The page provides a link to the Before & After School Programs but does not include specific details about the programs themselves."
-- "Students must enter and exit through Door 2. Students must wait patiently in the foyer. Once you exit the building for the day, you will not be allowed back in the building."
-- "Plan ahead for before and after school programs."
-- "After school programs will run as normal."
-
-A good extraction looks like:
-- "Peirce partners with the Lakeview YMCA to offer before and after school care for students in Kindergarten through 8th grades. Programs are run at Peirce School but organized and run by the YMCA. Before care runs from 7:00-8:00 am and after care runs from 3:00 - 6:00 pm."
-- "We have two after school options - Right At School and Park District."
-
-It's currently the year 2024--DO NOT include information on childcare programs from previous years.
-
-Page URL: {page.page_url}
-Page Title: {page.page_title if page.page_title else ""}
-Page Description:  {page.description if page.description else ""}
-Page Markdown: {page.markdown}
-"""
-    
-    prompt_v3 = f"""
-For the web page markdown given to you, extract the following information from it:
-- Extract all email addresses as a list. Leave the list empty if there aren't any.
-- If the page is a contact page or contact us page, set is_contact_page to True.
-- If the page describes a before or after school childcare program, extract those details into before_or_after_care_details.  Otherwise leave it empty.
-
-Follow these rules:
-- We ONLY care about before or after care CHILDCARE programs, not general instructions about what students are supposed to do before and after school.  DO NOT include general instructions about what students are supposed to do before and after school.
-- DO NOT infer that before or after care is likely and mention that.
-- DO NOT mention if the page doesn't talk about before or after childcare.
-- If a page mentions that a childcare program starts on a certain date in 2024 or 2025, include it.
-- The abbreviation "OST" stands for "Out of School Time" and should be included.
-- Extended Day programs should be included.
-- Right at School, Park District, and YMCA programs should be included.
-
-DON'T say things like the following.  These are BAD responses:
-- "The page does not provide specific details about before or after school childcare programs"
-- "The page provides a link to the Before & After School Programs but does not include specific details about the programs themselves."
-- "Students must enter and exit through Door 2. Students must wait patiently in the foyer. Once you exit the building for the day, you will not be allowed back in the building."
-- "Plan ahead for before and after school programs."
-- "After school programs will run as normal."
-
-A good extraction looks like:
-- "Peirce partners with the Lakeview YMCA to offer before and after school care for students in Kindergarten through 8th grades. Programs are run at Peirce School but organized and run by the YMCA. Before care runs from 7:00-8:00 am and after care runs from 3:00 - 6:00 pm."
-- "We have two after school options - Right At School and Park District."
-
-It's currently the year 2024--DO NOT include information on childcare programs from previous years.
-
-Page URL: {page.page_url}
-Page Title: {page.page_title if page.page_title else ""}
-Page Description:  {page.description if page.description else ""}
-Page Markdown: {page.markdown}
-"""
-
-    if prompt_version == "v1":
-        prompt = prompt_v1
-    elif prompt_version == "v2":
-        prompt = prompt_v2
-    elif prompt_version == "v3":
-        prompt = prompt_v3
-    else:
-        raise ValueError(f"Invalid prompt version: {prompt_version}")
+PROMPT_STAGE = "page_extraction"
 
-    tokenizer = tiktoken.encoding_for_model(model)
-    n_tokens = len(tokenizer.encode(dedent(prompt)))
-    if n_tokens > 100_000:
-        raise TokenLimitExceededException(f"Document too long: {n_tokens} tokens")
 
-    completion = openai_client.beta.chat.completions.parse(
-        model=model,
-        messages=[
-            {"role": "system", "content": "You are an AI expert tasked with understanding elementary and high school websites."},
-            {"role": "user", "content": dedent(prompt)} 
-        ],
-        response_format=CrawlerOpenAIResponse
+def render_prompt(page: CrawledPage, prompt_version="v1", markdown: str | None = None) -> str:
+    return get_prompt(PROMPT_STAGE, prompt_version).render(
+        page_url=page.page_url,
+        page_title=page.page_title if page.page_title else "",
+        description=page.description if page.description else "",
+        # leave out the nav/footer/sidebar that's repeated on every page of the site.  oversized
+        # pages are sent a window of the markdown at a time, see cps_childcare/chunked_extraction.py
+        page_markdown=markdown if markdown is not None else content_markdown(page),
     )
 
-    response = CrawlerOpenAIResponse.model_validate_json(completion.choices[0].message.content)
-    
+
+def prompt_messages(prompt: str, prompt_version="v1") -> list[dict]:
+    return get_prompt(PROMPT_STAGE, prompt_version).messages(prompt)
+
+
+def to_record(page: CrawledPage, response: CrawlerOpenAIResponse, model: str, prompt_version: str) -> CrawlerOpenAIRecord:
     record_data = {
         "school_id": page.school_id,
         "school_type": page.school_type,
@@ -202,21 +67,165 @@ Page Markdown: {page.markdown}
 
     return CrawlerOpenAIRecord.model_validate(record_data)
 
-client = OpenAI(api_key=os.getenv("CPS_OPENAI_API_KEY"))
+
+async def extract_markdown_async(openai_client: AsyncOpenAI, limiter: RateLimiter, page: CrawledPage, markdown: str,
+                                 model: str, prompt_version: str, cache: LLMCache | None = None) -> CrawlerOpenAIResponse:
+    prompt = render_prompt(page, prompt_version, markdown=markdown)
+    cache_key = (markdown, prompt_messages(prompt, prompt_version), model, CrawlerOpenAIResponse)
+    if cache is not None and (response := await asyncio.to_thread(cache.get, *cache_key)) is not None:
+        return response
+
+    # the limiter counts the response too, which is never more than a few hundred tokens
+    await limiter.acquire(estimate_tokens(prompt) + MAX_RESPONSE_TOKENS)
+    raw_response = await openai_client.beta.chat.completions.with_raw_response.parse(
+        model=model,
+        messages=prompt_messages(prompt, prompt_version),
+        response_format=CrawlerOpenAIResponse
+    )
+    limiter.update_from_headers(raw_response.headers)
+    completion = raw_response.parse()
+
+    response = CrawlerOpenAIResponse.model_validate_json(completion.choices[0].message.content)
+    if cache is not None:
+        await asyncio.to_thread(cache.put, *cache_key, response)
+    return response
+
+
+async def call_openai_async(openai_client: AsyncOpenAI, limiter: RateLimiter, page: CrawledPage,
+                            model="gpt-4o-mini", prompt_version="v1", cache: LLMCache | None = None):
+    markdown = content_markdown(page)
+    if prompt_fits(render_prompt(page, prompt_version, markdown=markdown), model):
+        response = await extract_markdown_async(openai_client, limiter, page, markdown, model, prompt_version, cache)
+    else:
+        # the windows all go through the limiter like any other request
+        windows = await asyncio.to_thread(split_markdown, markdown, model)
+        responses = await asyncio.gather(*(
+            extract_markdown_async(openai_client, limiter, page, window, model, prompt_version, cache)
+            for window in windows
+        ))
+        response = merge_crawler_responses(responses)
+    return to_record(page, response, model, prompt_version)
+
+
+async def extract_pages(pages: Iterable[CrawledPage], model: str, prompt_version: str, writer: RecordWriter,
+                        cache: LLMCache | None = None):
+    # the runner does its own retrying so that rate limits are seen by the limiter
+    client = AsyncOpenAI(api_key=os.getenv("CPS_OPENAI_API_KEY"), max_retries=0)
+    limiter = RateLimiter(requests_per_minute=REQUESTS_PER_MINUTE, tokens_per_minute=TOKENS_PER_MINUTE)
+    runner = OpenAIRunner(limiter, max_in_flight=MAX_IN_FLIGHT)
+
+    await runner.run(
+        pages,
+        lambda page: call_openai_async(client, limiter, page, model=model, prompt_version=prompt_version, cache=cache),
+        on_result=writer.put,
+        describe=lambda page: page.page_url,
+    )
+    await client.close()
+
+
+BATCH_STAGE = "page_extraction"
+
+
+def save_cached_results(pages: Iterable[CrawledPage], model: str, prompt_version: str, cache: LLMCache, writer: RecordWriter):
+    """Save the records for pages whose responses are already cached and yield the rest."""
+    for page in pages:
+        prompt = render_prompt(page, prompt_version)
+        response = cache.get(content_markdown(page), prompt_messages(prompt, prompt_version), model, CrawlerOpenAIResponse)
+        if response is None:
+            yield page
+        else:
+            writer.put(to_record(page, response, model, prompt_version))
+
+
+def batch_requests(pages: Iterable[CrawledPage], model: str, prompt_version: str):
+    for page in pages:
+        prompt = render_prompt(page, prompt_version)
+        if not prompt_fits(prompt, model):
+            # these get extracted a window at a time without --batch
+            print(f"Skipping {page.page_url}: too long for one prompt, run without --batch to extract it")
+            continue
+        yield page.id, batch_request_line(BATCH_STAGE, page.id, model, prompt_messages(prompt, prompt_version), CrawlerOpenAIResponse)
+
+
+def batch_result_to_record(page: CrawledPage, content: str, model: str, prompt_version: str,
+                           cache: LLMCache | None = None) -> CrawlerOpenAIRecord:
+    response = CrawlerOpenAIResponse.model_validate_json(content)
+    if cache is not None:
+        prompt = render_prompt(page, prompt_version)
+        cache.put(content_markdown(page), prompt_messages(prompt, prompt_version), model, CrawlerOpenAIResponse, response)
+    return to_record(page, response, model, prompt_version)
+
 
 MODEL = "gpt-4o-mini" # gpt-4o-2024-08-06
 PROMPT_VERSION = "v1"
-pages = get_pages(model_name=MODEL, prompt_version=PROMPT_VERSION, evals=False)
-random.shuffle(pages)
-
-print(f"Processing {len(pages)} pages...")
-for page in pages:
-    print(f"Processing {page.page_url}")
-    try:
-        record = call_openai(client, page, model=MODEL, prompt_version=PROMPT_VERSION)
-        with Session(engine) as session:
-            session.add(record)
-            session.commit()
-    except Exception as e:
-        print(f"Error processing {page.page_url}: {e}")
-        continue
+# the starting limits, they get adjusted to whatever the rate limit headers say
+REQUESTS_PER_MINUTE = int(os.getenv("OPENAI_REQUESTS_PER_MINUTE", 500))
+TOKENS_PER_MINUTE = int(os.getenv("OPENAI_TOKENS_PER_MINUTE", 200_000))
+MAX_IN_FLIGHT = int(os.getenv("OPENAI_MAX_IN_FLIGHT", 32))
+MAX_RESPONSE_TOKENS = 500
+# the share of the eval pages with care details that the pre-filter has to keep
+RELEVANCE_RECALL = float(os.getenv("RELEVANCE_RECALL", DEFAULT_RECALL))
+RELEVANCE_EMBEDDINGS = os.getenv("RELEVANCE_EMBEDDINGS", "0") == "1"
+
+parser = argparse.ArgumentParser(description="Extract emails and before/after care details from each crawled page.")
+parser.add_argument("--batch", action="store_true",
+                    help="save any finished OpenAI batches and submit the remaining pages as new batches")
+parser.add_argument("--no-prefilter", action="store_true",
+                    help="send every page to the LLM, not just the ones the relevance pre-filter keeps")
+args = parser.parse_args()
+
+n_unhashed = count_unhashed_pages(engine)
+if n_unhashed:
+    print(f"{n_unhashed} pages don't have a content hash yet, so their results would be redone on every run.  "
+          "Run `python -m cps_childcare.dedup` to backfill them first.")
+    sys.exit(1)
+
+# pages whose content, prompt, model and response schema haven't changed reuse their old responses
+cache = LLMCache(engine)
+
+if args.batch:
+    batch_client = OpenAI(api_key=os.getenv("CPS_OPENAI_API_KEY"))
+    n_running = ingest_batches(batch_client, engine, BATCH_STAGE, partial(batch_result_to_record, cache=cache))
+
+page_ids = get_page_ids(model_name=MODEL, prompt_version=PROMPT_VERSION, evals=False)
+if args.batch:
+    in_flight = in_flight_record_ids(engine, BATCH_STAGE)
+    page_ids = [page_id for page_id in page_ids if page_id not in in_flight]
+# shuffle the ids rather than the pages, nothing is loaded until it's about to be sent
+random.shuffle(page_ids)
+pages = iter_pages(engine, page_ids)
+
+if not args.no_prefilter:
+    # skip the pages that can't be about before/after care.  they don't get a record, so they're
+    # picked back up if the threshold changes, but it also means their emails and is_contact_page
+    # never get extracted.  nothing downstream reads those yet, use --no-prefilter if something does.
+    scorer = RelevanceScorer(use_embeddings=RELEVANCE_EMBEDDINGS)
+    threshold = calibrate(engine, scorer, recall=RELEVANCE_RECALL)
+    pages = filter_pages(pages, scorer, threshold)
+
+# every record gets written by this, in batches
+with RecordWriter(engine) as writer:
+    if args.batch:
+        pages = save_cached_results(pages, MODEL, PROMPT_VERSION, cache, writer)
+        print(f"Submitting up to {len(page_ids)} pages in batches ({n_running} batches still running)...")
+        n_running += len(submit_batches(batch_client, engine, BATCH_STAGE, MODEL, PROMPT_VERSION,
+                                        batch_requests(pages, MODEL, PROMPT_VERSION)))
+    else:
+        print(f"Processing up to {len(page_ids)} pages...")
+        asyncio.run(extract_pages(pages, MODEL, PROMPT_VERSION, writer, cache=cache))
+print(f"Saved {writer.n_written} records")
+if not args.no_prefilter:
+    n_filtered = scorer.stats["scored"] - scorer.stats["kept"]
+    print(f"The relevance pre-filter kept {scorer.stats['kept']}/{scorer.stats['scored']} pages, "
+          f"{n_filtered} pages were skipped without extracting their emails or contact page flag")
+print(cache.summary())
+
+# copy each near-duplicate cluster's results out to the rest of its pages
+with Session(engine) as session:
+    n_fanned_out = fan_out_page_results(session, CrawlerOpenAIRecord, openai_model_name=MODEL, prompt_version=PROMPT_VERSION)
+    session.commit()
+print(f"Copied results to {n_fanned_out} near-duplicate pages")
+
+if args.batch and n_running:
+    print(f"{n_running} batches are still running, run this again once they're done to save their results")
+    sys.exit(PENDING_EXIT_CODE)
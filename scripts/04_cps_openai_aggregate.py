@@ -1,94 +1,150 @@
+import argparse
 import os
-from textwrap import dedent
+import sys
+from functools import partial
+from typing import Iterable
 
 from openai import OpenAI
-from sqlalchemy import text
-from sqlmodel import select, Session
+from sqlmodel import Session
 
+from cps_childcare.boilerplate import content_markdown
+from cps_childcare.chunked_extraction import extract_windows, merge_childcare_responses, prompt_fits, split_markdown
+from cps_childcare.content_store import CrawledPage
 from cps_childcare.cps_data_models import (ChildcareOpenAIRecord, ChildcareOpenAIResponse,
     CitationSnippet, CombinedChildcareOpenAIRecord, CombinedChildcareOpenAIResponse, CrawlerRecord)
 from cps_childcare.database import engine
-
-
-def extract_care_page_details(client, page: CrawlerRecord, model="gpt-4o-mini", prompt_version="v1"):
-    prompt_v1 = f"""
-    Here is an elementary school webpage. If present, extract information about before and after school child care.
-    Follow these rules:
-    - We ONLY care about before or after care CHILDCARE programs, not general instructions about what students are supposed to do before and after school, or about summer programs, or about sports.
-    - Don't include info on summer camps or day camps.
-    - Sometimes these programs are called "OST", "Out of School Time", or "Right at School" programs.
-    - For the fields "before_care_quote_snippet" and "after_care_quote_snippet", return the EXACT QUOTED TEXT from the webpage "Content" that is the most relevant snippet to your answer.  DO NOT CHANGE ANY WORDS.
-
-    ## Webpage
-    #URL:
-    {page.page_url}
-    #Description:
-    {page.page_title}
-    #Content to Quote From:
-    "{page.markdown}"
-
-    ## Answer:
-    """
+from cps_childcare.dependency_executor import DependencyExecutor
+from cps_childcare.llm_cache import LLMCache
+from cps_childcare.openai_batch import (PENDING_EXIT_CODE, batch_request_line, in_flight_record_ids, ingest_batches,
+                                       submit_batches)
+from cps_childcare.prompts import get_prompt
+from cps_childcare.lineage import schools_to_combine
+from cps_childcare.queries import (care_pages_to_extract_query, count_unhashed_pages, iter_pages, load_extracted_pages,
+                                   load_page_ids)
+from cps_childcare.record_writer import RecordWriter
+from cps_childcare.retrieval import ChunkRetriever
+from cps_childcare.snippets import verify_snippet
+
+
+def render_care_prompt(page: CrawledPage, prompt_version="v1", markdown: str | None = None) -> str:
+    return get_prompt("care_details", prompt_version).render(
+        page_url=page.page_url,
+        page_title=page.page_title,
+        # oversized pages are sent a window of the markdown at a time
+        page_markdown=markdown if markdown is not None else content_markdown(page),
+    )
+
+
+def care_prompt_messages(prompt: str, prompt_version="v1") -> list[dict]:
+    return get_prompt("care_details", prompt_version).messages(prompt)
+
+
+def extract_care_markdown(client, page: CrawledPage, markdown: str, model: str, prompt_version: str,
+                          cache: LLMCache | None = None) -> ChildcareOpenAIResponse:
+    messages = care_prompt_messages(render_care_prompt(page, prompt_version, markdown=markdown), prompt_version)
+    cache_key = (markdown, messages, model, ChildcareOpenAIResponse)
+    if cache is not None and (response := cache.get(*cache_key, temperature=0.0)) is not None:
+        return response
 
     completion = client.beta.chat.completions.parse(
             model=model,
-            messages=[
-                {"role": "system", "content": "You are an AI expert tasked with understanding elementary school websites."},
-                {"role": "user", "content": prompt_v1}
-            ],
+            messages=messages,
             temperature=0.0,
             response_format=ChildcareOpenAIResponse
         )
 
-    return ChildcareOpenAIResponse.model_validate_json(completion.choices[0].message.content)
-
-
-def combine_care_page_details(client, school_id, model="gpt-4o-mini", prompt_version="v2"):
-    school_pages = get_all_school_extracted_pages(school_id)
-    school_pages = list(filter(is_current_page, school_pages))
+    response = ChildcareOpenAIResponse.model_validate_json(completion.choices[0].message.content)
+    if cache is not None:
+        cache.put(*cache_key, response, temperature=0.0)
+    return response
 
-    if len(school_pages) == 0:
-        return None
 
-    prompt_v2 = """
-    Here is a numbered list of json objects extracted from webpages about a single elementary school.  Use the
-    information to synthesize a single, high quality overview of the school's before and after school child care program.
-    - Prefer pages where the "before_care_quote_snippet_verified" and "after_care_quote_snippet_verified" fields are True over ones where they are False.
-    - If there are multiple pages that contain the same information, prefer the one with the highest quality "before_care_quote_snippet_verified" and "after_care_quote_snippet_verified" fields.
-    - If there are multiple pages that contain the same information, prefer the one with the most recent "webpage_year" field.
-    - You MUST cite your sources by listing the source number in "before_care_citations" and "after_care_citations".
+def extract_care_page_details(client, page: CrawledPage, model="gpt-4o-mini", prompt_version="v1",
+                              cache: LLMCache | None = None):
+    markdown = content_markdown(page)
+    if prompt_fits(render_care_prompt(page, prompt_version, markdown=markdown), model):
+        return extract_care_markdown(client, page, markdown, model, prompt_version, cache)
 
-    ## Webpages
-    """
+    # too big for one prompt, so extract it a window at a time and merge the results
+    responses = extract_windows(
+        lambda window: extract_care_markdown(client, page, window, model, prompt_version, cache),
+        split_markdown(markdown, model),
+    )
+    return merge_childcare_responses(responses)
 
-    context_fields = ["page_url", "webpage_year",
-                      "provides_before_care", "before_care_start_time", "before_care_provider", "before_care_quote_snippet", "before_care_quote_snippet_verified",
-                      "provides_after_care", "after_care_end_time", "after_care_provider", "after_care_quote_snippet", "after_care_quote_snippet_verified"]
-    context = ""
-    citation_urls = []
-    citation_before_care_snippets = []
-    citation_after_care_snippets = []
-    for num, page in enumerate(school_pages):
-        context_dict = {field: getattr(page, field) for field in context_fields}
-        context += f"[{num}] {context_dict}\n\n"
-        citation_urls.append(page.page_url)
-        citation_before_care_snippets.append(page.before_care_quote_snippet)
-        citation_after_care_snippets.append(page.after_care_quote_snippet)
 
-    full_prompt = dedent(prompt_v2) + context + "\n\n## Answer:"
+def to_care_record(page: CrawledPage, extracted: ChildcareOpenAIResponse, model: str, prompt_version: str) -> ChildcareOpenAIRecord:
+    result = {
+        "school_id": page.school_id,
+        "page_url": page.page_url,
+        "openai_model_name": model,
+        "prompt_version": prompt_version,
+        **extracted.model_dump(),
+        # tolerant of whitespace, punctuation and markdown differences, see cps_childcare/snippets.py
+        "before_care_quote_snippet_verified": verify_snippet(page.markdown, extracted.before_care_quote_snippet),
+        "after_care_quote_snippet_verified": verify_snippet(page.markdown, extracted.after_care_quote_snippet),
+    }
+    return ChildcareOpenAIRecord.model_validate(result)
+
+
+BATCH_STAGE = "care_details"
+
+
+def save_cached_results(pages: Iterable[CrawledPage], model: str, prompt_version: str, cache: LLMCache, writer: RecordWriter):
+    """Save the records for pages whose responses are already cached and yield the rest."""
+    for page in pages:
+        messages = care_prompt_messages(render_care_prompt(page, prompt_version), prompt_version)
+        response = cache.get(content_markdown(page), messages, model, ChildcareOpenAIResponse, temperature=0.0)
+        if response is None:
+            yield page
+        else:
+            writer.put(to_care_record(page, response, model, prompt_version))
+
+
+def batch_requests(pages: Iterable[CrawledPage], model: str, prompt_version: str):
+    for page in pages:
+        prompt = render_care_prompt(page, prompt_version)
+        if not prompt_fits(prompt, model):
+            # these get extracted a window at a time without --batch
+            print(f"Skipping {page.page_url}: too long for one prompt, run without --batch to extract it")
+            continue
+        messages = care_prompt_messages(prompt, prompt_version)
+        yield page.id, batch_request_line(BATCH_STAGE, page.id, model, messages,
+                                          ChildcareOpenAIResponse, temperature=0.0)
+
+
+def batch_result_to_record(page: CrawledPage, content: str, model: str, prompt_version: str,
+                           cache: LLMCache | None = None) -> ChildcareOpenAIRecord:
+    response = ChildcareOpenAIResponse.model_validate_json(content)
+    if cache is not None:
+        messages = care_prompt_messages(render_care_prompt(page, prompt_version), prompt_version)
+        cache.put(content_markdown(page), messages, model, ChildcareOpenAIResponse, response, temperature=0.0)
+    return to_care_record(page, response, model, prompt_version)
+
+
+def call_combine(client, context: str, model: str, prompt_version: str, cache: LLMCache | None = None):
+    prompt = get_prompt("combine", prompt_version)
+    messages = prompt.messages(prompt.render(context=context))
+
+    # the extracted page details (or retrieved chunks) are the content here
+    cache_key = (context, messages, model, CombinedChildcareOpenAIResponse)
+    response = cache.get(*cache_key) if cache is not None else None
+    if response is None:
+        completion = client.beta.chat.completions.parse(
+                model=model,
+                messages=messages,
+                #temperature=0.0,
+                response_format=CombinedChildcareOpenAIResponse
+            )
 
-    completion = client.beta.chat.completions.parse(
-            model=model,
-            messages=[
-                {"role": "system", "content": "You are an AI expert tasked with understanding elementary and high school websites."},
-                {"role": "user", "content": full_prompt}
-            ],
-            #temperature=0.0,
-            response_format=CombinedChildcareOpenAIResponse
-        )
+        response = CombinedChildcareOpenAIResponse.model_validate_json(completion.choices[0].message.content)
+        if cache is not None:
+            cache.put(*cache_key, response)
+    return response
 
-    response = CombinedChildcareOpenAIResponse.model_validate_json(completion.choices[0].message.content)
 
+def add_citation_snippets(response: CombinedChildcareOpenAIResponse, citation_urls: list[str],
+                          citation_before_care_snippets: list, citation_after_care_snippets: list):
     # go from citation number to citation text to make sure it's exact
     # instead of trusting what gpt returns here (we trust the numbers though)
     response.before_care_citation_snippets = []
@@ -114,68 +170,81 @@ def combine_care_page_details(client, school_id, model="gpt-4o-mini", prompt_ver
     return response
 
 
-def get_pages_to_extract():
-    with Session(engine) as session:
-        # only get pages that haven't been extracted yet
-        query = text(
-        f"""
-        WITH crawler_records_by_model AS (
-            SELECT *,
-                row_number() OVER (PARTITION BY school_id, page_url, openai_model_name, prompt_version ORDER BY created_at DESC) AS row
-            FROM crawleropenairecord
-        )
+def combine_care_page_details(client, school_id, model="gpt-4o-mini", prompt_version="v2", cache: LLMCache | None = None,
+                              school_pages: list[ChildcareOpenAIRecord] | None = None):
+    if school_pages is None:
+        school_pages = get_all_school_extracted_pages([school_id])[school_id]
+    # a page that was extracted again this run replaces its older record
+    school_pages = list({page.page_url: page for page in school_pages}.values())
+    school_pages = [page for page in school_pages if provides_care(page) and is_current_page(page)]
+
+    if len(school_pages) == 0:
+        return None
+
+    context_fields = ["page_url", "webpage_year",
+                      "provides_before_care", "before_care_start_time", "before_care_provider", "before_care_quote_snippet", "before_care_quote_snippet_verified",
+                      "provides_after_care", "after_care_end_time", "after_care_provider", "after_care_quote_snippet", "after_care_quote_snippet_verified"]
+    context = ""
+    citation_urls = []
+    citation_before_care_snippets = []
+    citation_after_care_snippets = []
+    for num, page in enumerate(school_pages):
+        context_dict = {field: getattr(page, field) for field in context_fields}
+        context += f"[{num}] {context_dict}\n\n"
+        citation_urls.append(page.page_url)
+        citation_before_care_snippets.append(page.before_care_quote_snippet)
+        citation_after_care_snippets.append(page.after_care_quote_snippet)
+
+    response = call_combine(client, context, model, prompt_version, cache)
+    return add_citation_snippets(response, citation_urls, citation_before_care_snippets, citation_after_care_snippets)
+
+
+def combine_school_chunks(client, school_id, model="gpt-4o-mini", prompt_version="v3", cache: LLMCache | None = None,
+                          retriever: ChunkRetriever | None = None):
+    chunks = retriever.retrieve(school_id)
+
+    if len(chunks) == 0:
+        return None
+
+    context = "".join(f"[{num}] {chunk.page_url}\n{chunk.text}\n\n" for num, chunk in enumerate(chunks))
+    citation_urls = [chunk.page_url for chunk in chunks]
+    # the chunk is the snippet for both kinds of care
+    citation_snippets = [chunk.text for chunk in chunks]
+
+    response = call_combine(client, context, model, prompt_version, cache)
+    return add_citation_snippets(response, citation_urls, citation_snippets, citation_snippets)
 
-        SELECT cr.*
-        FROM crawler_records_by_model o
-        JOIN crawlerrecord cr
-            ON o.school_id = cr.school_id
-            AND o.page_url = cr.page_url
-        LEFT JOIN childcareopenairecord co
-            ON o.school_id = co.school_id
-            AND o.page_url = co.page_url
-        WHERE row = 1
-            AND o.openai_model_name = 'gpt-4o-mini'
-            AND o.prompt_version = 'v1'
-            AND o.before_or_after_care_details != ''
-            AND co.id IS NULL
-        """
-        )
-        result = session.exec(query)
-        pages = result.fetchall()
-        pages = [CrawlerRecord.model_validate(page) for page in pages]
 
-    return list(pages)
+def get_page_ids_to_extract():
+    # only get pages that haven't been extracted yet, or have changed since.  just the ids, the pages get streamed
+    # with iter_pages.  they're grouped by school so that each school can be combined as soon as its pages are done.
+    # near-duplicates only get their representative extracted, and unlike 03 the results aren't fanned out to the
+    # other pages in the cluster: the combine step only reads ChildcareOpenAIRecord, and copies would just repeat
+    # the same care details in its context.
+    query = care_pages_to_extract_query("gpt-4o-mini", "v1", PROMPT_VERSION,
+                                        columns=(CrawlerRecord.id, CrawlerRecord.school_id))
+    return load_page_ids(engine, query.order_by(CrawlerRecord.school_id, CrawlerRecord.id))
 
 
-# get the schools we haven't combined yet
+# get the schools we haven't combined yet, or whose pages have changed since we did
 def get_schools_to_combine(prompt_version="v2"):
     with Session(engine) as session:
-        query = select(ChildcareOpenAIRecord.school_id).distinct()
-        result = session.exec(query)
-        all_schools = result.fetchall()
+        return schools_to_combine(session, MODEL, prompt_version)
 
-        query = (select(CombinedChildcareOpenAIRecord.school_id)
-                 .where(CombinedChildcareOpenAIRecord.prompt_version == prompt_version)
-                ).distinct()
-        result = session.exec(query)
-        combined_schools = result.fetchall()
 
-    schools_remaining = set(all_schools).difference(set(combined_schools))
-
-    return schools_remaining
+# in retrieval mode every crawled school gets combined, whether or not its pages were extracted
+def get_crawled_schools_to_combine(prompt_version="v3"):
+    with Session(engine) as session:
+        return schools_to_combine(session, MODEL, prompt_version, source=CrawlerRecord)
 
 
-def get_all_school_extracted_pages(school_id):
+def get_all_school_extracted_pages(school_ids) -> dict[int, list[ChildcareOpenAIRecord]]:
     with Session(engine) as session:
-        query = (select(ChildcareOpenAIRecord)
-                 .where(ChildcareOpenAIRecord.school_id == school_id)
-                 .where((ChildcareOpenAIRecord.provides_before_care == True) |
-                        (ChildcareOpenAIRecord.provides_after_care == True)))
-        result = session.exec(query)
-        pages = result.fetchall()
-        pages = [ChildcareOpenAIRecord.model_validate(page) for page in pages]
+        return load_extracted_pages(session, school_ids)
+
 
-    return pages
+def provides_care(page: ChildcareOpenAIRecord) -> bool:
+    return bool(page.provides_before_care or page.provides_after_care)
 
 
 # returns true if the page is from the current school year
@@ -201,69 +270,135 @@ def is_current_page(page: ChildcareOpenAIRecord) -> bool:
     return True
 
 
-client = OpenAI(api_key=os.getenv("CPS_OPENAI_API_KEY"))
-
-pages = get_pages_to_extract()
-print(f"Sending {len(pages)} pages to OpenAI...")
-
-MODEL = "gpt-4o-mini"
-PROMPT_VERSION = "v1"
-
-for page_num, page in enumerate(pages):
-    extracted = extract_care_page_details(client, page, model=MODEL)
+def extract_page(page: CrawledPage, writer: RecordWriter) -> ChildcareOpenAIRecord:
+    extracted = extract_care_page_details(client, page, model=MODEL, prompt_version=PROMPT_VERSION, cache=cache)
+    record = to_care_record(page, extracted, MODEL, PROMPT_VERSION)
+    writer.put(record)
 
-    before_care_quote_snippet_verified, after_care_quote_snippet_verified = None, None
+    print(f"{page.page_url}")
+    print(record)
+    return record
 
-    cleaned_markdown = page.markdown.replace("\n", "").replace(" ", "")
 
-    if extracted.before_care_quote_snippet:
-        cleaned_before_care_quote_snippet = extracted.before_care_quote_snippet.replace("\n", "").replace(" ", "")
-        before_care_quote_snippet_verified = cleaned_before_care_quote_snippet in cleaned_markdown
-    if extracted.after_care_quote_snippet:
-        cleaned_after_care_quote_snippet = extracted.after_care_quote_snippet.replace("\n", "").replace(" ", "")
-        after_care_quote_snippet_verified = cleaned_after_care_quote_snippet in cleaned_markdown
-
-    result = {
-        "school_id": page.school_id,
-        "page_url": page.page_url,
-        "openai_model_name": MODEL,
-        "prompt_version": PROMPT_VERSION,
-        **extracted.model_dump(),
-        "before_care_quote_snippet_verified": before_care_quote_snippet_verified,
-        "after_care_quote_snippet_verified": after_care_quote_snippet_verified,
-    }
-
-    with Session(engine) as session:
-        session.add(ChildcareOpenAIRecord.model_validate(result))
-        session.commit()
-
-    print(f"{page_num} / {len(pages)}: {page.page_url}")
-    print(result)
-
-
-school_ids = get_schools_to_combine()
-print(f"Combining data for {len(school_ids)} schools...")
-
-MODEL = "gpt-4o-mini"
-PROMPT_VERSION = "v2"
-
-for num, school_id in enumerate(school_ids):
-    combined = combine_care_page_details(client, school_id, model=MODEL, prompt_version=PROMPT_VERSION)
+def combine_school(school_id, combine, writer: RecordWriter, school_pages: list | None = None, extractions=()):
+    kwargs = {}
+    if school_pages is not None:
+        # the records extracted this run are handed over in memory, so the combine doesn't have to wait
+        # for the writer or go back to the database for them
+        kwargs["school_pages"] = school_pages + [future.result() for future in extractions
+                                                 if future.exception() is None]
+    combined = combine(client, school_id, model=MODEL, prompt_version=COMBINE_PROMPT_VERSION, cache=cache, **kwargs)
 
     if combined is None:
         print(f"No pages to combine for school {school_id}")
-        continue
+        return
 
     result = {
         "school_id": school_id,
         "openai_model_name": MODEL,
-        "prompt_version": PROMPT_VERSION,
+        "prompt_version": COMBINE_PROMPT_VERSION,
         **combined.model_dump(),
     }
+    writer.put(CombinedChildcareOpenAIRecord.model_validate(result))
 
-    with Session(engine) as session:
-        session.add(CombinedChildcareOpenAIRecord.model_validate(result))
-        session.commit()
+    print(f"Combined school {school_id}")
+    print(result)
 
-    print(f"{num} / {len(school_ids)}: {school_id}")
-    print(result)
\ No newline at end of file
+
+def extract_and_combine(pages: Iterable[CrawledPage], school_ids: set, combine, writer: RecordWriter,
+                        extracted_pages: dict | None = None):
+    """
+    Extract the pages concurrently and start each school's combine as soon as all of that school's
+    pages are done.  `pages` has to be grouped by school.  If `extracted_pages` is given (the school's
+    records already in the database, from `get_all_school_extracted_pages`), each combine gets those
+    plus the school's new records instead of loading them itself.
+    """
+    def submit_combine(school_id, school_futures=()):
+        school_pages = None if extracted_pages is None else extracted_pages.get(school_id, [])
+        executor.submit(combine_school, school_id, combine, writer, school_pages, school_futures, after=school_futures)
+        school_ids.discard(school_id)
+
+    with DependencyExecutor(max_workers=MAX_WORKERS) as executor:
+        current_school, school_futures = None, []
+        for page in pages:
+            if page.school_id != current_school:
+                if current_school is not None:
+                    submit_combine(current_school, school_futures)
+                current_school, school_futures = page.school_id, []
+            school_futures.append(executor.submit(extract_page, page, writer))
+        if current_school is not None:
+            submit_combine(current_school, school_futures)
+
+        # and the schools that didn't have any pages left to extract
+        for school_id in list(school_ids):
+            submit_combine(school_id)
+    print(f"{executor.n_done} pages and schools done, {executor.n_failed} failed")
+
+
+parser = argparse.ArgumentParser(description="Extract before/after care details from each page and combine them per school.")
+mode = parser.add_mutually_exclusive_group()
+mode.add_argument("--batch", action="store_true",
+                  help="save any finished OpenAI batches and submit the remaining pages as new batches")
+mode.add_argument("--retrieval", action="store_true",
+                  help="skip the page extraction and combine each school from its top chunks in the LanceDB index")
+args = parser.parse_args()
+
+n_unhashed = count_unhashed_pages(engine)
+if n_unhashed:
+    print(f"{n_unhashed} pages don't have a content hash yet, so their results would be redone on every run.  "
+          "Run `python -m cps_childcare.dedup` to backfill them first.")
+    sys.exit(1)
+
+client = OpenAI(api_key=os.getenv("CPS_OPENAI_API_KEY"))
+
+MODEL = "gpt-4o-mini"
+PROMPT_VERSION = "v1"
+COMBINE_PROMPT_VERSION = "v3" if args.retrieval else "v2"
+# how many pages and schools are sent to OpenAI at once
+MAX_WORKERS = int(os.getenv("OPENAI_MAX_IN_FLIGHT", 16))
+
+# pages and schools whose inputs, prompt, model and response schema haven't changed reuse their old responses
+cache = LLMCache(engine)
+
+if args.batch:
+    n_running = ingest_batches(client, engine, BATCH_STAGE, partial(batch_result_to_record, cache=cache))
+
+# in retrieval mode the schools are combined straight from their chunks, so no pages get extracted
+pending = [] if args.retrieval else get_page_ids_to_extract()
+if args.batch:
+    in_flight = in_flight_record_ids(engine, BATCH_STAGE)
+    pending = [row for row in pending if row.id not in in_flight]
+pages = iter_pages(engine, [row.id for row in pending])
+
+# the records are written in batches
+with RecordWriter(engine) as writer:
+    if args.batch:
+        pages = save_cached_results(pages, MODEL, PROMPT_VERSION, cache, writer)
+        print(f"Submitting up to {len(pending)} pages in batches...")
+        n_running += len(submit_batches(client, engine, BATCH_STAGE, MODEL, PROMPT_VERSION, batch_requests(pages, MODEL, PROMPT_VERSION)))
+        if n_running:
+            # combining has to wait until every page has been extracted
+            print(f"{n_running} batches are still running, run this again once they're done to combine the schools")
+            print(cache.summary())
+            sys.exit(PENDING_EXIT_CODE)
+    else:
+        print(f"Sending {len(pending)} pages to OpenAI...")
+
+    if args.retrieval:
+        school_ids = get_crawled_schools_to_combine(COMBINE_PROMPT_VERSION)
+        combine = partial(combine_school_chunks, retriever=ChunkRetriever())
+        extracted_pages = None
+    else:
+        # the schools with pages still to extract get combined once they're done
+        school_ids = get_schools_to_combine(COMBINE_PROMPT_VERSION) | {row.school_id for row in pending}
+        combine = combine_care_page_details
+        # load every school's existing page records in one go (the cached batch results included),
+        # the ones extracted below get passed to the combines as they finish
+        writer.flush()
+        extracted_pages = get_all_school_extracted_pages(school_ids)
+    print(f"Combining data for {len(school_ids)} schools...")
+
+    # in batch mode everything has been submitted by now, so there are no pages left to send directly
+    extract_and_combine(pages, set(school_ids), combine, writer, extracted_pages)
+
+print(cache.summary())
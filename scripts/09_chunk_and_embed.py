@@ -10,17 +10,12 @@ from llama_index.embeddings.text_embeddings_inference import TextEmbeddingsInfer
 from llama_index.vector_stores.lancedb import LanceDBVectorStore
 from sqlmodel import Session, select, text
 
+from cps_childcare.boilerplate import content_markdown
+from cps_childcare.content_store import has_markdown, load_pages
 from cps_childcare.database import engine
 from cps_childcare.cps_data_models import CrawlerRecord, WebPageChunk
 
 
-class EmbeddedImageCleaner(TransformComponent):
-    def __call__(self, nodes, **kwargs):
-        for node in nodes:
-            node.text = re.sub(r'data:image/([^;]*);base64,[^"]*', r'data:image/\1;base64)', node.text)
-        return nodes
-
-
 class HeaderPathCleaner(TransformComponent):
     max_header_length: int = 100
 
@@ -74,7 +69,6 @@ if __name__ == "__main__":
 
     pipeline = IngestionPipeline(
         transformations=[
-            EmbeddedImageCleaner(),
             MarkdownNodeParser(),
             HeaderPathCleaner(max_header_length=CHUNK_SIZE // 3),
             SentenceSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP),
@@ -87,17 +81,24 @@ if __name__ == "__main__":
         pages= session.exec(
             select(CrawlerRecord)
             .where(CrawlerRecord.status_code == 200)
-            .where(CrawlerRecord.markdown != None)
+            .where(has_markdown())
+            .where(CrawlerRecord.duplicate_of_id == None)
             .order_by(CrawlerRecord.id)
         ).all()
+        pages = load_pages(session, pages)
 
+        # embed the pages without the nav/footer/sidebar that's repeated across each site
         docs = [Document(
-                text=page.markdown,
+                text=content_markdown(page),
                 metadata={
+                    "school_id": page.school_id,
                     "school_name": page.school_name.title(),
                     "page_url": page.page_url,
                     "page_title": clean_page_title(page.page_title),
-                }
+                },
+                # school_id is only there to filter on, see cps_childcare/retrieval.py
+                excluded_embed_metadata_keys=["school_id"],
+                excluded_llm_metadata_keys=["school_id"],
             ) for page in pages
         ]
 
@@ -143,3 +144,6 @@ if __name__ == "__main__":
 
         #     if page_num > 10:
         #         break
+
+    # the keyword half of the hybrid search in cps_childcare/retrieval.py
+    vector_db.open_table(TABLE_NAME).create_fts_index("text", replace=True)